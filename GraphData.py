@@ -0,0 +1,287 @@
+import numpy
+
+"""
+Graph Data:
+
+sample storage for GraphFrame, kept apart from matplotlib so it can be used
+(and benchmarked) without a display.
+
+GraphHistory keeps every sample of the flight, with its time: fltTime for
+radio telemetry (unwrapped by GraphClock, see FLT_TIME_RESOLUTION) or time
+for SD-card logs. MessageBatch columns are appended a whole column at a time
+(gaps filled with the last value), with no Python work per sample and no
+trip through Tcl. Rows without a time aren't graphed.
+
+On top of the samples is a min/max decimation pyramid: level 1 has the
+min and max (and when they happened) of every DECIMATION_FACTOR samples,
+level 2 of every DECIMATION_FACTOR level 1 bins, and so on. Only complete
+bins are kept, built as samples arrive. window() picks the lowest level that
+covers the times asked for in max_points or fewer points, and draws each bin
+as its min and max in the order they happened, so every spike is still
+there however far out the graph is zoomed. So the whole flight costs the
+same to draw as the last few seconds.
+"""
+
+FLT_TIME_RESOLUTION = 100 # radio fltTime counts hundredths of a second
+FLT_TIME_RANGE = 65536 # fltTime is a uint16, so wraps round every 655.36s
+
+DECIMATION_FACTOR = 4 # samples (or bins) in each bin of the next level up
+HISTORY_SIZE = 4096 # samples allocated for at first (doubled when full)
+
+
+def fill_gaps(column, last: float) -> numpy.ndarray:
+    """
+    column (a list, with None where a row had no value) as a float array,
+    every gap filled with the value before it (last for gaps at the start)
+    """
+    values = numpy.array(column, dtype=float) # None becomes nan
+    gaps = numpy.isnan(values)
+
+    if gaps.any():
+        values = numpy.concatenate(((last,), values))
+        gaps = numpy.concatenate(((False,), gaps))
+        filled = numpy.where(gaps, 0, numpy.arange(len(values)))
+        values = values[numpy.maximum.accumulate(filled)][1:]
+
+    return values
+
+
+class GraphClock(object):
+    """
+    Graph time (seconds) of every row of a batch: fltTime for radio
+    telemetry, counting the times it wrapped round, or time for SD-card logs
+    """
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.last_flt_time = None
+        self.wraps = 0
+
+    def times(self, batch) -> numpy.ndarray:
+        """
+        seconds for every row, nan where a row has no time
+        """
+        if "fltTime" in batch.columns:
+            return self.flt_times(numpy.array(batch.column("fltTime"), dtype=float))
+
+        self.reset() # out of flight: the next fltTime starts a new flight
+
+        if "time" in batch.columns:
+            try:
+                return numpy.array(batch.column("time"), dtype=float)
+            except (TypeError, ValueError):
+                pass
+
+        return numpy.full(batch.rows, numpy.nan)
+
+    def flt_times(self, raw: numpy.ndarray) -> numpy.ndarray:
+        valid = ~numpy.isnan(raw)
+        flt_times = raw[valid]
+        if not len(flt_times):
+            return raw
+
+        # a drop of more than half the range is fltTime wrapping round, not a new flight
+        previous = flt_times[0] if self.last_flt_time is None else self.last_flt_time
+        steps = numpy.diff(flt_times, prepend=previous)
+        wraps = self.wraps + numpy.cumsum(steps < -FLT_TIME_RANGE / 2)
+
+        self.last_flt_time = flt_times[-1]
+        self.wraps = int(wraps[-1])
+
+        raw[valid] = (flt_times + wraps * FLT_TIME_RANGE) / FLT_TIME_RESOLUTION
+        return raw
+
+
+class GrowingArray(object):
+    """
+    rows of float columns, appended to a block of columns at a time
+    """
+    def __init__(self, rows: int, capacity: int = HISTORY_SIZE) -> None:
+        self.data = numpy.empty((rows, capacity))
+        self.count = 0
+
+    def extend(self, block: numpy.ndarray) -> None:
+        end = self.count + block.shape[1]
+
+        if end > self.data.shape[1]:
+            data = numpy.empty((self.data.shape[0], max(2 * self.data.shape[1], end)))
+            data[:, :self.count] = self.data[:, :self.count]
+            self.data = data
+
+        self.data[:, self.count:end] = block
+        self.count = end
+
+    def view(self, start: int = 0, end: int = None) -> numpy.ndarray:
+        return self.data[:, start:self.count if end is None else end]
+
+
+def decimate(mins, maxs, min_times, max_times, factor: int) -> numpy.ndarray:
+    """
+    bins of factor columns combined into one: rows of mins, maxs, min_times, max_times
+    """
+    shape = (mins.shape[0], -1, factor)
+    (mins, maxs, min_times, max_times) = (a.reshape(shape) for a in (mins, maxs, min_times, max_times))
+
+    lowest = numpy.argmin(mins, axis=2)[..., None]
+    highest = numpy.argmax(maxs, axis=2)[..., None]
+
+    return numpy.concatenate([numpy.take_along_axis(mins, lowest, 2)[..., 0],
+                              numpy.take_along_axis(maxs, highest, 2)[..., 0],
+                              numpy.take_along_axis(min_times, lowest, 2)[..., 0],
+                              numpy.take_along_axis(max_times, highest, 2)[..., 0]])
+
+
+def envelope(mins, maxs, min_times, max_times) -> tuple:
+    """
+    points of the bins: each bin's min and max, in the order they happened
+    """
+    min_first = min_times <= max_times
+    xs = numpy.empty((mins.shape[0], 2 * mins.shape[1]))
+    ys = numpy.empty_like(xs)
+
+    xs[:, 0::2] = numpy.where(min_first, min_times, max_times)
+    xs[:, 1::2] = numpy.where(min_first, max_times, min_times)
+    ys[:, 0::2] = numpy.where(min_first, mins, maxs)
+    ys[:, 1::2] = numpy.where(min_first, maxs, mins)
+
+    return (xs, ys)
+
+
+class GraphHistory(object):
+    """
+    Every sample of a flight for a number of graphs, with its decimation pyramid
+    """
+    def __init__(self, graphs: int, factor: int = DECIMATION_FACTOR) -> None:
+        self.graphs = graphs
+        self.factor = factor
+        self.last = numpy.zeros(graphs) # last value of each graph, for filling gaps
+        self.clear()
+
+    def clear(self) -> None:
+        """
+        forgets every sample (the last values are kept for filling gaps)
+        """
+        self.samples = GrowingArray(1 + self.graphs) # time, then a row per graph
+        self.levels = [] # GrowingArray per level of the pyramid: rows of mins, maxs, min times, max times
+
+    @property
+    def count(self) -> int:
+        return self.samples.count
+
+    @property
+    def first_time(self) -> float:
+        return float(self.samples.data[0, 0])
+
+    @property
+    def last_time(self) -> float:
+        return float(self.samples.data[0, self.count - 1])
+
+    def extend(self, times: numpy.ndarray, columns: list) -> bool:
+        """
+        appends rows: their times and a (gap filled) array of values per graph.
+        Rows without a time are left out. Returns True if the history was
+        cleared because time went back (a new flight)
+        """
+        for i in range(self.graphs):
+            if len(columns[i]):
+                self.last[i] = columns[i][-1]
+
+        timed = ~numpy.isnan(times)
+        if not timed.all():
+            times = times[timed]
+            columns = [column[timed] for column in columns]
+
+        if not len(times):
+            return False
+
+        start = 0
+        previous = times[0] if self.count == 0 else self.last_time
+        backwards = numpy.flatnonzero(numpy.diff(times, prepend=previous) < 0)
+        if len(backwards):
+            start = backwards[-1] # only the samples since the last flight started are kept
+            self.clear()
+
+        self.samples.extend(numpy.vstack([times[start:]] + [column[start:] for column in columns]))
+        self.build_levels()
+
+        return bool(len(backwards))
+
+    def build_levels(self) -> None:
+        """
+        adds the bins completed by new samples to every level of the pyramid
+        """
+        factor = self.factor
+        graphs = self.graphs
+        lower = self.samples
+        level = 0
+
+        while True:
+            if level == len(self.levels):
+                if lower.count < factor:
+                    return
+                self.levels.append(GrowingArray(4 * graphs))
+
+            bins = self.levels[level]
+            start = bins.count * factor
+            end = (lower.count // factor) * factor
+            if end <= start:
+                return
+
+            if lower is self.samples:
+                block = lower.view(start, end)
+                values = block[1:]
+                times = numpy.broadcast_to(block[0], values.shape)
+                bins.extend(decimate(values, values, times, times, factor))
+            else:
+                block = lower.view(start, end)
+                bins.extend(decimate(*(block[i * graphs:(i + 1) * graphs] for i in range(4)), factor))
+
+            lower = bins
+            level += 1
+
+    def window(self, start: float, end: float, max_points: int) -> tuple:
+        """
+        (xs, ys) lists with the points of each graph from start to end seconds
+        (and the samples either side, so lines reach the edges). At most about
+        max_points points each: the samples themselves (views, not copies)
+        if there are few enough, otherwise min/max bins
+        """
+        times = self.samples.view()[0]
+        first = max(int(numpy.searchsorted(times, start, "left")) - 1, 0)
+        last = min(int(numpy.searchsorted(times, end, "right")) + 1, len(times))
+        count = last - first
+
+        if count <= max_points:
+            samples = self.samples.view(first, last)
+            return ([samples[0]] * self.graphs, list(samples[1:]))
+
+        # lowest level with few enough bins in the window (2 points each, and a partial bin at either end)
+        level = 0
+        size = self.factor
+        while level + 1 < len(self.levels) and 2 * (count // size + 2) > max_points:
+            level += 1
+            size *= self.factor
+
+        # whole bins from that level, then the end of the window from the levels below
+        (xs, ys) = ([], [])
+        covered = first
+        for level in range(level, -1, -1):
+            bins = self.levels[level]
+            bin_start = covered // size
+            bin_end = min(-(-last // size), bins.count)
+            if bin_end > bin_start:
+                block = bins.view(bin_start, bin_end)
+                (x, y) = envelope(*(block[i * self.graphs:(i + 1) * self.graphs] for i in range(4)))
+                xs.append(x)
+                ys.append(y)
+                covered = bin_end * size
+            size //= self.factor
+
+        if covered < last:
+            samples = self.samples.view(covered, last)
+            xs.append(numpy.broadcast_to(samples[0], (self.graphs, last - covered)))
+            ys.append(samples[1:])
+
+        (xs, ys) = (numpy.concatenate(xs, axis=1), numpy.concatenate(ys, axis=1))
+        return (list(xs), list(ys))
@@ -3,97 +3,208 @@ import matplotlib
 import matplotlib.pyplot as plt
 matplotlib.use("TkAgg")
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from collections import deque
+from GraphData import GraphHistory, GraphClock, fill_gaps
 from Styles import Colors
+import numpy
+import math
 
-NUM_POINTS = 800
 LINEWIDTH = 1
-INITIAL_INTERVAL = 0.05 # for calculating X-axis
+GRAPH_SPAN = 40 # seconds shown while following the latest samples
+GRAPH_SPANS = (10, 40, 120) # spans offered in the menu
+MIN_GRAPH_SPAN = 1 # seconds, zoomed all the way in
+ZOOM_STEP = 1.25 # span multiplied or divided by this for every scroll wheel step
+X_HEADROOM = 0.25 # part of the span left free right of the latest sample, so the x-axis only moves (and redraws) now and then
+POINTS_PER_PIXEL = 2 # most points drawn per pixel of graph width
 AXIS_NAMES = ["Altitude (m)", "Velocity (m/s)", "Acceleration (m/s/s)"]
+GRAPH_KEYS = ["fusionAlt", "fusionVel", "accelZ"]
 LINE_COLORS = [Colors.ALTITUDE_COLOR, Colors.VELOCITY_COLOR, Colors.ACCELERATION_COLOR]
 
 NUM_GRAPHS = 3 #  max = 3
 
 class GraphFrame(Frame):
+    """
+    Altitude, velocity and acceleration against flight time. Every sample of
+    the flight is kept (see GraphData), and the x-axis either follows the
+    latest span seconds or shows the whole flight (span_var 0). Scroll over
+    the graphs to zoom
+    """
     def reset_data(self):
-        self.ys = []
-
-        for _ in range(NUM_GRAPHS):
-            self.ys.append(deque(NUM_POINTS*[0], NUM_POINTS))
-
-        self.xs = [x * INITIAL_INTERVAL for x in (range(0-NUM_POINTS,0))]
+        self.history = GraphHistory(NUM_GRAPHS)
+        self.clock.reset()
+        self.changed = True # lines need their data again
 
         self.ranges = [(-100,+1000), # Alt
                        (-10,+100), # Vel
                        (-10,+10)] # Acc
 
+        self.xlim = (0, self.span or GRAPH_SPAN)
+
     def reset(self):
         self.reset_data()
+        self.set_limits()
         self.canvas.draw()
         self.draw()
 
+    def set_limits(self):
+        self.ax[0].set_xlim(self.xlim) # x-axis is shared
+        for i in range(NUM_GRAPHS):
+            self.ax[i].set_ylim(self.ranges[i])
 
-    def update_data(self):
-        changed = False
-
-        for i in range(3):
-            new_y = self.yvars[i].get()
+    def add_columns(self, batch):
+        """
+        adds every row of a MessageBatch to the graphs, a whole column at a
+        time. Rows without a value for a graph repeat its last value, rows
+        without a flight time aren't graphed
+        """
+        times = self.clock.times(batch)
+        columns = [fill_gaps(batch.column(GRAPH_KEYS[i]), self.history.last[i]) for i in range(NUM_GRAPHS)]
+        count = self.history.count
+        if self.history.extend(times, columns) or self.history.count != count:
+            self.changed = True
 
-            (min, max) = self.ranges[i]
-            if new_y >= max:
-                max += self.extend_size[i]
-                changed = True
-            elif new_y <= min:
-                min -= self.extend_size[i]
-                changed = True
+        changed = False
 
-            if changed:
-                self.ranges[i] = (min,max)
-                self.ax[i].set_ylim(self.ranges[i])
+        for i in range(NUM_GRAPHS):
+            if len(columns[i]):
+                changed |= self.extend_range(i, float(numpy.min(columns[i])), float(numpy.max(columns[i])))
 
-            self.ys[i].append(new_y)
+        changed |= self.update_xlim()
 
         if changed:
             # do complete redraw for axes
             self.canvas.draw()
 
+    def extend_range(self, i: int, low: float, high: float) -> bool:
+        """
+        extends the y-axis of graph i until low and high are inside it
+        returns True if the axis changed (and so needs complete redraw)
+        """
+        (min, max) = self.ranges[i]
+        size = self.extend_size[i]
+        changed = False
+
+        if math.isfinite(high) and high >= max:
+            max += size * (math.floor((high - max) / size) + 1)
+            changed = True
+        if math.isfinite(low) and low <= min:
+            min -= size * (math.floor((min - low) / size) + 1)
+            changed = True
+
+        if changed:
+            self.ranges[i] = (min,max)
+            self.ax[i].set_ylim(self.ranges[i])
+
+        return changed
+
+    def update_xlim(self, force: bool = False) -> bool:
+        """
+        moves the x-axis on once the latest sample reaches its right edge (or
+        the flight starts again), leaving X_HEADROOM free so most draws blit
+        returns True if the axis changed (and so needs complete redraw)
+        """
+        history = self.history
+        if not history.count:
+            return False
+
+        (first, latest) = (history.first_time, history.last_time)
+        (left, right) = self.xlim
+
+        if not force and left <= latest <= right and (self.span is not None or left == first):
+            return False
+
+        if self.span is None:
+            (left, right) = (first, latest + max(latest - first, MIN_GRAPH_SPAN) * X_HEADROOM)
+        else:
+            right = latest + self.span * X_HEADROOM
+            left = right - self.span
+
+        self.xlim = (left, right)
+        self.ax[0].set_xlim(self.xlim)
+        self.changed = True
+        return True
+
+    def update_span(self, *_):
+        """
+        called when span_var changes (from the menu, or zooming)
+        """
+        self.span = self.span_var.get() or None
+
+        if not self.update_xlim(force=True):
+            self.xlim = (0, self.span or GRAPH_SPAN)
+            self.ax[0].set_xlim(self.xlim)
+
+        self.canvas.draw()
+        self.draw()
+
+    def on_scroll(self, event):
+        """
+        scroll up zooms in, down zooms out, as far as the whole flight
+        """
+        history = self.history
+        duration = history.last_time - history.first_time if history.count else 0.0
+        span = self.span or duration
+
+        if event.button == "up":
+            span = max(span / ZOOM_STEP, MIN_GRAPH_SPAN)
+        elif self.span is None:
+            return
+        else:
+            span *= ZOOM_STEP
+            if history.count and span >= duration:
+                span = 0.0 # whole flight
+
+        self.span_var.set(span)
+
 
     def __init__(self, master, **kwargs):
         Frame.__init__(self, master, **kwargs)
 
-        self.yvars = [DoubleVar(master, 0.0, "fusionAlt"),
-                      DoubleVar(master, 0.0, "fusionVel"),
-                      DoubleVar(master, 0.0, "accelZ")]
-
         self.extend_size = [1000, # alt
                             100,   # vel
                             100]   # accelz
 
+        # seconds shown, 0 for the whole flight
+        self.span_var = DoubleVar(master, GRAPH_SPAN, "graph_span")
+        self.span = GRAPH_SPAN
+
+        self.clock = GraphClock()
         self.reset_data()
+        self.width = 0 # pixels the lines were last decimated for
 
         self.figure, self.ax = plt.subplots(3, sharex=True)
 
         self.lines = []
 
         plt.subplots_adjust(bottom=0.075, right=0.95, top=0.95, left=0.15, hspace=0.1)
-        plt.xlabel("Seconds")
+        plt.xlabel("Flight time (s)")
 
         for i in range(NUM_GRAPHS):
-            self.ax[i].set_ylim(self.ranges[i])
             self.ax[i].grid(color=Colors.GRAY)
             self.ax[i].set_ylabel(AXIS_NAMES[i])
-            (line,) = self.ax[i].plot(self.xs, self.ys[i], LINE_COLORS[i], animated=True, linewidth=LINEWIDTH)
+            (line,) = self.ax[i].plot([], [], LINE_COLORS[i], animated=True, linewidth=LINEWIDTH)
             self.lines.append(line)
 
+        self.set_limits()
+
         self.canvas = FigureCanvasTkAgg(self.figure, self)
         self.canvas.get_tk_widget().pack(side=BOTTOM, fill=BOTH, expand=True)
 
         self.canvas.draw()
         self.blit_manager = BlitManager(self.canvas, self.lines)
+        self.canvas.mpl_connect("scroll_event", self.on_scroll)
+        self.span_var.trace_add("write", self.update_span)
 
     def draw(self):
-        for i in range(NUM_GRAPHS):
-            self.lines[i].set_ydata(self.ys[i])
+        width = max(int(self.ax[0].bbox.width), 1)
+
+        if self.changed or width != self.width:
+            # at most POINTS_PER_PIXEL points per pixel, however much of the flight is shown
+            (start, end) = self.xlim
+            (xs, ys) = self.history.window(start, end, POINTS_PER_PIXEL * width)
+            for i in range(NUM_GRAPHS):
+                self.lines[i].set_data(xs[i], ys[i])
+            self.changed = False
+            self.width = width
 
         self.blit_manager.update()
 
@@ -149,6 +149,9 @@ class MapColumn(PanedWindow):
         self.stats_frame = Frame(self, bg=Colors.BG_COLOR)
         self.stats_frame.pack(side=BOTTOM, after=self.status_bar, expand=False, fill=X)
 
+        self.tcl_calls_label = NumberLabel(self.stats_frame, name="Tcl:", textvariable=StringVar(master, name="tcl_calls_per_sec"), units="/s")
+        self.tcl_calls_label.grid(column = 0, row = 0, sticky=(N,W,E,S))
+
         self.total_bytes_read_label = NumberLabel(self.stats_frame, name="Data:", textvariable=StringVar(master, name="total_bytes_read"), units="")
         self.total_bytes_read_label.grid(column = 1, row = 0, sticky=(N,W,E,S))
 
@@ -171,10 +174,20 @@ class MapColumn(PanedWindow):
         self.total_bad_messages_label = NumberLabel(self.stats_frame, name="Error:", textvariable=StringVar(master, name="total_bad_messages"), units="Pkt")
         self.total_bad_messages_label.grid(column = 3, row = 1, sticky=(N,W,E,S))
 
+        # Display falling behind:
+        self.total_coalesced_label = NumberLabel(self.stats_frame, name="Merged:", textvariable=StringVar(master, name="total_coalesced"), units="")
+        self.total_coalesced_label.grid(column = 4, row = 0, sticky=(N,W,E,S))
+
+        self.total_overflow_label = NumberLabel(self.stats_frame, name="Dropped:", textvariable=StringVar(master, name="total_overflow"), units="Pkt")
+        self.total_overflow_label.grid(column = 4, row = 1, sticky=(N,W,E,S))
+
+        self.total_overflow_rows_label = NumberLabel(self.stats_frame, name="Lost:", textvariable=StringVar(master, name="total_overflow_rows"), units="Rows")
+        self.total_overflow_rows_label.grid(column = 5, row = 1, sticky=(N,W,E,S))
+
         for r in range(2):
             self.stats_frame.rowconfigure(r, weight=1)
 
-        for c in range(4):
+        for c in range(6):
             self.stats_frame.columnconfigure(c, weight=1, uniform="1")
 
 
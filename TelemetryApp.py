@@ -9,25 +9,31 @@ MFL
 """
 
 from tkinter import *
-from GraphFrame import GraphFrame
-from TelemetryControls import ReadOut
+from GraphFrame import GraphFrame, GRAPH_SPANS
+from TelemetryControls import ReadOut, VariableBindings, QueueWatcher
 from MapFrame import *
 from tkinter.filedialog import askopenfilename, asksaveasfilename
 from tkinter import messagebox
+from tkinter.simpledialog import askfloat, askinteger
 from Styles import Colors
 from time import monotonic
 from TelemetryDecoder import DecoderState
-from TelemetryReader import SDCardFileReader, RadioTelemetryReader, BinaryFileReader
+from TelemetryReader import SDCardFileReader, RadioTelemetryReader, BinaryFileReader, DiversityReader
+from TelemetryEngine import ReaderEngine
+from TelemetryChannel import TelemetryChannel, ChannelPolicy
 from TelemetrySender import TelemetryTestSender
+from TelemetryPlayback import PlaybackEvent, PlaybackPacket, PLAYBACK_SPEEDS
 from enum import Enum
 from matplotlib import style
 import queue
 style.use('dark_background')
 
-FAST_UPDATE_INTERVAL = 10
+FAST_UPDATE_INTERVAL = 10 # shortest ms between processing the message queue
+IDLE_UPDATE_INTERVAL = 250 # longest ms between checks of the message queue while no data arrives
 GRAPH_UPDATE_INTERVAL = 100 # time between updating graphs
 STATS_INTERVAL = 500 # ms between calculating the bytes/second value
 TIME_SINCE_FORMAT = "{:.2f}"
+PLAYBACK_JUMP = 10 # seconds jumped back or forward by the arrow keys
 
 RECENT_PACKET_TIMEOUT = 1 # seconds after receiving last message that we show red marker to user
 
@@ -60,7 +66,7 @@ class TelemetryApp(Tk):
 
         self.state = AppState.IDLE
 
-        self.message_queue = queue.Queue() # incoming telemetry from file or serial port
+        self.message_queue = TelemetryChannel() # incoming telemetry from file or serial port (bounded)
 
         self.telemetry_vars = ["name",
                                "time", "accelX", "accelY", "accelZ", "gyroZ" "highGx", "highGy", "highGz",
@@ -73,16 +79,27 @@ class TelemetryApp(Tk):
         for var in self.telemetry_vars:
             self.setvar(var)
 
+        self.bindings = VariableBindings(self) # telemetry and per-frame variables, written once per frame if changed
+
         self.serial_reader = RadioTelemetryReader(self.message_queue)
         self.serial_reader.name = "serial_reader"
+        self.diversity_reader = DiversityReader(self.message_queue)
+        self.diversity_reader.name = "diversity_reader"
         self.csv_file_reader = SDCardFileReader(self.message_queue)
         self.csv_file_reader.name = "csv_file_reader"
         self.tlm_file_reader = BinaryFileReader(self.message_queue)
         self.tlm_file_reader.name = "tlm_file_reader"
 
+        # all readers run on one event loop thread, instead of a thread each
+        self.reader_engine = ReaderEngine()
+        for reader in (self.serial_reader, self.diversity_reader, self.csv_file_reader, self.tlm_file_reader):
+            reader.engine = self.reader_engine
+
         self.current_reader = None
 
-        self.fast_update_timer = None # used to store tk.after ID for text updating
+        # runs check_queue() when readers send data (polling slowly while idle)
+        self.queue_watcher = QueueWatcher(self, self.message_queue, self.check_queue,
+                                          FAST_UPDATE_INTERVAL, IDLE_UPDATE_INTERVAL)
         self.slow_update_timer = None # used to store tk after ID for graph updating
         self.currently_receiving_timer = None # used for storing tk.after ID for
         self.stats_timer = None
@@ -99,16 +116,33 @@ class TelemetryApp(Tk):
         self.total_bad_bytes_read = StringVar(self, "0B", "total_bad_bytes_read")
         self.total_messages_decoded = IntVar(self, 0, "total_messages_decoded")
         self.total_bad_messages = IntVar(self, 0, "total_bad_messages")
+        self.total_coalesced = IntVar(self, 0, "total_coalesced") # batches merged while the UI was behind
+        self.total_overflow = IntVar(self, 0, "total_overflow") # messages dropped while the UI was behind
+        self.total_overflow_rows = IntVar(self, 0, "total_overflow_rows") # rows (graph samples) lost past the channel's row cap
         self.bytes_per_sec = StringVar(self, "0B", "bytes_per_sec")
         self.messages_per_sec = StringVar(self, "0P", "messages_per_sec")
+        self.tcl_calls_per_sec = StringVar(self, "0", "tcl_calls_per_sec")
 
         self.bytes_counter = 0
         self.messages_counter = 0
+        self.tcl_calls_counter = 0 # bindings.tcl_calls at the last stats update
 
         # Testing and debug
         # -----------------
         self.print_to_console = BooleanVar(self, False, "print_to_console")
         self.print_to_console.trace_add("write", self.update_print_to_console)
+        self.full_rate = BooleanVar(self, False, "full_rate")
+        self.full_rate.trace_add("write", self.update_full_rate)
+        self.coalesce = BooleanVar(self, True, "coalesce")
+        self.coalesce.trace_add("write", self.update_channel_policy)
+
+        # Playback
+        # --------
+        self.playback_speed = DoubleVar(self, 1.0, "playback_speed") # 0 for unthrottled
+        self.playback_speed.trace_add("write", self.update_playback_speed)
+        self.playback_paused = BooleanVar(self, False, "playback_paused")
+        self.playback_paused.trace_add("write", self.update_playback_paused)
+        self.playing_name = ""
         self.test_serial_sender = TelemetryTestSender() # for test data only
 
 
@@ -138,8 +172,23 @@ class TelemetryApp(Tk):
         self.map_menu.add_checkbutton(label="Only use offline maps",
                                       variable=self.offline_maps_only)
 
+        self.playback_menu = Menu(self.menubar)
+        self.playback_menu.add_checkbutton(label="Pause", variable=self.playback_paused, accelerator="Space")
+        self.playback_menu.add_separator()
+        for speed in PLAYBACK_SPEEDS:
+            self.playback_menu.add_radiobutton(label=f"{speed:g}x speed", variable=self.playback_speed, value=speed)
+        self.playback_menu.add_radiobutton(label="Unthrottled", variable=self.playback_speed, value=0.0)
+        self.playback_menu.add_separator()
+        for event in PlaybackEvent:
+            self.playback_menu.add_command(label=f"Jump to {str(event).lower()}", command=lambda event=event: self.seek_playback(event))
+        self.playback_menu.add_command(label=f"Back {PLAYBACK_JUMP}s", command=lambda: self.jump_playback(-PLAYBACK_JUMP), accelerator="Left")
+        self.playback_menu.add_command(label=f"Forward {PLAYBACK_JUMP}s", command=lambda: self.jump_playback(PLAYBACK_JUMP), accelerator="Right")
+        self.playback_menu.add_command(label="Go to time...", command=self.ask_playback_time)
+        self.playback_menu.add_command(label="Go to packet...", command=self.ask_playback_packet)
+
         self.serial_menu = Menu(self.menubar)
         self.menubar.add_cascade(label="File", menu=self.file_menu)
+        self.menubar.add_cascade(label="Playback", menu=self.playback_menu)
         self.menubar.add_cascade(label="Serial", menu=self.serial_menu)
         self.menubar.add_cascade(label="Map", menu=self.map_menu)
 
@@ -154,6 +203,13 @@ class TelemetryApp(Tk):
         self.graphs = GraphFrame(self.window, width=400, background=Colors.BLACK)
         self.map_column = MapColumn(self.window)
 
+        # x-axis of the graphs (scrolling over them zooms too)
+        self.graph_menu = Menu(self.menubar)
+        for span in GRAPH_SPANS:
+            self.graph_menu.add_radiobutton(label=f"Last {span}s", variable=self.graphs.span_var, value=span)
+        self.graph_menu.add_radiobutton(label="Whole flight", variable=self.graphs.span_var, value=0.0)
+        self.menubar.add_cascade(label="Graphs", menu=self.graph_menu)
+
         self.window.add(self.readouts)
         self.window.add(self.graphs, stretch="always")
         self.window.add(self.map_column)
@@ -205,6 +261,9 @@ class TelemetryApp(Tk):
             self.bind('s', lambda _: self.tracker.print_diff())
         self.bind('r', lambda _: self.reset())
         self.bind('t', lambda _: self.open_telemetry_test_file())
+        self.bind('<space>', lambda _: self.playback_paused.set(not self.playback_paused.get()))
+        self.bind('<Left>', lambda _: self.jump_playback(-PLAYBACK_JUMP))
+        self.bind('<Right>', lambda _: self.jump_playback(PLAYBACK_JUMP))
         self.focus()
 
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -212,7 +271,78 @@ class TelemetryApp(Tk):
 
 
     def update_print_to_console(self, *_):
-        self.serial_reader.print_received = self.print_to_console.get()
+        for reader in (self.serial_reader, self.diversity_reader):
+            reader.print_received = self.print_to_console.get()
+
+
+    def update_full_rate(self, *_):
+        for reader in (self.serial_reader, self.diversity_reader, self.tlm_file_reader):
+            reader.full_rate = self.full_rate.get()
+
+
+    def update_channel_policy(self, *_):
+        self.message_queue.policy = ChannelPolicy.COALESCE if self.coalesce.get() else ChannelPolicy.DROP_OLDEST
+
+
+    def update_playback_speed(self, *_):
+        speed = self.playback_speed.get()
+        for reader in (self.csv_file_reader, self.tlm_file_reader):
+            if speed > 0:
+                reader.playback.set_speed(speed)
+            else:
+                reader.playback.set_unthrottled()
+
+
+    def update_playback_paused(self, *_):
+        for reader in (self.csv_file_reader, self.tlm_file_reader):
+            if self.playback_paused.get():
+                reader.playback.pause()
+            else:
+                reader.playback.resume()
+
+
+    def seek_playback(self, target) -> None:
+        """
+        moves the file being played to target (seconds from the start, or a
+        PlaybackEvent). Graphs start again from there
+        """
+        if self.state != AppState.READING_FILE:
+            return
+
+        self.current_reader.playback.seek(target)
+        self.message_queue.clear()
+        self.graphs.reset()
+
+
+    def jump_playback(self, seconds: float) -> None:
+        if self.state == AppState.READING_FILE:
+            self.seek_playback(max(0.0, self.current_reader.playback.position + seconds))
+
+
+    def ask_playback_time(self) -> None:
+        if self.state != AppState.READING_FILE:
+            return
+
+        playback = self.current_reader.playback
+        if playback.index is None:
+            print(f"Still indexing {playback.filename}, try again in a moment")
+            return
+
+        seconds = askfloat("Go to time", f"Seconds from the start (0 - {playback.duration:.1f}):",
+                           minvalue=0.0, maxvalue=playback.duration, parent=self)
+        if seconds is not None:
+            self.seek_playback(seconds)
+
+    def ask_playback_packet(self) -> None:
+        """
+        seeks to a radioPacketNum (version 2 TLM files only)
+        """
+        if self.state != AppState.READING_FILE:
+            return
+
+        packet_number = askinteger("Go to packet", "Radio packet number:", minvalue=0, parent=self)
+        if packet_number is not None:
+            self.seek_playback(PlaybackPacket(packet_number))
 
 
     def num_key_pressed(self, event):
@@ -231,35 +361,49 @@ class TelemetryApp(Tk):
         if self.confirm_stop():
             if PROFILING:
                 self.tracker.print_diff()
+            self.reader_engine.shutdown()
+            self.queue_watcher.close()
             self.destroy()
             self.quit()
 
-    def check_queue(self):
+    def check_queue(self) -> bool:
         """
-        Check the message queue regularly to see if new messages came.
-        If they came then process then.
+        Run by the queue watcher when messages came (and now and then while idle).
+        If they came then process then, and write the variables they
+        changed once at the end. Returns True if any came
         """
         time_since_last_packet = (monotonic() - self.last_packet_local_timestamp)
 
         # Set red/green indicator in status bar depending on when last packet came in:
-        self.currently_receiving.set(time_since_last_packet < RECENT_PACKET_TIMEOUT)
-        self.time_since_last_packet.set(TIME_SINCE_FORMAT.format(time_since_last_packet))
+        self.bindings.set("currently_receiving", time_since_last_packet < RECENT_PACKET_TIMEOUT)
+        self.bindings.set("time_since_last_packet", TIME_SINCE_FORMAT.format(time_since_last_packet))
+
+        received = False
 
         try:
             while True:
-                message = self.message_queue.get(block=False)
-                self.process_message(message)
+                batch = self.message_queue.get(block=False)
+                self.process_batch(batch)
+                received = True
 
         except queue.Empty:
             pass
 
         finally:
+            if received:
+                self.bindings.set("total_messages_decoded", self.current_reader.messages_decoded)
+                self.bindings.set("total_bytes_read", self.format_bytes(self.current_reader.bytes_received))
 
-            if self.current_reader.running.is_set():
-                self.fast_update_timer = self.after(FAST_UPDATE_INTERVAL, self.check_queue)
-            else:
+            self.bindings.flush()
+
+            if received:
+                self.map_column.update_data()
+
+            if not self.current_reader.running.is_set():
                 self.stop()
 
+        return received
+
 
     def draw_graph(self):
         """
@@ -284,30 +428,51 @@ class TelemetryApp(Tk):
         self.messages_per_sec.set(round(self.messages_counter / interval))
         self.messages_counter = 0
 
+        self.tcl_calls_per_sec.set(round((self.bindings.tcl_calls - self.tcl_calls_counter) / interval))
+        self.tcl_calls_counter = self.bindings.tcl_calls
+
         self.total_bad_bytes_read.set(self.format_bytes(self.current_reader.bad_bytes_received))
         self.total_bad_messages.set(self.current_reader.bad_packets_received)
+        self.total_coalesced.set(self.message_queue.coalesced)
+        self.total_overflow.set(self.message_queue.overflow_messages)
+        self.total_overflow_rows.set(self.message_queue.overflow_rows)
+
+        if self.state == AppState.READING_FILE:
+            playback = self.current_reader.playback
+            speed = "unthrottled" if playback.unthrottled else f"{playback.speed:g}x"
+            if playback.paused:
+                speed = "paused"
+            elif not playback.unthrottled:
+                speed += f", {1000 * playback.lag:.0f}ms lag"
+            self.map_column.set_status_text(f"Playing: {self.playing_name}  {playback.position:.1f}s / {playback.duration:.1f}s ({speed})",
+                                            Colors.WHITE, Colors.DARK_GREEN)
 
         self.stats_timer = self.after(STATS_INTERVAL, self.update_stats)
 
-    def process_message(self, message):
+    def process_batch(self, batch):
         """
-        decodes FC-style message into app variables and triggers graphs + map to update
+        decodes a batch of FC-style messages into app variables and triggers graphs to update.
+        Variables only get the latest values, written by check_queue() once
+        every batch waiting has been processed; graphs and min/max get every
+        row of the batch
         """
+        if batch.decoder_state != self.telemetry_state:
+            # values from before the state change go first (MapFrame reads some
+            # of them), and MapFrame writes some variables itself
+            self.bindings.flush()
+            self.set_telemetry_state(batch.decoder_state)
+            self.bindings.forget()
 
-        self.set_telemetry_state(message.decoder_state)
-        self.last_packet_local_timestamp = message.local_time
+        self.last_packet_local_timestamp = batch.local_time
 
-        self.bytes_counter += (message.total_message_size)
-        self.messages_counter += 1
+        self.bytes_counter += (batch.total_message_size)
+        self.messages_counter += batch.messages
 
-        self.total_messages_decoded.set(self.current_reader.messages_decoded)
-        self.total_bytes_read.set(self.format_bytes(self.current_reader.bytes_received))
+        self.bindings.update(batch.telemetry)
 
-        for (key, value) in message.telemetry.items():
-            self.setvar(key, value)
-
-        self.map_column.update_data()
-        self.graphs.update_data()
+        self.graphs.add_columns(batch)
+        for readout in (self.altitude, self.velocity, self.acceleration):
+            readout.update_range(batch.columns.get(readout.key, ()))
 
     def confirm_stop(self) -> bool:
         """
@@ -341,14 +506,12 @@ class TelemetryApp(Tk):
 
     def start(self):
         self.last_packet_local_timestamp = monotonic()
-        self.check_queue()
+        self.queue_watcher.start()
         self.draw_graph()
         self.update_stats()
 
     def stop(self):
-        if self.fast_update_timer is not None:
-            self.after_cancel(self.fast_update_timer)
-            self.fast_update_timer = None
+        self.queue_watcher.stop()
 
         if self.slow_update_timer is not None:
             self.after_cancel(self.slow_update_timer)
@@ -381,14 +544,23 @@ class TelemetryApp(Tk):
         for var in self.telemetry_vars:
             self.setvar(var, "0")
 
+        self.bindings.clear()
         self.set_telemetry_state(DecoderState.OFFLINE)
         self.time_since_last_packet.set(TIME_SINCE_FORMAT.format(float(0)))
         self.total_bytes_read.set("0B")
         self.total_bad_bytes_read.set("0B")
         self.total_messages_decoded.set(0)
         self.total_bad_messages.set(0)
+        self.message_queue.clear()
+        self.message_queue.reset_stats()
+        self.total_coalesced.set(0)
+        self.total_overflow.set(0)
+        self.total_overflow_rows.set(0)
         self.bytes_per_sec.set("0B")
         self.messages_per_sec.set("0P")
+        self.tcl_calls_per_sec.set("0")
+        self.tcl_calls_counter = self.bindings.tcl_calls
+        self.playback_paused.set(False)
 
         # clear app variables and graphs:
         self.setvar("name", "")
@@ -414,42 +586,59 @@ class TelemetryApp(Tk):
             for port_name in ports:
                 self.serial_menu.add_command(label=port_name, command=lambda name=port_name: self.listen_to_port(name))
 
+        if len(ports) > 1:
+            self.serial_menu.add_command(label="All ports (diversity)", command=self.listen_to_all_ports)
+
         self.serial_menu.add_separator()
         self.serial_menu.add_command(label="Re-scan", command=self.update_serial_menu)
         self.serial_menu.add_checkbutton(label="Print data in console",variable=self.print_to_console)
+        self.serial_menu.add_checkbutton(label="Full-rate in-flight samples",variable=self.full_rate)
+        self.serial_menu.add_checkbutton(label="Merge telemetry when display is behind",variable=self.coalesce)
 
     def listen_to_port(self, port):
+        if port in self.serial_reader.available_ports():
+            self.serial_reader.serial_port = port
+            self.listen_to_serial(self.serial_reader, port)
+
+    def listen_to_all_ports(self):
+        """
+        listens to every radio receiver at once and combines them into one stream
+        """
+        ports = self.serial_reader.available_ports()
+        if len(ports) > 0:
+            self.diversity_reader.serial_ports = ports
+            self.listen_to_serial(self.diversity_reader, ", ".join(ports))
+
+    def listen_to_serial(self, reader, port):
         if self.confirm_stop():
             self.reset() # if user has decided to cancel current operation then we should also reset
         else:
             return
 
-        if port in self.serial_reader.available_ports():
-            yesnocancel = messagebox.askyesnocancel(f"Listen on serial port {port}",
-                                                    "Do you want to save a backup of this telemetry to disk?")
+        yesnocancel = messagebox.askyesnocancel(f"Listen on serial port {port}",
+                                                "Do you want to save a backup of this telemetry to disk?")
 
-            if yesnocancel is None:
-                return
+        if yesnocancel is None:
+            return
 
-            self.reset()
+        self.reset()
 
-            if yesnocancel:
-                filename = asksaveasfilename(title="Choose backup file name", defaultextension=".tlm", filetypes =[('Binary Telemetry Data', '*.tlm')])
-                if filename != "":
-                    self.serial_reader.filename = filename
-                    self.state = AppState.RECORDING_SERIAL
-                    self.map_column.set_status_text(f"Recording {port} to {os.path.basename(filename)}", Colors.WHITE, Colors.DARK_RED)
-                else:
-                    return
+        if yesnocancel:
+            filename = asksaveasfilename(title="Choose backup file name", defaultextension=".tlm", filetypes =[('Binary Telemetry Data', '*.tlm')])
+            if filename != "":
+                reader.filename = filename
+                self.state = AppState.RECORDING_SERIAL
+                self.map_column.set_status_text(f"Recording {port} to {os.path.basename(filename)}", Colors.WHITE, Colors.DARK_RED)
             else:
-                # print(f"Not saving telemetry from serial port {port} to file")
-                self.state = AppState.READING_SERIAL
-                self.map_column.set_status_text(f"Listening to {port}", Colors.WHITE, Colors.DARK_BLUE)
+                return
+        else:
+            # print(f"Not saving telemetry from serial port {port} to file")
+            self.state = AppState.READING_SERIAL
+            self.map_column.set_status_text(f"Listening to {port}", Colors.WHITE, Colors.DARK_BLUE)
 
-            self.current_reader = self.serial_reader
-            self.serial_reader.serial_port = port
-            self.serial_reader.start()
-            self.start()
+        self.current_reader = reader
+        reader.start()
+        self.start()
 
     def open_telemetry_file(self):
         if self.confirm_stop():
@@ -461,7 +650,8 @@ class TelemetryApp(Tk):
                                                ('Telemetry Text Files', '*.csv')])
 
         self.state = AppState.READING_FILE
-        self.map_column.set_status_text(f"Playing: {filename.split('/')[-1]}", Colors.WHITE, Colors.DARK_GREEN)
+        self.playing_name = filename.split('/')[-1]
+        self.map_column.set_status_text(f"Playing: {self.playing_name}", Colors.WHITE, Colors.DARK_GREEN)
 
         if filename.endswith(".tlm"):
             self.current_reader = self.tlm_file_reader
@@ -0,0 +1,389 @@
+import numpy
+import os
+from time import perf_counter
+from zlib import crc32
+from cobs import cobsr
+from TelemetryDecoder import *
+from TelemetryPipeline import SYNC_WORD, CHECKSUM_LENGTH
+from TelemetryFile import TlmFile
+
+"""
+Telemetry Arrays:
+
+bulk loading of whole telemetry files into NumPy structured arrays, for
+post-flight analysis instead of replaying the file through the UI.
+
+load_tlm() reads a .tlm backup file (either version, see TelemetryFile): the
+only per-packet Python work is framing, COBS/R and CRC32. Packets are grouped by type and then decoded all at
+once with numpy.frombuffer using the dtypes from TelemetrySchema, and scaling
+and derived fields are computed as vector operations.
+
+Result is a dict of DecoderState: structured array (one row per packet, or
+per sample for in-flight packets). Every table has a "frame" column with the
+index of the packet in the file so packets of different types can be put
+back in order.
+
+load_sd() does the same for SD-card CSV logs: key rows are found with
+SDCardTelemetryDecoder, and the value rows under each key row are collected
+and converted a whole column at a time. Files are read in chunks so logs
+larger than memory can be processed with iter_sd() one chunk at a time.
+Tables have a "line" column (line number in the file) and a "flight" column
+(number of in-flight key rows before it) so flights of a multi-flight log
+can be told apart.
+"""
+
+FRAME_INDEX_KEY = "frame"
+FRAME_INDEX_DTYPE = "<i8"
+
+LINE_INDEX_KEY = "line"
+FLIGHT_INDEX_KEY = "flight"
+SD_CHUNK_SIZE = 16 * 1024 * 1024 # bytes of lines read at once
+SD_TEXT_LENGTH = 64 # longest text value kept by the fast parser
+SD_TEXT_CONVERTERS = (str.strip, SDCardTelemetryDecoder.parse_value)
+
+
+def load_tlm(filename: str, layout_version: int = DEFAULT_LAYOUT_VERSION) -> dict:
+    """
+    reads the whole TLM file at filename into one structured array per packet type
+    """
+    with open(filename, 'rb') as file:
+        tlm = TlmFile(file)
+        if tlm.version == 1:
+            file.seek(0)
+            raw_data = file.read()
+        else:
+            # only the frames, without their records (and receive times)
+            raw_data = b"".join(raw for (_, raw) in tlm.frames())
+        tlm.close()
+
+    return decode_tlm(raw_data, layout_version)
+
+
+def decode_tlm(raw_data: bytes, layout_version: int = DEFAULT_LAYOUT_VERSION) -> dict:
+    """
+    decodes a buffer of sync-word separated COBS/R frames (contents of a TLM file)
+    """
+    layout = get_layout(layout_version)
+
+    # (schema, packet length): ([telemetry bytes], [frame indexes])
+    groups = {}
+
+    # Framing, COBS/R and CRC32 are the only steps done packet by packet:
+    # (CRC check is TelemetryPipeline.check_crc32() inlined, without debug output)
+    for (index, packet) in enumerate(raw_data.split(SYNC_WORD)):
+        try:
+            buffer = memoryview(cobsr.decode(packet))
+        except cobsr.DecodeError:
+            continue
+
+        if len(buffer) <= CHECKSUM_LENGTH:
+            continue
+
+        telemetry_bytes = buffer[:-CHECKSUM_LENGTH]
+        if crc32(telemetry_bytes) != int.from_bytes(buffer[-CHECKSUM_LENGTH:], "big"):
+            continue
+
+        schema = layout.event_table[telemetry_bytes[0]]
+        if not schema.fields:
+            continue # error events carry no telemetry
+
+        (payloads, indexes) = groups.setdefault((schema, len(telemetry_bytes)), ([], []))
+        payloads.append(telemetry_bytes)
+        indexes.append(index)
+
+    tables = {}
+
+    for ((schema, length), (payloads, indexes)) in groups.items():
+        try:
+            table = decode_group(schema, length, b"".join(payloads), indexes)
+        except DecodingError as error:
+            print(f"Skipping {len(payloads)} {schema.name} packets: {error}")
+            continue
+
+        tables.setdefault(schema.state, []).append(table)
+
+    # packets of one type but different lengths (e.g. number of samples) are joined back in file order
+    for (state, state_tables) in tables.items():
+        table = numpy.concatenate(state_tables) if len(state_tables) > 1 else state_tables[0]
+        tables[state] = table[numpy.argsort(table[FRAME_INDEX_KEY], kind="stable")]
+
+    return tables
+
+
+def decode_group(schema: PacketSchema, length: int, data: bytes, indexes: list):
+    """
+    decodes data made of packets of one schema all of the same length
+    """
+    indexes = numpy.array(indexes, dtype=FRAME_INDEX_DTYPE)
+
+    if schema.metadata is None:
+        if length != schema.size:
+            raise DecodingError(f"{schema.name} should be {schema.size} bytes but got {length}")
+
+        raw = numpy.frombuffer(data, dtype=schema.dtype)
+        columns = {name: raw[name] for name in schema.keys}
+
+    else:
+        samples_length = length - schema.metadata.size
+
+        if samples_length <= 0 or samples_length % schema.size != 0:
+            raise DecodingError(f"{schema.name} packet of {length} bytes does not contain whole samples")
+
+        if schema.samples is not None and samples_length != schema.samples * schema.size:
+            raise DecodingError(f"{schema.name} should have {schema.samples} samples")
+
+        samples = samples_length // schema.size
+        raw = numpy.frombuffer(data, dtype=schema.packet_dtype(samples))
+
+        # one row per sample, with the metadata of its packet repeated
+        columns = {name: raw["samples"][name].reshape(-1) for name in schema.keys}
+        columns |= {name: numpy.repeat(raw[name], samples) for name in schema.metadata.keys}
+        indexes = numpy.repeat(indexes, samples)
+
+    fields = list(schema.fields) + (list(schema.metadata.fields) if schema.metadata is not None else [])
+
+    return build_table(fields, columns, indexes)
+
+
+def build_table(fields: list, columns: dict, indexes):
+    """
+    applies each field's modifier as a vector operation and adds derived
+    fields, then packs it all into one structured array
+    """
+    table = {FRAME_INDEX_KEY: indexes}
+
+    for field in fields:
+        column = columns[field.name]
+
+        if field.type.startswith(CHAR_TYPE_PREFIX):
+            # names and callsigns hardly ever change, so only decode each distinct one once
+            (texts, inverse) = numpy.unique(column, return_inverse=True)
+            column = numpy.array([text_modifier(text) for text in texts] or [""])[inverse]
+        elif field.scale is not None and field.rounded:
+            column = numpy.rint(column * field.scale).astype(numpy.int64)
+        elif field.scale is not None:
+            column = column * field.scale
+
+        table[field.name] = column
+
+    if "roll" in table:
+        # turns keep the sign of roll to show direction of turn
+        roll = table["roll"].astype(numpy.int64)
+        sign = numpy.where(roll < 0, -1, 1)
+        (turns, bound_roll) = numpy.divmod(numpy.abs(roll), 360)
+        table["turns"] = turns * sign
+        table["boundRoll"] = bound_roll * sign
+
+    return pack_table(table, len(indexes))
+
+
+def pack_table(table: dict, length: int):
+    """
+    packs a dict of name: column into one structured array
+    """
+    result = numpy.empty(length, dtype=[(name, column.dtype) for (name, column) in table.items()])
+
+    for (name, column) in table.items():
+        result[name] = column
+
+    return result
+
+
+def load_sd(filename: str,
+            accel_resolution: int = SDCardTelemetryDecoder.DEFAULT_ACCEL_RESOLUTION,
+            chunk_size: int = SD_CHUNK_SIZE) -> dict:
+    """
+    reads the whole SD-card log at filename into one structured array per section
+    (DecoderState.INFLIGHT, MAXES, LAUNCH, LAND and POSTFLIGHT)
+    """
+    start = perf_counter()
+    tables = {}
+
+    for (state, table) in iter_sd(filename, accel_resolution, chunk_size):
+        tables.setdefault(state, []).append(table)
+
+    for (state, state_tables) in tables.items():
+        tables[state] = join_tables(state_tables)
+
+    elapsed = perf_counter() - start
+    size = os.path.getsize(filename) / 1e6
+    print(f"Loaded {filename}: {size:.1f}MB in {elapsed:.2f}s ({size / elapsed:.1f}MB/s)")
+
+    return tables
+
+
+def iter_sd(filename: str,
+            accel_resolution: int = SDCardTelemetryDecoder.DEFAULT_ACCEL_RESOLUTION,
+            chunk_size: int = SD_CHUNK_SIZE):
+    """
+    yields (DecoderState, structured array) for every run of value rows under
+    one key row, read chunk_size bytes of lines at a time. Runs which cross a
+    chunk boundary come out as more than one table
+    """
+    decoder = SDCardTelemetryDecoder(accel_resolution)
+    line_number = 0
+    flight = 0
+
+    with open(filename, 'rt') as file:
+        while lines := file.readlines(chunk_size):
+            (tables, flight) = decode_sd_lines(decoder, lines, line_number, flight)
+            line_number += len(lines)
+            yield from tables
+
+
+def decode_sd_lines(decoder: SDCardTelemetryDecoder, lines: list, line_number: int = 0, flight: int = 0):
+    """
+    splits lines of an SD-card log into value rows under each key row, using
+    the decoder's key row detection (and keeping its state between chunks).
+    Returns ([(DecoderState, structured array)], flight number at the end)
+    """
+    tables = []
+    rows = []
+    indexes = []
+    header = decoder.header # key row of the value rows being collected
+
+    for (index, line) in enumerate(lines, line_number):
+        (first, comma, _) = line.partition(",")
+        if not comma:
+            continue
+
+        # same order of checks as SDCardTelemetryDecoder.decode(), but lines
+        # are only split when they might be key rows
+        if not (decoder.state == DecoderState.INFLIGHT and first.isnumeric()):
+            if decoder.read_header(line, line.split(",")) is not None:
+                if rows:
+                    tables.append(build_sd_table(decoder, header, rows, indexes, flight))
+                    (rows, indexes) = ([], [])
+
+                header = decoder.header
+                if header.state == DecoderState.INFLIGHT:
+                    flight += 1
+                continue
+
+        if header is not None:
+            rows.append(line)
+            indexes.append(index)
+
+    if rows:
+        tables.append(build_sd_table(decoder, header, rows, indexes, flight))
+
+    return (tables, flight)
+
+
+def build_sd_table(decoder: SDCardTelemetryDecoder, header: SDCardHeader, rows: list, indexes: list, flight: int):
+    """
+    converts value rows (lines) under one header into a structured array.
+    Rows are parsed with numpy.loadtxt using a dtype made from the header's
+    column converters, or one column at a time if that fails (blank cells,
+    short rows or values of another type)
+    """
+    for column in header.columns:
+        if column[1] is None:
+            # columns pick their type from their first value, like decode_columns() does
+            infer_converters(decoder, header, rows)
+            break
+
+    table = {LINE_INDEX_KEY: numpy.array(indexes, dtype=FRAME_INDEX_DTYPE),
+             FLIGHT_INDEX_KEY: numpy.full(len(rows), flight, dtype=FRAME_INDEX_DTYPE)}
+
+    try:
+        columns = load_columns(header, rows)
+    except ValueError:
+        columns = convert_columns(header, rows)
+
+    for (key, column) in columns.items():
+        divisor = decoder.divisors.get(key)
+        table[key] = column / divisor if divisor is not None else column
+
+    return (header.state, pack_table(table, len(rows)))
+
+
+def infer_converters(decoder: SDCardTelemetryDecoder, header: SDCardHeader, rows: list) -> None:
+    for row in rows:
+        for (column, value) in zip(header.columns, row.split(",")):
+            if column[1] is None and value and not value.isspace():
+                column[1] = decoder.infer_converter(value)
+
+        if all(converter is not None for (_, converter) in header.columns):
+            return
+
+
+def column_dtype(converter) -> str:
+    if converter is int:
+        return "<i8"
+    if converter in SD_TEXT_CONVERTERS:
+        return f"U{SD_TEXT_LENGTH}"
+    return "<f8" # floats, scaled columns (time, accel) and columns with nothing in them yet
+
+
+def load_columns(header: SDCardHeader, rows: list) -> dict:
+    """
+    fast path: NumPy's CSV parser converts all rows at once
+    """
+    dtype = [(key, column_dtype(converter)) for (key, converter) in header.columns]
+    raw = numpy.loadtxt(rows, delimiter=",", dtype=dtype, usecols=range(len(dtype)), ndmin=1)
+
+    columns = {}
+    for (key, _) in header.columns:
+        column = raw[key]
+        if column.dtype.kind == "U":
+            column = numpy.char.strip(column)
+            column = column.astype(f"U{max(1, numpy.char.str_len(column).max(initial=0))}")
+        columns[key] = column
+
+    return columns
+
+
+def convert_columns(header: SDCardHeader, rows: list) -> dict:
+    """
+    slow path: splits every row and converts one column at a time
+    """
+    num_keys = len(header.columns)
+    items = []
+
+    for row in rows:
+        values = row.split(",")
+        if len(values) < num_keys:
+            values.extend([""] * (num_keys - len(values)))
+        items.append(values)
+
+    return {key: convert_column(values, converter)
+            for ((key, converter), values) in zip(header.columns, zip(*items))}
+
+
+def convert_column(values: tuple, converter):
+    """
+    converts one column of text items to an array: int and float columns are
+    parsed by NumPy in one go, anything else is kept as text. Blank or odd
+    items in a number column turn it into floats with NaN for the blanks
+    """
+    dtype = column_dtype(converter)
+
+    if dtype.startswith("U"):
+        return numpy.array([value.strip() for value in values])
+
+    try:
+        return numpy.array(values, dtype=dtype)
+    except ValueError:
+        return numpy.array([parse_number(value) for value in values], dtype=numpy.float64)
+
+
+def parse_number(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return numpy.nan
+
+
+def join_tables(tables: list):
+    """
+    joins tables of one section: tables from different key rows can have
+    different columns (e.g. firmware versions), so only the columns all
+    of them share are kept
+    """
+    if len(tables) == 1:
+        return tables[0]
+
+    names = [name for name in tables[0].dtype.names if all(name in table.dtype.names for table in tables)]
+    columns = {name: numpy.concatenate([table[name] for table in tables]) for name in names}
+    return pack_table(columns, len(columns[LINE_INDEX_KEY]))
@@ -0,0 +1,257 @@
+from threading import Thread
+from time import monotonic
+import locale
+import os
+import queue
+
+"""
+Telemetry Backup:
+
+writes the TLM and CSV backup files on a thread of their own, so a slow SD
+card or USB stick never holds up reading the radio.
+
+Readers open the files as usual and hand them to a BackupWriter, which gives
+back a BackupFile to write to instead. BackupFile.write() only puts the data
+on the writer's queue and returns straight away; the writer thread writes
+it and commits in groups: the files are flushed once every flush_interval
+seconds or flush_bytes bytes (whichever comes first) instead of after every
+packet, and optionally fsync'ed every fsync_interval seconds so a power cut
+loses at most that much data.
+
+Metrics (queue depth, time spent writing, and commit latency: how long data
+waited between write() and reaching the OS) are in BackupWriter.report()
+"""
+
+BACKUP_FLUSH_INTERVAL = 0.1 # seconds between flushes of the backup files
+BACKUP_FLUSH_BYTES = 65536 # flush sooner if this much data is waiting
+BACKUP_FSYNC_INTERVAL = None # seconds between fsyncs (None: leave it to the OS)
+
+WRITE = 0
+TRUNCATE = 1
+
+
+class BackupFile(object):
+    """
+    Stand-in for a backup file which queues everything for the BackupWriter.
+    Keeps track of its own position so tell() doesn't have to wait for the disk.
+
+    Text files are opened in binary mode and encoded here, the same way
+    open(filename, 'wt') would
+    """
+    def __init__(self, writer: "BackupWriter", file, filename: str, text: bool = False) -> None:
+        self.writer = writer
+        self.file = file
+        self.filename = filename
+        self.text = text
+        self.encoding = locale.getpreferredencoding(False)
+        self.position = 0
+
+    def write(self, data) -> None:
+        if self.text:
+            if os.linesep != "\n":
+                data = data.replace("\n", os.linesep)
+            data = data.encode(self.encoding)
+
+        self.position += len(data)
+        self.writer.queue.put((self, WRITE, data, monotonic()))
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, position: int) -> None:
+        self.position = position
+
+    def truncate(self) -> None:
+        """
+        drops everything after the current position (what seek() then truncate() does on a file)
+        """
+        self.writer.queue.put((self, TRUNCATE, self.position, monotonic()))
+
+    def flush(self) -> None:
+        pass # the writer flushes in groups
+
+    def close(self) -> None:
+        self.writer.remove(self)
+
+
+class BackupWriter(object):
+    """
+    Writer thread for any number of BackupFiles
+    """
+    def __init__(self,
+                 flush_interval: float = BACKUP_FLUSH_INTERVAL,
+                 flush_bytes: int = BACKUP_FLUSH_BYTES,
+                 fsync_interval: float | None = BACKUP_FSYNC_INTERVAL,
+                 name: str = "backup_writer") -> None:
+
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync_interval = fsync_interval
+        self.name = name
+        self.queue = queue.SimpleQueue() # (BackupFile, WRITE/TRUNCATE, data, time queued), None to stop
+        self.files = []
+        self.thread = None
+
+        # metrics
+        self.bytes_written = 0
+        self.writes = 0
+        self.truncates = 0
+        self.flushes = 0
+        self.fsyncs = 0
+        self.errors = 0
+        self.max_depth = 0 # most writes ever waiting in the queue
+        self.write_seconds = 0.0 # time spent in write(), flush() and fsync()
+        self.max_write_seconds = 0.0 # longest single flush (with its fsync)
+        self.max_latency = 0.0 # longest time data waited between BackupFile.write() and a flush
+        self.total_latency = 0.0
+        self.committed = 0 # writes flushed, for the mean latency
+
+    def add(self, file, filename: str, text: bool = False) -> BackupFile:
+        """
+        takes over an open file (opened in binary mode), returns the BackupFile to write to
+        """
+        backup_file = BackupFile(self, file, filename, text)
+        self.files.append(backup_file)
+
+        if self.thread is None:
+            self.thread = Thread(target=self.__run__, name=self.name, daemon=True)
+            self.thread.start()
+
+        return backup_file
+
+    def remove(self, backup_file: BackupFile) -> None:
+        """
+        closes backup_file once everything written to it is on disk (doesn't wait)
+        """
+        self.queue.put((backup_file, None, None, monotonic()))
+
+    def close(self) -> None:
+        """
+        writes everything still queued, closes every file and stops the thread
+        """
+        if self.thread is None:
+            return
+
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def __run__(self) -> None:
+        pending = [] # time queued of every write not flushed yet
+        pending_bytes = 0
+        dirty = set() # files written to since the last flush
+        deadline = None # when the oldest pending write must be flushed
+        last_fsync = monotonic()
+
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - monotonic())
+
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+
+            if item is None:
+                break
+
+            if item:
+                self.max_depth = max(self.max_depth, self.queue.qsize() + 1)
+                (backup_file, action, data, queued) = item
+
+                if action is None:
+                    self.commit(dirty, pending, force_sync=True)
+                    pending = []
+                    pending_bytes = 0
+                    dirty = set()
+                    deadline = None
+                    self.close_file(backup_file)
+                    continue
+
+                self.apply(backup_file, action, data)
+                dirty.add(backup_file)
+                pending.append(queued)
+                if action == WRITE:
+                    pending_bytes += len(data)
+                if deadline is None:
+                    deadline = queued + self.flush_interval
+
+            now = monotonic()
+            if pending and (pending_bytes >= self.flush_bytes or now >= deadline):
+                sync = self.fsync_interval is not None and now - last_fsync >= self.fsync_interval
+                self.commit(dirty, pending, sync)
+                if sync:
+                    last_fsync = now
+                pending = []
+                pending_bytes = 0
+                dirty = set()
+                deadline = None
+
+        self.commit(dirty, pending, force_sync=True)
+        for backup_file in list(self.files):
+            self.close_file(backup_file)
+
+    def apply(self, backup_file: BackupFile, action: int, data) -> None:
+        start = monotonic()
+
+        try:
+            if action == WRITE:
+                backup_file.file.write(data)
+                self.bytes_written += len(data)
+                self.writes += 1
+            else:
+                backup_file.file.seek(data)
+                backup_file.file.truncate()
+                self.truncates += 1
+        except Exception as error:
+            self.errors += 1
+            print(f"Error writing to file {backup_file.filename}:\n{error}")
+
+        self.write_seconds += monotonic() - start
+
+    def commit(self, dirty: set, pending: list, sync: bool = False, force_sync: bool = False) -> None:
+        """
+        flushes every file written to (and fsyncs them if sync, or if force_sync and fsync is on)
+        """
+        start = monotonic()
+        sync = sync or (force_sync and self.fsync_interval is not None)
+
+        for backup_file in dirty:
+            try:
+                backup_file.file.flush()
+                if sync:
+                    os.fsync(backup_file.file.fileno())
+                    self.fsyncs += 1
+            except Exception as error:
+                self.errors += 1
+                print(f"Error writing to file {backup_file.filename}:\n{error}")
+
+        end = monotonic()
+        self.flushes += 1
+        self.write_seconds += end - start
+        self.max_write_seconds = max(self.max_write_seconds, end - start)
+
+        for queued in pending:
+            latency = end - queued
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        self.committed += len(pending)
+
+    def close_file(self, backup_file: BackupFile) -> None:
+        try:
+            backup_file.file.close()
+        except Exception as error:
+            print(f"Error closing file {backup_file.filename}:\n{error}")
+
+        if backup_file in self.files:
+            self.files.remove(backup_file)
+
+    def report(self) -> str:
+        mean_latency = self.total_latency / self.committed if self.committed else 0
+        return (f"backup: {self.bytes_written} bytes in {self.writes} writes, {self.truncates} truncates, {self.flushes} flushes, {self.fsyncs} fsyncs, {self.errors} errors\n"
+                f"  queue depth max: {self.max_depth}   time writing: {1000 * self.write_seconds:.1f}ms"
+                f" (longest flush {1000 * self.max_write_seconds:.1f}ms)"
+                f"   commit latency mean: {1000 * mean_latency:.1f}ms max: {1000 * self.max_latency:.1f}ms")
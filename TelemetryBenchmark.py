@@ -0,0 +1,1052 @@
+"""
+Micro-benchmarks for the telemetry decoding path
+
+Run with:
+    python TelemetryBenchmark.py            (all benchmarks)
+    python TelemetryBenchmark.py decode     (only the named benchmark)
+
+Each benchmark prints packets (or rows) per second for the old way of doing
+things next to the current code, so changes to the hot path can be checked on
+the same machine they will run on in the field.
+"""
+
+import struct
+import sys
+from time import perf_counter, sleep
+from zlib import crc32
+from cobs import cobsr
+from TelemetryDecoder import *
+from TelemetryReader import TelemetryReader, SYNC_WORD, CHECKSUM_LENGTH, CSV_CHECKPOINT_INTERVAL
+
+CALLSIGN = "QQ0523".encode("ascii")
+NAME = "Test Flight Rocket 1".encode("ascii")
+
+DEFAULT_REPEATS = 50000
+
+
+def test_packets(num_samples: int = 1) -> list:
+    """
+    one packet of each type, the same as TelemetryTestSender sends
+    (in-flight packet has num_samples samples followed by the metadata)
+    """
+    flight_packet = b"".join(struct.pack(InFlightData.format, 1, 500 + i, 200, 300, 1100, 2200, 505)
+                             for i in range(num_samples))
+    flight_packet += struct.pack(InFlightMetaData.format, 10, 220, 45.79160, 0.59950, CALLSIGN)
+
+    return [struct.pack(PreFlightPacket.format, 0, True, 2, NAME, 120, 220, 45.79166, 0.59956, 3, CALLSIGN),
+            flight_packet,
+            struct.pack(PostFlightPacket.format, 26, 100, 200, 3, 1000, True, 1001, 45.79166, 0.59956, CALLSIGN)]
+
+
+def test_frames(num_samples: int = 1) -> list:
+    """
+    test packets as they come out of the radio: CRC32 appended, COBS/R encoded, sync word
+    """
+    frames = []
+
+    for packet in test_packets(num_samples):
+        packet += int.to_bytes(crc32(packet), CHECKSUM_LENGTH)
+        frames.append(cobsr.encode(packet) + SYNC_WORD)
+
+    return frames
+
+
+def legacy_decode(data_bytes: bytes) -> list:
+    """
+    RadioTelemetryDecoder.decode() as it was before packets had a compiled
+    struct: format string parsed on every call, tuple -> list -> dict,
+    and every in-flight sample sliced (copied) out of the packet
+    """
+    def as_dict(packet_class, packet_bytes):
+        values = list(struct.unpack(packet_class.format, packet_bytes))
+        return dict(zip(packet_class.keys, values))
+
+    event = data_bytes[0]
+    length = InFlightData.size
+
+    if event == 0 or event == 30:
+        return [as_dict(PreFlightPacket, data_bytes)]
+
+    elif event < 26:
+        total_length = len(data_bytes) - InFlightMetaData.size
+        messages = [as_dict(InFlightData, data_bytes[index:index + length])
+                    for index in range(0, total_length, length)]
+        messages.append(as_dict(InFlightMetaData, data_bytes[total_length:]))
+        return messages
+
+    else:
+        return [as_dict(PostFlightPacket, data_bytes)]
+
+
+def legacy_frame(raw_buffer: bytes) -> list:
+    """
+    COBS -> CRC -> decode as the readers did it before, slicing at every step
+    """
+    buffer = cobsr.decode(raw_buffer[:-1])
+    received_crc32 = buffer[-CHECKSUM_LENGTH:]
+    telemetry_bytes = buffer[:-CHECKSUM_LENGTH]
+
+    if received_crc32 != int.to_bytes(crc32(telemetry_bytes), CHECKSUM_LENGTH):
+        return None
+
+    return legacy_decode(telemetry_bytes)
+
+
+def legacy_enrich(decoder: RadioTelemetryDecoder, packets: list) -> dict:
+    """
+    the chain of passes the readers used to run on every decoded packet:
+    merge dicts, apply_modifiers(), then generate_float_strings(),
+    generate_roll_turns() and generate_name_strings() merged back in with |=
+    """
+    telemetry = {}
+    for packet in packets:
+        telemetry |= packet.as_dict()
+
+    telemetry = decoder.apply_modifiers(telemetry)
+
+    float_strings = {}
+    for key, value in telemetry.items():
+        if key in decoder.floats:
+            float_strings[f"{key}String"] = decoder.floats_modifier(value)
+    telemetry |= float_strings
+
+    if decoder.state == DecoderState.INFLIGHT:
+        roll = int(telemetry["roll"])
+        sign = 1
+        if roll < 0:
+            roll *= -1
+            sign = -1
+        turns, bound_roll = divmod(roll, 360)
+        telemetry |= {"turns": turns * sign, "boundRoll": bound_roll * sign}
+
+    name_strings = {}
+    try:
+        event = telemetry["event"]
+        name_strings["eventName"] = f"{decoder.event_names[event]} [{event}]"
+    except KeyError:
+        pass
+    try:
+        cont = telemetry["cont"]
+        name_strings["contName"] = f"{decoder.cont_names[cont]} [{cont}]"
+    except KeyError:
+        pass
+    telemetry |= name_strings
+
+    return telemetry
+
+
+SD_INFLIGHT_KEYS = ["accelX", "accelY", "accelZ", "gyroX", "gyroY", "gyroZ", "highGx", "highGy", "highGz",
+                    "smoothHighGz", "offVert", "intVel", "intAlt", "fusionVel", "fusionAlt", "fltEvents",
+                    "radioCode", "baroAlt", "altMoveAvg", "gnssLat", "gnssLon", "gnssSpeed", "gnssAlt",
+                    "gnssAngle", "gnssSatellites", "radioPacketNum"]
+
+
+def test_sd_lines(num_rows: int = 20000) -> list:
+    """
+    lines of an SD-card log: in-flight key row, in-flight rows at 1kHz, then maximums and postflight
+    """
+    lines = ["Test Flight Rocket 1," + ",".join(SD_INFLIGHT_KEYS) + ",\n"]
+
+    for i in range(num_rows):
+        lines.append(f"{i * 1000},{i % 50 - 25},12,{4000 + i % 300},-3,5,{i % 7},101,-98,{2000 + i % 90},"
+                     f"1999,{i % 45},{i // 10},{i // 3},{i // 10},{i // 3},00010010,"
+                     f"3,{i // 3 + 2},{i // 3 + 1},45.791664,-0.599557,{i % 300},{i // 3},"
+                     f"{i % 360},9,{i // 20},\n")
+
+    lines.append("Max Baro Alt,Max GPS Alt,Max Velocity,Max Accel,\n")
+    lines.append("6667,6650,412,25.3,\n")
+    lines.append("Rocket Name,callsign,date,\n")
+    lines.append("Test Flight Rocket 1,QQ0523,2023/12/06,\n")
+
+    return lines
+
+
+class LegacySDCardDecoder(SDCardTelemetryDecoder):
+    """
+    SDCardTelemetryDecoder as it was before columns were compiled from key rows
+    """
+    def decode(self, line: str) -> dict | None:
+        items = line.split(",")
+        if len(items) < 2:
+            return None
+
+        if self.state == DecoderState.INFLIGHT and items[0].isnumeric():
+            return self.decode_telemetry_values(items)
+
+        for state, unique_key in self.unique_keys.items():
+            if unique_key in items:
+                self.state = state
+                self.telemetry_keys = [SDCardTelemetryDecoder.format_key(key) for key in items if key.strip()]
+
+                if state == DecoderState.INFLIGHT:
+                    self.telemetry_keys[0] = "time"
+                    return {"name": items[0]}
+                else:
+                    return None
+
+        return self.decode_telemetry_values(items)
+
+    def decode_telemetry_values(self, values) -> dict | None:
+        try:
+            telemetry_dict = {key: value for (key, value) in zip(self.telemetry_keys, values) if value.strip()}
+        except Exception:
+            return None
+
+        return self.apply_modifiers(telemetry_dict)
+
+
+def decode_all(decoder_class):
+    """
+    function decoding a whole list of SD-card lines with a new decoder_class
+    """
+    decoder = decoder_class()
+    return lambda lines: [decoder.decode(line) for line in lines]
+
+
+def timed(function, packets: list, repeats: int, rounds: int = 5) -> float:
+    """
+    calls function on every packet repeats times and returns packets/second
+    (best of a few rounds, so a busy machine doesn't hide the difference)
+    """
+    best = float("inf")
+
+    for _ in range(rounds):
+        start = perf_counter()
+
+        for _ in range(repeats // rounds):
+            for packet in packets:
+                function(packet)
+
+        best = min(best, perf_counter() - start)
+
+    return ((repeats // rounds) * len(packets)) / best
+
+
+def report(name: str, before: float, after: float, units: str = "packets/s") -> None:
+    print(f"{name:<32} before: {before:>12,.0f} {units}   after: {after:>12,.0f} {units}   ({after / before:.2f}x)")
+
+
+def benchmark_decode(repeats: int = DEFAULT_REPEATS) -> None:
+    packets = test_packets()
+    decoder = RadioTelemetryDecoder()
+
+    before = timed(legacy_decode, packets, repeats)
+    after = timed(decoder.decode, packets, repeats)
+    report("decode (records only)", before, after)
+
+    def decode_dicts(packet):
+        return [message.as_dict() for message in decoder.decode(packet)]
+
+    after = timed(decode_dicts, packets, repeats)
+    report("decode + as_dict()", before, after)
+
+
+def benchmark_frame(repeats: int = DEFAULT_REPEATS) -> None:
+    frames = test_frames(num_samples=4)
+    decoder = RadioTelemetryDecoder()
+
+    def decode_frame(raw_buffer):
+        buffer = cobsr.decode(raw_buffer[:-1])
+        return decoder.decode(TelemetryReader.check_crc32(buffer))
+
+    before = timed(legacy_frame, frames, repeats)
+    after = timed(decode_frame, frames, repeats)
+    report("COBS+CRC+decode (4 samples)", before, after)
+
+
+def benchmark_enrich(repeats: int = DEFAULT_REPEATS) -> None:
+    decoder = RadioTelemetryDecoder()
+
+    # decode once, then time only what happens to the decoded packets
+    # (decoder state has to match the packet for the legacy roll pass)
+    decoded = [(decoder.decode(packet), decoder.schema, decoder.state) for packet in test_packets(num_samples=4)]
+
+    def legacy(item):
+        (packets, decoder.schema, decoder.state) = item
+        return legacy_enrich(decoder, packets)
+
+    def fused(item):
+        (packets, decoder.schema, decoder.state) = item
+        return decoder.enrich(packets)
+
+    for item in decoded:
+        assert legacy(item) == fused(item), "fused enrichment doesn't match legacy passes"
+
+    before = timed(legacy, decoded, repeats)
+    after = timed(fused, decoded, repeats)
+    report("enrich (modifiers+strings)", before, after)
+
+
+def test_session(num_preflight: int = 1000,
+                 num_inflight: int = 20000,
+                 num_postflight: int = 1000,
+                 num_samples: int = 4) -> bytes:
+    """
+    a recorded session as written to a TLM backup file
+    """
+    (preflight, inflight, postflight) = test_frames(num_samples)
+    return preflight * num_preflight + inflight * num_inflight + postflight * num_postflight
+
+
+def benchmark_tlm(repeats: int = 3) -> None:
+    import TelemetryArrays
+
+    raw_data = test_session()
+    decoder = RadioTelemetryDecoder()
+    num_packets = raw_data.count(SYNC_WORD)
+
+    def per_packet(raw_data):
+        # what BinaryFileReader does for every packet (without the replay sleeps)
+        for packet in raw_data.split(SYNC_WORD):
+            if packet:
+                telemetry_bytes = TelemetryReader.check_crc32(cobsr.decode(packet))
+                decoder.enrich(decoder.decode(telemetry_bytes))
+
+    before = num_packets / (1 / timed(per_packet, [raw_data], repeats, rounds=repeats))
+    after = num_packets / (1 / timed(TelemetryArrays.decode_tlm, [raw_data], repeats, rounds=repeats))
+    report(f"TLM file ({len(raw_data) / 1e6:.1f}MB)", before, after)
+
+
+def benchmark_tlm_stream(num_inflight: int = 200000) -> None:
+    """
+    first frame latency, frames/s and Python memory peak splitting a big
+    TLM file into frames: whole file read and split, against TlmFile on mmap
+    """
+    import os
+    import tempfile
+    import tracemalloc
+    from TelemetryFile import TlmFile
+
+    raw_data = test_session(num_inflight=num_inflight)
+    (handle, filename) = tempfile.mkstemp(suffix=".tlm")
+    with os.fdopen(handle, "wb") as file:
+        file.write(raw_data)
+    del raw_data
+
+    def whole_file() -> tuple:
+        start = perf_counter()
+        with open(filename, "rb") as file:
+            frames = iter(file.read().split(SYNC_WORD))
+            next(frames)
+            first = perf_counter() - start
+            return (first, 1 + sum(1 for frame in frames if frame))
+
+    def mapped() -> tuple:
+        start = perf_counter()
+        with open(filename, "rb") as file:
+            tlm = TlmFile(file)
+            frames = tlm.frames()
+            next(frames)
+            first = perf_counter() - start
+            count = 1 + sum(1 for frame in frames)
+            tlm.close()
+            return (first, count)
+
+    results = []
+    for function in (whole_file, mapped):
+        start = perf_counter()
+        (first, count) = function()
+        seconds = perf_counter() - start
+
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append((count / seconds, peak, first))
+
+    os.remove(filename)
+
+    ((before, before_peak, before_first), (after, after_peak, after_first)) = results
+    report(f"TLM split ({num_inflight} in-flight)", before, after, "frames/s")
+    print(f"{'':<32} before: {before_peak / 1e6:>9.1f}MB peak   after: {after_peak / 1e6:>9.1f}MB peak")
+    print(f"{'':<32} before: {1000 * before_first:>9.2f}ms to first frame   after: {1000 * after_first:>9.2f}ms to first frame")
+
+
+def benchmark_playback(minutes: float = 40.0, flight_seconds: float = 30.0) -> None:
+    """
+    a long session (mostly preflight at 10Hz, then flight_seconds of
+    in-flight packets at 20Hz): time to get to liftoff playing at 1x, against
+    building the index, seeking to liftoff and playing the flight unthrottled
+    """
+    import os
+    import queue
+    import tempfile
+    from threading import Event
+    from TelemetryFile import TlmWriter
+    from TelemetryReader import BinaryFileReader
+    from TelemetryPlayback import PlaybackEvent
+
+    (preflight, inflight, postflight) = test_frames(4)
+    num_preflight = int((minutes * 60 - flight_seconds) * 10)
+    num_inflight = int(flight_seconds * 20)
+
+    (handle, filename) = tempfile.mkstemp(suffix=".tlm")
+    with os.fdopen(handle, "wb") as file:
+        writer = TlmWriter(file, 0.0)
+        received = 0.0
+        for (frames, interval) in (([preflight] * num_preflight, 0.1), ([inflight] * num_inflight, 0.05), ([postflight] * 100, 0.1)):
+            for raw in frames:
+                received += interval
+                writer.write_frame(raw, received)
+        writer.close()
+
+    reader = BinaryFileReader(queue.SimpleQueue())
+    reader.filename = filename
+    running = Event()
+    running.set()
+
+    start = perf_counter()
+    with open(filename, "rb") as file:
+        replay = reader.replay(file, reader.build_pipeline(None, reader.stamp), reader.sender(reader.queue), running)
+        next(replay)
+        first_frame = perf_counter() - start
+
+        # events are found once the frames have been scanned, on the playback index thread
+        while not (reader.playback.index is not None and reader.playback.index.complete):
+            sleep(0.001)
+        indexed = perf_counter() - start
+
+        reader.playback.seek(PlaybackEvent.LIFTOFF)
+        reader.playback.set_unthrottled()
+        for _ in replay:
+            if reader.decoder.state == DecoderState.POSTFLIGHT:
+                break
+        seconds = perf_counter() - start
+
+    os.remove(filename)
+
+    liftoff = reader.playback.index.at_event(PlaybackEvent.LIFTOFF).time
+    print(f"playback ({minutes:g} min session)      before: {liftoff:>9.1f}s to liftoff at 1x"
+          f"   after: {1000 * first_frame:.0f}ms to the first frame, {1000 * indexed:.0f}ms to index,"
+          f" {1000 * seconds:.0f}ms to liftoff and through the flight")
+
+
+def benchmark_sd(repeats: int = 5) -> None:
+    lines = test_sd_lines()
+
+    before = len(lines) / (1 / timed(decode_all(LegacySDCardDecoder), [lines], repeats, rounds=repeats))
+    after = len(lines) / (1 / timed(decode_all(SDCardTelemetryDecoder), [lines], repeats, rounds=repeats))
+    report("SD-card rows", before, after, "rows/s")
+
+
+def benchmark_sd_replay(seconds: float = 5.0) -> None:
+    """
+    replaying a 1kHz SD-card log at 1x: how far behind it finishes, CPU time
+    and UI batches, sleeping row by row against the deadline scheduler
+    """
+    import os
+    import queue
+    import tempfile
+    from time import monotonic, process_time, sleep
+    from TelemetryReader import SDCardFileReader
+
+    lines = test_sd_lines(num_rows=int(seconds * 1000))
+    (handle, filename) = tempfile.mkstemp(suffix=".csv")
+    with os.fdopen(handle, "w") as file:
+        file.writelines(lines)
+
+    def row_by_row() -> tuple:
+        decoder = SDCardTelemetryDecoder()
+        last_timestamp = 0
+        batches = 0
+        with open(filename, "rt") as file:
+            for line in file:
+                telemetry = decoder.decode(line)
+                if telemetry is not None and "time" in telemetry:
+                    delay = float(telemetry["time"]) - last_timestamp
+                    last_timestamp = float(telemetry["time"])
+                    if delay > 0:
+                        batches += 1
+                        sleep(delay)
+        return (batches, 0.0)
+
+    def scheduled() -> tuple:
+        message_queue = queue.SimpleQueue()
+        reader = SDCardFileReader(message_queue)
+        reader.filename = filename
+        reader.running.set()
+        reader.__run__(message_queue, reader.running)
+        return (message_queue.qsize(), reader.playback.max_lag)
+
+    results = []
+    for function in (row_by_row, scheduled):
+        start = monotonic()
+        cpu = process_time()
+        (batches, max_lag) = function()
+        results.append((monotonic() - start - (seconds - 0.001), process_time() - cpu, batches, max_lag))
+
+    os.remove(filename)
+
+    for (name, (behind, cpu, batches, max_lag)) in zip(("before", "after"), results):
+        print(f"SD-card replay ({seconds:g}s at 1kHz)   {name}: {1000 * behind:>7.0f}ms behind at the end"
+              f"   {cpu:.2f}s CPU   {batches} UI batches" + (f"   max lag {1000 * max_lag:.1f}ms" if name == "after" else ""))
+
+
+def benchmark_sd_headers(repeats: int = 5) -> None:
+    # multi-flight log: short flights, so key rows are a big part of the file
+    lines = test_sd_lines(num_rows=20) * 500
+
+    before = len(lines) / (1 / timed(decode_all(LegacySDCardDecoder), [lines], repeats, rounds=repeats))
+    after = len(lines) / (1 / timed(decode_all(SDCardTelemetryDecoder), [lines], repeats, rounds=repeats))
+    report("SD-card rows (500 flights)", before, after, "rows/s")
+
+
+def benchmark_sd_bulk(repeats: int = 3) -> None:
+    import TelemetryArrays
+
+    lines = test_sd_lines(num_rows=100000)
+    size = sum(len(line) for line in lines) / 1e6
+
+    def bulk(lines):
+        return TelemetryArrays.decode_sd_lines(SDCardTelemetryDecoder(), lines)
+
+    before = size / (1 / timed(decode_all(SDCardTelemetryDecoder), [lines], repeats, rounds=repeats))
+    after = size / (1 / timed(bulk, [lines], repeats, rounds=repeats))
+    report(f"SD-card bulk load ({size:.1f}MB)", before, after, "MB/s")
+
+
+def benchmark_pipeline(repeats: int = 1) -> None:
+    from TelemetryPipeline import Pipeline, SinkStage, radio_stages
+
+    raw_data = test_session()
+    decoder = RadioTelemetryDecoder()
+    pipeline = Pipeline(radio_stages(decoder) + [SinkStage(lambda frame: None)])
+
+    # fed in 64kB chunks like BinaryFileReader, so framing carries partial frames over
+    chunks = [raw_data[i:i + 65536] for i in range(0, len(raw_data), 65536)]
+
+    for _ in range(repeats):
+        pipeline.run(chunks)
+
+    print(f"pipeline stages ({len(raw_data) / 1e6:.1f}MB TLM session):")
+    print(pipeline.report())
+
+
+def benchmark_batches(repeats: int = 3, batch_size: int = 20) -> None:
+    import queue
+    from collections import namedtuple
+    from time import monotonic
+    from TelemetryPipeline import Pipeline, SinkStage, radio_stages
+    from TelemetryReader import MessageBatcher
+
+    Message = namedtuple("message", ["telemetry", "decoder_state", "local_time", "total_message_size", "samples"])
+    graph_keys = ["fusionAlt", "fusionVel", "accelZ"]
+
+    # decoded once: what the readers' senders are given for every frame
+    decoder = RadioTelemetryDecoder()
+    frames = []
+    Pipeline(radio_stages(decoder) + [SinkStage(lambda frame: frames.append((frame.telemetry, frame.state, len(frame.raw))))]).run([test_session()])
+
+    def per_message(frames):
+        # a Message per packet, popped one by one by the UI
+        message_queue = queue.Queue()
+        variables = {}
+        for (telemetry, state, size) in frames:
+            message_queue.put(Message(telemetry, state, monotonic(), size, ()))
+        while not message_queue.empty():
+            message = message_queue.get(block=False)
+            for (key, value) in message.telemetry.items():
+                variables[key] = value
+            points = [message.telemetry.get(key) for key in graph_keys]
+
+    def batched(frames):
+        # a MessageBatch per read of batch_size packets (e.g. a 10x replay tick)
+        message_queue = queue.Queue()
+        variables = {}
+        batcher = MessageBatcher(message_queue)
+        for (i, (telemetry, state, size)) in enumerate(frames):
+            batcher.add(telemetry, state, size)
+            if i % batch_size == batch_size - 1:
+                batcher.flush()
+        batcher.flush()
+        while not message_queue.empty():
+            batch = message_queue.get(block=False)
+            for (key, value) in batch.telemetry.items():
+                variables[key] = value
+            points = [batch.column(key) for key in graph_keys]
+
+    before = len(frames) / (1 / timed(per_message, [frames], repeats, rounds=repeats))
+    after = len(frames) / (1 / timed(batched, [frames], repeats, rounds=repeats))
+    report(f"UI queue ({batch_size} packets/read)", before, after, "msgs/s")
+
+
+def benchmark_channel(num_batches: int = 20000) -> None:
+    """
+    UI stalled (e.g. a dialog open) while a reader sends num_batches: how many
+    batches and rows pile up, and how long the UI then takes to catch up
+    """
+    import queue
+    from TelemetryChannel import TelemetryChannel
+    from TelemetryReader import MessageBatcher
+    from TelemetryDecoder import DecoderState
+
+    telemetry = {"fusionAlt": 1.0, "fusionVel": 2.0, "accelZ": 3.0, "gnssLat": 45.79, "gnssLon": 0.59}
+
+    def stalled(message_queue) -> tuple:
+        batcher = MessageBatcher(message_queue)
+        for _ in range(num_batches):
+            batcher.add(telemetry, DecoderState.INFLIGHT, 36)
+            batcher.flush()
+
+        waiting = message_queue.qsize()
+        start = perf_counter()
+        variables = {}
+        while not message_queue.empty():
+            batch = message_queue.get(block=False)
+            for (key, value) in batch.telemetry.items():
+                variables[key] = value # what setvar() does for every batch
+        return (waiting, perf_counter() - start)
+
+    (before_waiting, before_seconds) = stalled(queue.Queue())
+    channel = TelemetryChannel()
+    (after_waiting, after_seconds) = stalled(channel)
+
+    print(f"UI stalled for {num_batches} batches   before: {before_waiting} waiting, {1000 * before_seconds:.1f}ms to catch up"
+          f"   after: {after_waiting} waiting, {1000 * after_seconds:.1f}ms to catch up"
+          f"  ({channel.coalesced} merged, {channel.overflow_messages} dropped, {channel.overflow_rows} rows lost)")
+
+
+def benchmark_bindings(num_ticks: int = 2000, batches_per_tick: int = 20) -> None:
+    """
+    UI catching up on a backlog: batches_per_tick in-flight batches processed
+    per check_queue() tick, writing their variables with setvar() per batch
+    against VariableBindings flushed once per tick. A trace on the altitude,
+    like ReadOut's, counts how often one fires
+    """
+    import tkinter
+    from TelemetryControls import VariableBindings
+
+    decoder = RadioTelemetryDecoder()
+    telemetry = decoder.enrich(decoder.decode(test_packets(4)[1]))
+    batches = []
+    for i in range(num_ticks * batches_per_tick):
+        batch = dict(telemetry)
+        batch["fusionAlt"] = float(i // batches_per_tick) # altitude changes every tick
+        batch["radioPacketNum"] = i
+        batches.append(batch)
+
+    def setvar(tcl) -> int:
+        for batch in batches:
+            for (key, value) in batch.items():
+                tcl.setvar(key, value)
+        return len(batches) * len(telemetry)
+
+    def bindings(tcl) -> int:
+        bindings = VariableBindings(tcl)
+        for i in range(0, len(batches), batches_per_tick):
+            for batch in batches[i:i + batches_per_tick]:
+                bindings.update(batch)
+            bindings.flush()
+        return bindings.tcl_calls
+
+    results = []
+    for function in (setvar, bindings):
+        tcl = tkinter.Tcl()
+        altitude = tkinter.DoubleVar(tcl, 0.0, "fusionAlt")
+        traces = []
+        altitude.trace_add("write", lambda *_: traces.append(None))
+
+        start = perf_counter()
+        calls = function(tcl)
+        results.append((perf_counter() - start, calls, len(traces)))
+
+    ((before, before_calls, before_traces), (after, after_calls, after_traces)) = results
+    report(f"UI variables ({batches_per_tick} batches/tick)", num_ticks / before, num_ticks / after, "ticks/s")
+    print(f"{'':<32} before: {before_calls:>9} Tcl calls, {before_traces} traces   after: {after_calls:>9} Tcl calls, {after_traces} traces")
+
+
+def benchmark_graphs(minutes: float = 60.0, rate: int = 100, width: int = 800, batch_rows: int = 40) -> None:
+    """
+    graphs of a minutes long flight sampled at rate Hz: the samples (every
+    tenth missing) added batch_rows at a time, then the line data for a graph
+    width pixels wide, following the last 40 seconds and showing the whole
+    flight. Every sample in the window (what a plain time axis draws)
+    against GraphHistory's min/max pyramid
+    """
+    from GraphData import GraphHistory, fill_gaps
+    import numpy
+
+    num_samples = int(minutes * 60 * rate)
+    times = numpy.arange(num_samples) / rate
+    altitudes = [None if i % 10 == 0 else float(i % 5000) for i in range(num_samples)]
+
+    history = GraphHistory(1)
+    start = perf_counter()
+    for i in range(0, num_samples, batch_rows):
+        history.extend(times[i:i + batch_rows], [fill_gaps(altitudes[i:i + batch_rows], history.last[0])])
+    seconds = perf_counter() - start
+    print(f"{'graph history':<32} {num_samples / seconds:>12,.0f} samples/s added, {len(history.levels)} levels")
+
+    for (name, window_start) in (("last 40s", times[-1] - 40), ("whole flight", 0.0)):
+        window_end = times[-1]
+
+        def every_sample() -> tuple:
+            samples = history.samples.view()
+            first = max(int(numpy.searchsorted(samples[0], window_start)) - 1, 0)
+            return (numpy.array(samples[0, first:]), numpy.array(samples[1, first:]))
+
+        def decimated() -> tuple:
+            (xs, ys) = history.window(window_start, window_end, 2 * width)
+            return (numpy.array(xs[0]), numpy.array(ys[0]))
+
+        results = []
+        for function in (every_sample, decimated):
+            best = float("inf")
+            for _ in range(20):
+                start = perf_counter()
+                (xs, _) = function()
+                best = min(best, perf_counter() - start)
+            results.append((best, len(xs)))
+
+        ((before, before_points), (after, after_points)) = results
+        report(f"graph window ({name})", 1 / before, 1 / after, "draws/s")
+        print(f"{'':<32} before: {before_points:>9} points   after: {after_points:>9} points")
+
+
+def benchmark_wakeup(num_batches: int = 50, interval: float = 0.05, idle: float = 2.0) -> None:
+    """
+    a reader sending a batch every `interval` seconds, then idle: time from
+    put() to the UI callback taking it off the channel, and how often the
+    callback runs, polling every 10ms against the QueueWatcher
+    """
+    import tkinter
+    import threading
+    from time import monotonic, sleep
+    from TelemetryChannel import TelemetryChannel
+    from TelemetryControls import QueueWatcher, MIN_UPDATE_INTERVAL
+    from TelemetryReader import MessageBatcher
+
+    def session(watch) -> tuple:
+        tcl = tkinter.Tcl()
+        channel = TelemetryChannel()
+        latencies = []
+        runs = []
+
+        def callback() -> bool:
+            runs.append(monotonic())
+            received = False
+            while not channel.empty():
+                latencies.append(monotonic() - channel.get().local_time)
+                received = True
+            return received
+
+        stop = watch(tcl, channel, callback)
+
+        def reader() -> None:
+            batcher = MessageBatcher(channel)
+            for i in range(num_batches):
+                sleep(interval)
+                batcher.add({"radioPacketNum": i}, DecoderState.INFLIGHT, 36)
+                batcher.flush()
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        end = monotonic() + num_batches * interval + idle
+        while monotonic() < end:
+            tcl.dooneevent()
+        thread.join()
+        stop()
+
+        idle_runs = sum(1 for run in runs if run > end - idle + 0.5)
+        return (sum(latencies) / len(latencies), max(latencies), idle_runs / (idle - 0.5))
+
+    def polling(tcl, channel, callback):
+        timer = None
+        def poll() -> None:
+            nonlocal timer
+            callback()
+            timer = tcl.after(MIN_UPDATE_INTERVAL, poll)
+        poll()
+        return lambda: tcl.after_cancel(timer)
+
+    def watcher(tcl, channel, callback):
+        watcher = QueueWatcher(tcl, channel, callback)
+        watcher.start()
+        return watcher.close
+
+    ((before_mean, before_max, before_idle), (after_mean, after_max, after_idle)) = (session(polling), session(watcher))
+    print(f"UI wakeup (batch every {1000 * interval:g}ms)  before: {1000 * before_mean:.2f}ms mean {1000 * before_max:.2f}ms max latency, {before_idle:.0f} runs/s idle"
+          f"   after: {1000 * after_mean:.2f}ms mean {1000 * after_max:.2f}ms max latency, {after_idle:.0f} runs/s idle")
+
+
+class SlowFile(object):
+    """
+    file on a slow SD card / USB stick: every flush takes `delay` seconds
+    """
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.size = 0
+
+    def write(self, data) -> None:
+        self.size += len(data)
+
+    def flush(self) -> None:
+        from time import sleep
+        sleep(self.delay)
+
+    def close(self) -> None:
+        pass
+
+
+def benchmark_backup(num_packets: int = 200, delay: float = 0.005) -> None:
+    """
+    time the read loop spends backing up each TLM packet when every flush takes `delay`
+    """
+    from TelemetryBackup import BackupWriter
+
+    frames = test_frames(num_samples=4) * (num_packets // 3)
+
+    def write_and_flush(file):
+        # what the read loop did for every packet
+        start = perf_counter()
+        for frame in frames:
+            file.write(frame)
+            file.flush()
+        return perf_counter() - start
+
+    before = write_and_flush(SlowFile(delay))
+
+    writer = BackupWriter()
+    after = write_and_flush(writer.add(SlowFile(delay), "slow.tlm"))
+    writer.close()
+
+    report(f"TLM backup ({1000 * delay:.0f}ms flushes)", len(frames) / before, len(frames) / after)
+    print(writer.report())
+
+
+def benchmark_csv(num_packets: int = 20000) -> None:
+    """
+    CSV backup of a long pad wait (repeated preflight packets): replacing the
+    preflight row in the file every packet against keeping it pending in memory
+    """
+    import os
+    import tempfile
+    from TelemetryPipeline import Pipeline, SinkStage, radio_stages
+    from TelemetryBackup import BackupWriter
+    from TelemetryReader import CsvBackupWriter
+
+    (_, inflight, postflight) = test_frames()
+    preflight = []
+    for i in range(num_packets):
+        # barometric altitude drifting on the pad, so every row is different
+        packet = struct.pack(PreFlightPacket.format, 0, True, 2, NAME, 120 + i % 10, 220, 45.79166, 0.59956, 3, CALLSIGN)
+        preflight.append(cobsr.encode(packet + int.to_bytes(crc32(packet), CHECKSUM_LENGTH)) + SYNC_WORD)
+
+    decoder = RadioTelemetryDecoder()
+    frames = []
+    Pipeline(radio_stages(decoder) + [SinkStage(frames.append)]).run([b"".join(preflight) + inflight + postflight])
+
+    def pad_wait(checkpoint_interval: float) -> tuple:
+        (handle, filename) = tempfile.mkstemp(suffix=".csv")
+        os.close(handle)
+        writer = BackupWriter()
+        csv_writer = CsvBackupWriter(writer.add(open(filename, "wb"), filename, text=True), filename, decoder.layout, checkpoint_interval)
+
+        start = perf_counter()
+        for frame in frames:
+            csv_writer.write(frame)
+        csv_writer.close()
+        writer.close() # includes the time to get it all on disk
+        seconds = perf_counter() - start
+
+        with open(filename, "rb") as file:
+            contents = file.read()
+        os.remove(filename)
+        return (len(frames) / seconds, contents, writer.truncates)
+
+    (before, before_contents, before_truncates) = pad_wait(0) # every preflight packet replaces the row in the file
+    (after, after_contents, after_truncates) = pad_wait(CSV_CHECKPOINT_INTERVAL)
+    assert before_contents == after_contents, "pending rows changed the CSV file"
+
+    report(f"CSV backup ({num_packets} preflight)", before, after)
+    print(f"{'':<32} before: {before_truncates:>12} truncates   after: {after_truncates:>12} truncates")
+
+
+SERIAL_BAUD = 115200
+SERIAL_BITS_PER_BYTE = 10 # start + 8 data + stop bits
+
+
+def serial_session(read_frames, num_packets: int = 400, burst: int = 4) -> tuple:
+    """
+    sends frames into a pty paced like a 115200 baud radio link, in bursts of
+    `burst` frames back to back (like a radio modem forwarding its buffer),
+    and reads them back with read_frames(port), a generator which yields
+    each frame as it is split out of the reads.
+    Returns (port reads per frame, mean latency in ms from write to frame out)
+    """
+    import os
+    import serial
+    import threading
+    import tty
+    from time import sleep
+
+    frames = test_frames(num_samples=4) * (num_packets // 3)
+    (master, slave) = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    port = serial.Serial(os.ttyname(slave), SERIAL_BAUD, timeout=0.5)
+
+    # count every read on the port (read_until() reads one byte per call)
+    reads = 0
+    port_read = port.read
+
+    def counted_read(size=1):
+        nonlocal reads
+        reads += 1
+        return port_read(size)
+
+    port.read = counted_read
+
+    sent = []
+
+    def send():
+        for i in range(0, len(frames), burst):
+            data = b"".join(frames[i:i + burst])
+            sent.extend([perf_counter()] * len(frames[i:i + burst]))
+            os.write(master, data)
+            sleep(len(data) * SERIAL_BITS_PER_BYTE / SERIAL_BAUD)
+
+    sender = threading.Thread(target=send)
+    received = []
+
+    sender.start()
+    for _ in read_frames(port):
+        received.append(perf_counter())
+        if len(received) == len(frames):
+            break
+    sender.join()
+
+    port.close()
+    os.close(master)
+
+    latency = sum(r - s for (r, s) in zip(received, sent)) / len(received)
+    return (reads / len(frames), latency * 1000)
+
+
+def legacy_serial_frames(port):
+    """
+    RadioTelemetryReader before bulk reads: read_until() one packet per call, sleep when nothing came
+    """
+    from time import sleep
+
+    while True:
+        raw_buffer = port.read_until(SYNC_WORD, 255)
+        if not raw_buffer:
+            sleep(0.01)
+            continue
+        yield raw_buffer
+
+
+def bulk_serial_frames(port):
+    from TelemetryPipeline import FramingStage
+    from TelemetryReader import RadioTelemetryReader
+
+    def chunks():
+        while True:
+            yield RadioTelemetryReader.read_waiting(port)
+
+    return FramingStage().run(chunks())
+
+
+def benchmark_serial() -> None:
+    (before_reads, before_latency) = serial_session(legacy_serial_frames)
+    (after_reads, after_latency) = serial_session(bulk_serial_frames)
+    print(f"serial at {SERIAL_BAUD} baud (pty)     before: {before_reads:.2f} reads/frame {before_latency:.2f}ms latency"
+          f"   after: {after_reads:.2f} reads/frame {after_latency:.2f}ms latency")
+
+
+def multi_source_session(engine, num_sources: int = 3, num_packets: int = 600) -> tuple:
+    """
+    num_sources RadioTelemetryReaders on pty pairs, all sent the same packets,
+    run on engine (or a thread each if engine is None).
+    Returns (messages received, threads running, CPU seconds used)
+    """
+    import os
+    import queue
+    import threading
+    import tty
+    from time import process_time, sleep
+    from TelemetryReader import RadioTelemetryReader
+
+    message_queue = queue.Queue()
+    masters = []
+    readers = []
+
+    for i in range(num_sources):
+        (master, slave) = os.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        reader = RadioTelemetryReader(message_queue)
+        reader.serial_port = os.ttyname(slave)
+        reader.filename = None
+        reader.timeout = 0.1
+        reader.name = f"radio_{i}"
+        reader.engine = engine
+        masters.append(master)
+        readers.append(reader)
+
+    for reader in readers:
+        reader.start()
+    sleep(0.2)
+
+    start = process_time()
+    frames = test_frames(num_samples=4)
+    for i in range(num_packets):
+        for master in masters:
+            os.write(master, frames[i % len(frames)])
+        sleep(0.002)
+    sleep(0.2)
+    cpu = process_time() - start
+    threads = threading.active_count()
+
+    for reader in readers:
+        reader.stop()
+    for master in masters:
+        os.close(master)
+
+    messages = 0
+    while not message_queue.empty():
+        messages += message_queue.get().messages
+
+    return (messages, threads, cpu)
+
+
+def benchmark_engine() -> None:
+    from TelemetryEngine import ReaderEngine
+
+    engine = ReaderEngine()
+    (before_messages, before_threads, before_cpu) = multi_source_session(None)
+    (after_messages, after_threads, after_cpu) = multi_source_session(engine)
+    engine.shutdown()
+
+    print(f"3 serial sources (pty)          before: {before_messages} messages {before_threads} threads {before_cpu:.2f}s CPU"
+          f"   after: {after_messages} messages {after_threads} threads {after_cpu:.2f}s CPU")
+
+
+BENCHMARKS = {"decode": benchmark_decode,
+              "frame": benchmark_frame,
+              "enrich": benchmark_enrich,
+              "tlm": benchmark_tlm,
+              "tlm-stream": benchmark_tlm_stream,
+              "playback": benchmark_playback,
+              "sd": benchmark_sd,
+              "sd-replay": benchmark_sd_replay,
+              "sd-headers": benchmark_sd_headers,
+              "sd-bulk": benchmark_sd_bulk,
+              "pipeline": benchmark_pipeline,
+              "batches": benchmark_batches,
+              "channel": benchmark_channel,
+              "bindings": benchmark_bindings,
+              "graphs": benchmark_graphs,
+              "wakeup": benchmark_wakeup,
+              "backup": benchmark_backup,
+              "csv": benchmark_csv,
+              "serial": benchmark_serial,
+              "engine": benchmark_engine}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or BENCHMARKS.keys()
+
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,166 @@
+from collections import deque
+from threading import Lock
+from enum import Enum
+import queue
+
+"""
+Telemetry Channel:
+
+bounded replacement for the queue.Queue between the readers and the UI.
+
+Readers put MessageBatches on it from their thread (or the ReaderEngine's),
+the Tk thread takes them off with get(block=False) like a queue.Queue. When the
+UI falls behind (map tiles loading, a dialog open) and the channel is full, a
+new batch is merged into one already waiting instead of growing the queue:
+the UI variables only get the latest value of every key, but the batch
+columns keep every row, so graphs still get every sample. With DROP_OLDEST
+(or batches which can't be merged) the oldest batch is dropped instead, but
+only its latest values: its rows move to the front of the batch after it.
+Backups are written by the readers before anything is put on the channel,
+so recording never loses data either way.
+
+The one exception is the cap on rows waiting in the channel (max_rows), so
+memory stays bounded even if the UI stops altogether: past that the oldest
+batch is dropped rows and all, and its rows are counted in overflow_rows
+(shown in the stats bar as lost), so graphs have a gap there.
+
+If wakeup is set, it is called (from the reader's thread, outside the lock)
+whenever a batch is put on the empty channel, so the UI can wait for data
+instead of polling for it.
+"""
+
+CHANNEL_SIZE = 64 # batches waiting for the UI before they are merged
+CHANNEL_MAX_ROWS = 200000 # rows (samples) waiting for the UI before the oldest are lost
+
+
+class ChannelPolicy(Enum):
+    COALESCE = "coalesce" # merge into a waiting batch of the same decoder state (drops only if that's impossible)
+    DROP_OLDEST = "drop oldest" # drop the oldest waiting batch's latest values (its rows are kept)
+
+    def __str__(self):
+        return self.value
+
+
+class TelemetryChannel(object):
+    """
+    Bounded, thread-safe channel of MessageBatches from readers to the UI
+    """
+    def __init__(self,
+                 maxsize: int = CHANNEL_SIZE,
+                 max_rows: int = CHANNEL_MAX_ROWS,
+                 policy: ChannelPolicy = ChannelPolicy.COALESCE) -> None:
+
+        self.maxsize = maxsize
+        self.max_rows = max_rows
+        self.policy = policy
+        self.batches = deque()
+        self.rows = 0 # rows in all waiting batches
+        self.lock = Lock()
+        self.wakeup = None # called when a batch is put on the empty channel
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.batches_put = 0
+        self.coalesced = 0 # batches merged into one already waiting
+        self.overflow_batches = 0 # batches dropped
+        self.overflow_messages = 0 # messages in them
+        self.overflow_rows = 0 # rows lost with them (only past max_rows)
+        self.max_waiting = 0 # most batches ever waiting
+
+    def put(self, batch, block: bool = False) -> None:
+        """
+        never blocks (block is only there to look like queue.Queue.put)
+        """
+        with self.lock:
+            self.batches_put += 1
+            batches = self.batches
+            was_empty = not batches
+
+            if len(batches) >= self.maxsize:
+                if self.policy == ChannelPolicy.COALESCE and batches[-1].decoder_state == batch.decoder_state:
+                    batches[-1].merge(batch)
+                    self.rows += batch.rows
+                    self.coalesced += 1
+                    batch = None
+                elif not self.coalesce_waiting():
+                    self.drop_oldest(batch)
+
+            if batch is not None:
+                batches.append(batch)
+                self.rows += batch.rows
+
+            while self.rows > self.max_rows and len(batches) > 1:
+                self.drop_rows()
+
+            self.max_waiting = max(self.max_waiting, len(batches))
+
+        if was_empty and self.wakeup is not None:
+            self.wakeup()
+
+    def coalesce_waiting(self) -> bool:
+        """
+        makes room by merging the oldest two waiting neighbours with the same
+        decoder state, so no state change is lost. Returns False if there are none
+        """
+        if self.policy != ChannelPolicy.COALESCE:
+            return False
+
+        batches = self.batches
+
+        for i in range(len(batches) - 1):
+            if batches[i].decoder_state == batches[i + 1].decoder_state:
+                batches[i].merge(batches[i + 1])
+                del batches[i + 1]
+                self.coalesced += 1
+                return True
+
+        return False
+
+    def drop_oldest(self, batch) -> None:
+        """
+        makes room by dropping the oldest waiting batch's latest values: its
+        rows go to the front of the next waiting batch (or of batch, the one
+        being put, if there is none) so no sample is lost
+        """
+        dropped = self.batches.popleft()
+        self.overflow_batches += 1
+        self.overflow_messages += dropped.messages
+
+        if self.batches:
+            self.batches[0].insert_rows(dropped)
+        else:
+            self.rows -= dropped.rows
+            batch.insert_rows(dropped)
+
+    def drop_rows(self) -> None:
+        """
+        past max_rows: drops the oldest waiting batch, rows and all
+        """
+        dropped = self.batches.popleft()
+        self.rows -= dropped.rows
+        self.overflow_batches += 1
+        self.overflow_messages += dropped.messages
+        self.overflow_rows += dropped.rows
+
+    def get(self, block: bool = False):
+        """
+        oldest waiting batch, raises queue.Empty if there is none
+        """
+        with self.lock:
+            if not self.batches:
+                raise queue.Empty
+
+            batch = self.batches.popleft()
+            self.rows -= batch.rows
+            return batch
+
+    def empty(self) -> bool:
+        return not self.batches
+
+    def qsize(self) -> int:
+        return len(self.batches)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.batches.clear()
+            self.rows = 0
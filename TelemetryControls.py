@@ -1,12 +1,197 @@
 from tkinter import *
 from Styles import Fonts, Colors
+from time import monotonic
+import os
 
 DEFAULT_FORMAT = "{:.2f}"
 
+MIN_UPDATE_INTERVAL = 10 # ms between updates while data is arriving
+IDLE_UPDATE_INTERVAL = 250 # longest ms between updates while idle, when woken by data
+POLL_IDLE_INTERVAL = 50 # longest ms between updates while idle, when only polling
+
 LARGE_FONT_SIZE = 40
 MEDIUM_FONT_SIZE = 24
 SMALL_FONT_SIZE = 14
 
+class VariableBindings(object):
+    """
+    Cached Tk variables for telemetry keys (each variable is named after its
+    key), written once per UI frame: set() and update() only keep the latest
+    value of each key, and flush() writes the ones that changed since they
+    were last written. So a backlog of messages costs one Tcl call per key
+    per frame at most, and traces (ReadOut, MapFrame) only fire on real changes.
+
+    Counts the Tcl calls it makes, and the writes it saved, for the stats bar
+    """
+    def __init__(self, master: Misc) -> None:
+        self.master = master
+        self.variables = {} # key: Variable (kept for good: deleting a Variable unsets it in Tcl)
+        self.values = {} # key: value last written
+        self.pending = {} # key: latest value since the last flush
+        self.tcl_calls = 0
+        self.skipped = 0
+
+    def variable(self, key: str) -> Variable:
+        variable = self.variables.get(key)
+
+        if variable is None:
+            variable = self.variables[key] = Variable(self.master, name=key)
+            self.tcl_calls += 1 # checks the variable exists
+
+        return variable
+
+    def set(self, key: str, value) -> None:
+        self.pending[key] = value
+
+    def update(self, telemetry: dict) -> None:
+        self.pending.update(telemetry)
+
+    def flush(self) -> None:
+        """
+        writes the pending values which changed
+        """
+        values = self.values
+
+        for (key, value) in self.pending.items():
+            old = values.get(key, values) # values itself stands in for "never written"
+            if old == value and type(old) is type(value):
+                self.skipped += 1
+                continue
+
+            self.variable(key).set(value)
+            values[key] = value
+            self.tcl_calls += 1
+
+        self.pending.clear()
+
+    def forget(self) -> None:
+        """
+        forgets the values written, so the next flush writes every key again
+        (for when something else has written to the variables)
+        """
+        self.values.clear()
+
+    def clear(self) -> None:
+        self.pending.clear()
+        self.forget()
+
+
+class QueueWatcher(object):
+    """
+    Runs callback() on the Tk thread when readers put data on a
+    TelemetryChannel, instead of polling it every MIN_UPDATE_INTERVAL.
+
+    The channel wakes the Tk loop through a pipe registered with
+    createfilehandler when a batch arrives on the empty channel, and
+    callback() runs straight away (or MIN_UPDATE_INTERVAL after the last run,
+    whichever is later). It is still polled, for what changes without data
+    (time since last packet, the reader finishing), but the poll backs off
+    while idle: the interval doubles every time callback() returns False,
+    up to IDLE_UPDATE_INTERVAL. On platforms without createfilehandler
+    (Windows) it only polls, backing off no further than POLL_IDLE_INTERVAL
+    """
+    def __init__(self, master: Misc, channel, callback,
+                 min_interval: int = MIN_UPDATE_INTERVAL,
+                 idle_interval: int = IDLE_UPDATE_INTERVAL,
+                 poll_idle_interval: int = POLL_IDLE_INTERVAL) -> None:
+
+        self.master = master
+        self.channel = channel
+        self.callback = callback # returns True if it got any data
+        self.min_interval = min_interval
+        self.interval = min_interval
+        self.timer = None
+        self.running = False
+        self.last_run = 0.0
+        self.wakeups = 0 # times woken by data
+        self.runs = 0
+
+        try:
+            (self.read_fd, self.write_fd) = os.pipe()
+            os.set_blocking(self.read_fd, False)
+            os.set_blocking(self.write_fd, False)
+            master.tk.createfilehandler(self.read_fd, READABLE, self.readable)
+        except (AttributeError, OSError):
+            self.close_pipe()
+            self.idle_interval = poll_idle_interval
+        else:
+            self.idle_interval = idle_interval
+            channel.wakeup = self.wake
+
+    @property
+    def event_driven(self) -> bool:
+        return self.read_fd is not None
+
+    def start(self) -> None:
+        self.running = True
+        self.interval = self.min_interval
+        self.schedule(0)
+
+    def stop(self) -> None:
+        self.running = False
+        if self.timer is not None:
+            self.master.after_cancel(self.timer)
+            self.timer = None
+
+    def close(self) -> None:
+        self.stop()
+        self.channel.wakeup = None
+        if self.read_fd is not None:
+            self.master.tk.deletefilehandler(self.read_fd)
+        self.close_pipe()
+
+    def close_pipe(self) -> None:
+        for fd in (getattr(self, "read_fd", None), getattr(self, "write_fd", None)):
+            if fd is not None:
+                os.close(fd)
+        self.read_fd = self.write_fd = None
+
+    def wake(self) -> None:
+        """
+        called by the channel, from a reader's thread
+        """
+        try:
+            os.write(self.write_fd, b"\x00")
+        except (BlockingIOError, OSError, TypeError):
+            pass # pipe full (a wakeup is already waiting) or closed
+
+    def readable(self, fd, mask) -> None:
+        try:
+            os.read(fd, 4096)
+        except BlockingIOError:
+            pass
+
+        if not self.running:
+            return
+
+        self.wakeups += 1
+        self.interval = self.min_interval
+        since_last_run = 1000 * (monotonic() - self.last_run)
+        self.schedule(max(0, int(self.min_interval - since_last_run)))
+
+    def schedule(self, delay: int) -> None:
+        if self.timer is not None:
+            self.master.after_cancel(self.timer)
+        self.timer = self.master.after(delay, self.run)
+
+    def run(self) -> None:
+        self.timer = None
+        self.last_run = monotonic()
+        self.runs += 1
+
+        received = self.callback()
+
+        if not self.running:
+            return # callback stopped us
+
+        if received and not self.event_driven:
+            self.interval = self.min_interval # more is probably on the way
+        else:
+            self.interval = min(self.interval * 2, self.idle_interval)
+
+        self.schedule(self.interval)
+
+
 class ReadOut(Frame):
     def __init__(self,
                  master,
@@ -19,6 +204,7 @@ class ReadOut(Frame):
         Frame.__init__(self, master, bg=Colors.BG_COLOR)
 
         self.variable = variable
+        self.key = str(variable) # telemetry key is the name of the variable
 
         self.name = name
         self.min_var = StringVar(self, "0.0")
@@ -61,6 +247,25 @@ class ReadOut(Frame):
 
         self.value.set(new_value_string)
 
+    def update_range(self, column: list):
+        """
+        updates min/max from every value of a batch column (None where
+        a row had no value), not just the last one which is shown in the variable
+        """
+        values = [value for value in column if value is not None]
+        if not values:
+            return
+
+        new_min = min(values)
+        if new_min < self.min:
+            self.min_var.set(self.format.format(new_min))
+            self.min = new_min
+
+        new_max = max(values)
+        if new_max > self.max:
+            self.max_var.set(self.format.format(new_max))
+            self.max = new_max
+
     def reset(self):
         self.min_var.set(self.format.format(0))
         self.min = 0.0
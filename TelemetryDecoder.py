@@ -1,5 +1,5 @@
 from enum import StrEnum
-import struct
+from TelemetrySchema import *
 
 """
 Telemetry Decoding:
@@ -12,73 +12,19 @@ TelemetryDecoder:
   - SDCardTelemetryDecoder
   - RadioTelemetryDecoder
 """
-ENDIANNESS = "<"
 GNSS_FLOATS_FORMAT = "{:.6f}"
-STRING_DECODING_ERRORS = "ignore"
-
-class DecodingError(Exception):
-    pass
-
-class RadioPacket(object):
-    def __init__(self,
-                 data_bytes: bytes) -> None:
-        self.values = list(struct.unpack(self.format, data_bytes))
-
-    def as_dict(self):
-        zipped = zip(self.keys, self.values)
-        return dict(zipped)
-
-class ErrorPacket(object):
-    def __init__(self, event) -> None:
-        self.values["event"] = event
-
-class PreFlightPacket(RadioPacket): # 43 bytes (51)
-    keys = ["event",          # uint8_t   event
-            "gnssFix",        # uint8_t   gnss.fix # interpret as bool
-            "cont",           # uint8_t   cont.reportCode
-            "name",           # char[20]  rocketName
-            "baroAlt",        # int16_t   baseAlt
-            "preGnssAlt",     # int16_t   GPSalt
-            "preGnssLat",     # float     GPS.location.lat
-            "preGnssLon",     # float     GPS.location.lng
-            "gnssSatellites", # uint16_t  satNum
-            "callsign"]       # char[6]   callsign
-
-    format = f"{ENDIANNESS}B?B20shhffH6s"
-
-class InFlightData(RadioPacket): # 13 bytes (total 37)
-    keys = ["event",     # uint8_t  event
-            "fltTime",   # uint16_t fltTime
-            "fusionVel", # int16_t  vel
-            "fusionAlt", # int16_t  alt
-            "roll",      # int16_t  roll
-            "offVert",   # int16_t  offVert
-            "accelZ"]    # int16_t  accel
-
-    format = f"{ENDIANNESS}BHhhhhh"
-
-class InFlightMetaData(RadioPacket): # 18 bytes (26)
-    keys = ["radioPacketNum", # int16_t packetnum
-            "gnssAlt",        # int16_t GPSalt
-            "gnssLat",        # float   GPS.location.lat
-            "gnssLon",        # float   GPS.location.lon
-            "callsign"]       # char[6] callsign
-
-    format = f"{ENDIANNESS}HHff6s"
-
-class PostFlightPacket(RadioPacket): # 26
-    keys = ["event",        # uint8_t  event
-            "maxAlt",       # uint16_t maxAlt
-            "maxVel",       # uint16_t maxVel
-            "maxG",         # uint16_t maxG
-            "maxGnssAlt",   # uint16_t maxGPSalt
-            "gnssFix",      # uint8_t  gnss.fix
-            "postGnssAlt",  # uint16_t GPSalt
-            "postGnssLat",  # float    GPS.location.lat
-            "postGnssLon",  # float    GPS.location.lng
-            "callsign"]     # char[6]  callsign
-
-    format = f"{ENDIANNESS}B4HBHff6s"
+
+ACCEL_MULTIPLIER = 0.029927521
+OFFVERT_MULTIPLIER = 0.1
+PACKET_NUMBER_KEY = "radioPacketNum"
+
+def roll_turns(roll) -> int:
+    # turns keep the sign of roll to show direction of turn
+    return roll // 360 if roll >= 0 else -(-roll // 360)
+
+def bound_roll(roll) -> int:
+    return roll % 360 if roll >= 0 else -(-roll % 360)
+
 
 class DecoderState(StrEnum):
     OFFLINE = "Offline"
@@ -90,6 +36,86 @@ class DecoderState(StrEnum):
     POSTFLIGHT = "Postflight"
     ERROR = "Error"
 
+
+# Radio packet schemas
+# --------------------
+# (see TelemetrySchema for how these are turned into decoders)
+
+PREFLIGHT_SCHEMA = PacketSchema("PreFlightPacket", # 43 bytes (51)
+    [Field("event",          "uint8"),    # uint8_t   event
+     Field("gnssFix",        "bool"),     # uint8_t   gnss.fix # interpret as bool
+     Field("cont",           "uint8"),    # uint8_t   cont.reportCode
+     Field("name",           "char[20]"), # char[20]  rocketName
+     Field("baroAlt",        "int16"),    # int16_t   baseAlt
+     Field("preGnssAlt",     "int16"),    # int16_t   GPSalt
+     Field("preGnssLat",     "float"),    # float     GPS.location.lat
+     Field("preGnssLon",     "float"),    # float     GPS.location.lng
+     Field("gnssSatellites", "uint16"),   # uint16_t  satNum
+     Field("callsign",       "char[6]")], # char[6]   callsign
+    events=[0, 30],
+    state=DecoderState.PREFLIGHT)
+
+INFLIGHT_METADATA_SCHEMA = PacketSchema("InFlightMetaData", # 18 bytes (26)
+    [Field("radioPacketNum", "uint16"),   # uint16_t packetnum
+     Field("gnssAlt",        "uint16"),   # uint16_t GPSalt
+     Field("gnssLat",        "float"),    # float    GPS.location.lat
+     Field("gnssLon",        "float"),    # float    GPS.location.lon
+     Field("callsign",       "char[6]")]) # char[6]  callsign
+
+INFLIGHT_FIELDS = [Field("event",     "uint8"),  # uint8_t  event
+                   Field("fltTime",   "uint16"), # uint16_t fltTime
+                   Field("fusionVel", "int16"),  # int16_t  vel
+                   Field("fusionAlt", "int16"),  # int16_t  alt
+                   Field("roll",      "int16"),  # int16_t  roll
+                   Field("offVert",   "int16", scale=OFFVERT_MULTIPLIER, rounded=True), # int16_t offVert
+                   Field("accelZ",    "int16", scale=ACCEL_MULTIPLIER)]                 # int16_t accel
+
+INFLIGHT_EVENTS = range(1, 26)
+
+POSTFLIGHT_SCHEMA = PacketSchema("PostFlightPacket", # 26
+    [Field("event",       "uint8"),    # uint8_t  event
+     Field("maxAlt",      "uint16"),   # uint16_t maxAlt
+     Field("maxVel",      "uint16"),   # uint16_t maxVel
+     Field("maxG",        "uint16"),   # uint16_t maxG
+     Field("maxGnssAlt",  "uint16"),   # uint16_t maxGPSalt
+     Field("gnssFix",     "uint8"),    # uint8_t  gnss.fix
+     Field("postGnssAlt", "uint16"),   # uint16_t GPSalt
+     Field("postGnssLat", "float"),    # float    GPS.location.lat
+     Field("postGnssLon", "float"),    # float    GPS.location.lng
+     Field("callsign",    "char[6]")], # char[6]  callsign
+    state=DecoderState.POSTFLIGHT)
+
+ERROR_SCHEMA = PacketSchema("ErrorPacket", [], events=[28, 32], state=DecoderState.ERROR)
+
+
+# Firmware layouts
+# ----------------
+# version 1: in-flight packets carry any whole number of samples (currently 1)
+# version 2: in-flight packets always carry 4 samples + metadata
+
+LAYOUT_V1 = register_layout(RadioLayout(1,
+    [PREFLIGHT_SCHEMA,
+     PacketSchema("InFlightData", INFLIGHT_FIELDS, events=INFLIGHT_EVENTS, state=DecoderState.INFLIGHT,
+                  metadata=INFLIGHT_METADATA_SCHEMA, samples=None), # 13 bytes per sample
+     ERROR_SCHEMA],
+    fallback=POSTFLIGHT_SCHEMA))
+
+LAYOUT_V2 = register_layout(RadioLayout(2,
+    [PREFLIGHT_SCHEMA,
+     PacketSchema("InFlightData", INFLIGHT_FIELDS, events=INFLIGHT_EVENTS, state=DecoderState.INFLIGHT,
+                  metadata=INFLIGHT_METADATA_SCHEMA, samples=4),
+     ERROR_SCHEMA],
+    fallback=POSTFLIGHT_SCHEMA))
+
+DEFAULT_LAYOUT_VERSION = 1
+
+# Record classes of the default layout, for building and reading packets directly:
+PreFlightPacket = PREFLIGHT_SCHEMA.record
+InFlightData = LAYOUT_V1.schema(INFLIGHT_EVENTS[0]).record
+InFlightMetaData = INFLIGHT_METADATA_SCHEMA.record
+PostFlightPacket = POSTFLIGHT_SCHEMA.record
+
+
 class TelemetryDecoder(object):
     def __init__(self):
         self.state = DecoderState.PREFLIGHT
@@ -123,14 +149,6 @@ class RadioTelemetryDecoder(TelemetryDecoder):
     then modify() changes this to be appropriate for the UI
     """
 
-    NUM_FLIGHT_DATA_MESSAGES = 1        # each in-flight packet contains this many actual data samples
-    FLIGHT_DATA_MESSAGE_LENGTH = 13     # length of each of this samples
-    FLIGHT_DATA_TOTAL_LENGTH = NUM_FLIGHT_DATA_MESSAGES * FLIGHT_DATA_MESSAGE_LENGTH
-    SYNC_WORD_LENGTH = 4
-
-    ACCEL_MULTIPLIER = 0.029927521
-    OFFVERT_MULTIPLIER = 0.1
-
     # Mapping of event number to text name:
     event_names =  ["Preflight","Liftoff","Booster Burnout","Apogee Detected","Firing Apogee Pyro",
                     "Separation Detected","Firing Mains","Under Chute","Ejecting Booster",
@@ -146,134 +164,165 @@ class RadioTelemetryDecoder(TelemetryDecoder):
                   "Pyro Mains Only", "Pyro Mains & Apogee"]
 
 
-    def __init__(self):
+    def __init__(self, layout_version: int = DEFAULT_LAYOUT_VERSION):
         TelemetryDecoder.__init__(self)
-        self.modifiers = { "name" : self.name_modifier,
-                           "callsign" : self.callsign_modifier,
-                           "accelZ" : self.accel_modifier,
-                           "offVert" : self.offvert_modifier}
+
+        # packet layout of the flight computer's firmware, from TelemetrySchema
+        # modifiers (name, callsign, accelZ, offVert...) are generated from it
+        self.layout = get_layout(layout_version)
+        self.modifiers = self.layout.modifiers
 
         self.floats = ["preGnssLat",  "preGnssLon",
                        "gnssLat",     "gnssLon",
                        "postGnssLat", "postGnssLon"]
 
-    def name_modifier(self, name: bytes) -> str:
-        """
-        Removes extra or bad characters from name
-        """
-        return name.decode("ascii", errors=STRING_DECODING_ERRORS).strip().rstrip('\x00')
+        self.event_labels = self.label_table(self.event_names)
+        self.cont_labels = self.label_table(self.cont_names)
+
+        # one fused enrichment function per packet type of the layout:
+        self.enrichers = {schema.name: self.compile_enricher(schema)
+                          for schema in self.layout.schemas + [self.layout.fallback]}
+        self.schema = self.layout.fallback # schema of last decoded packet
+
+        # event: function reading radioPacketNum from a packet without decoding it (None if it has none)
+        readers = {schema.name: schema.field_reader(PACKET_NUMBER_KEY) for schema in set(self.layout.event_table)}
+        self.packet_number_readers = [readers[schema.name] for schema in self.layout.event_table]
 
-    def callsign_modifier(self, callsign: bytes) -> str:
+    def compile_enricher(self, schema: PacketSchema):
         """
-        Removes extra or bad characters from callsign
+        builds the function which turns one decoded packet into the telemetry
+        dict sent to the UI in a single pass. For every field the packet type
+        carries it applies its modifier (like accel * ACCEL_MULTIPLIER) and adds:
+          - pre-formatted float strings for GNSS coordinates ("gnssLatString")
+          - turns and roll bound to 0..360 ("turns", "boundRoll")
+          - text names for event and pyro continuity codes ("eventName", "contName")
+        name labels come from lookup tables covering every possible code.
+
+        The function takes the tuple of values of the packet (and of its
+        metadata for in-flight packets). The (key, index, modifier) list it
+        applies is built once per schema: index is the value's position in
+        the packet (metadata values follow the sample's), modifier is None
+        for values which go to the UI as they are
         """
-        try:
-            return callsign.decode("ascii", errors=STRING_DECODING_ERRORS).strip()
-        except UnicodeDecodeError:
-            return
+        fields = list(schema.fields)
+        modifiers = dict(schema.modifiers)
 
-    def accel_modifier(self, accel: float) -> float:
-        return accel * self.ACCEL_MULTIPLIER
+        if schema.metadata is not None:
+            fields += schema.metadata.fields
+            modifiers |= schema.metadata.modifiers
 
-    def offvert_modifier(self, offvert: float) -> int:
-        return round(offvert * self.OFFVERT_MULTIPLIER)
+        index = {field.name: i for (i, field) in enumerate(fields)}
+        items = [(name, i, modifiers.get(name)) for (name, i) in index.items()]
 
-    def generate_roll_turns(self, telemetry: dict):
-        """
-        decomposes roll into number of turns, and roll remained bound to 0..360
-        uses sign to show other direction turn
-        """
-        roll_dict = {}
+        for name in index:
+            if name in self.floats:
+                items.append((f"{name}String", index[name], GNSS_FLOATS_FORMAT.format))
 
-        roll = int(telemetry["roll"])
-        sign = 1
+        if "roll" in index:
+            items += [("turns", index["roll"], roll_turns),
+                      ("boundRoll", index["roll"], bound_roll)]
 
-        if roll < 0:
-            roll *= -1
-            sign = -1
+        if "event" in index:
+            items.append(("eventName", index["event"], self.event_labels.__getitem__))
 
-        turns, bound_roll = divmod(roll, 360)
+        if "cont" in index:
+            items.append(("contName", index["cont"], self.cont_labels.__getitem__))
 
-        roll_dict["turns"] = turns * sign
-        roll_dict["boundRoll"] = bound_roll * sign
+        def enrich(values: tuple, metadata: tuple = ()) -> dict:
+            values += metadata
+            telemetry = {}
 
-        return roll_dict
+            for (key, i, modifier) in items:
+                telemetry[key] = values[i] if modifier is None else modifier(values[i])
 
-    def generate_float_strings(self, telemetry: dict):
-        """
-        Adds an additional pre-formtted float (as str type) to
-        telemetry for every named float
-        """
-        float_strings = {}
+            return telemetry
 
-        for key, value in telemetry.items():
-            if key in self.floats:
-                float_strings[f"{key}String"] = self.floats_modifier(value)
+        return enrich
 
-        return float_strings
+    @staticmethod
+    def label_table(names: list) -> list:
+        """
+        "name [code]" for every possible uint8 code, so looking one up can't fail
+        """
+        return [f"{names[code] if code < len(names) else 'Unknown'} [{code}]" for code in range(NUM_EVENT_CODES)]
 
-    def generate_name_strings(self, telemetry: dict) -> dict:
+    def enrich(self, packets: list | None) -> dict:
         """
-        for some things like event and pyro status we just get number
-        this adds text description for them
+        turns the packets from the last decode() into one telemetry dict for the UI
+        (in-flight samples are merged: the last sample is sent along with the metadata)
         """
-        name_strings = {}
+        if not packets:
+            return {}
 
-        # add separate event name value:
-        try:
-            event = telemetry["event"]
-            name_strings["eventName"] = f"{self.event_names[event]} [{event}]"
-        except KeyError:
-            pass # if [event] doesn't exist in telemetry then it will give exception, we ignore
+        enricher = self.enrichers[self.schema.name]
 
-        # if there's a cont code (PREFLIGHT) then also add the name for it
-        try:
-            cont = telemetry["cont"]
-            name_strings["contName"] = f"{self.cont_names[cont]} [{cont}]"
-        except KeyError:
-            pass # if [cont] doesn't exist in telemetry then it will give exception, we ignore
+        if self.schema.metadata is None:
+            return enricher(packets[0].values)
 
-        return name_strings
+        return enricher(packets[-2].values, packets[-1].values)
 
     def decode(self, data_bytes) -> list | None:
         """
         Takes buffer of bytes and converts into a
-        list of telemetry dictionaries. Pre and post
+        list of telemetry packets. Pre and post
         packets just have 1 piece of telemetry inside
         each inflight packet has 4 samples + metadata
-        so for this we get 5 dictionarys
-        """
-        # work out state from event byte:
-        event = data_bytes[0]
+        so for this we get 5 packets.
+        Call as_dict() on each packet to get its telemetry dictionary
 
-        if event == 0 or event == 30:
-            self.state = DecoderState.PREFLIGHT
-            return [PreFlightPacket(data_bytes).as_dict()]
+        data_bytes can be bytes or a memoryview: every packet is unpacked
+        from it in place using offsets so no bytes are copied per sample.
+        The packet type (and so decoder state) is looked up from the event
+        byte in the layout's event table
+        """
+        view = memoryview(data_bytes)
 
-        elif event < 26:
-            self.state = DecoderState.INFLIGHT
+        # work out state from event byte:
+        schema = self.layout.event_table[view[0]]
+        self.schema = schema
+        self.state = schema.state
 
-            messages = []
+        return schema.decode(view)
 
-            for index in range(0,
-                                self.FLIGHT_DATA_TOTAL_LENGTH,
-                                self.FLIGHT_DATA_MESSAGE_LENGTH):
+    def packet_number(self, telemetry_bytes) -> int | None:
+        """
+        radioPacketNum of a packet, read without decoding it (None if the packet type has none)
+        """
+        reader = self.packet_number_readers[telemetry_bytes[0]]
+        if reader is None:
+            return None
 
-                inflight_bytes = data_bytes[index:index + self.FLIGHT_DATA_MESSAGE_LENGTH]
-                messages.append(InFlightData(inflight_bytes).as_dict())
+        try:
+            return reader(telemetry_bytes)
+        except struct.error:
+            return None
 
-            in_flight_meta_bytes = data_bytes[self.FLIGHT_DATA_TOTAL_LENGTH:]
-            messages.append(InFlightMetaData(in_flight_meta_bytes).as_dict())
+    def split_samples(self, packets: list) -> list:
+        """
+        turns the packets of one in-flight radio packet into one telemetry
+        dict per sample, each with its own fltTime and the packet metadata,
+        enriched like enrich(). Used when every sample should reach the UI
+        instead of only the last one
+        """
+        enricher = self.enrichers[self.schema.name]
+        metadata = packets[-1].values
+        return [enricher(sample.values, metadata) for sample in packets[:-1]]
 
-            return messages
 
-        elif event == 28 or event == 32:
-            self.state = DecoderState.ERROR
-            return None
+class SDCardHeader(object):
+    """
+    A key row of an SD-card log and everything compiled from it: the state it
+    starts, its formatted keys, the [key, converter] list for its columns
+    and (once every column has a converter) the (index, key, converter)
+    list value rows are decoded with
+    """
+    __slots__ = ("state", "keys", "columns", "converters")
 
-        else:
-            self.state = DecoderState.POSTFLIGHT
-            return [PostFlightPacket(data_bytes).as_dict()]
+    def __init__(self, state, keys: list, columns: list) -> None:
+        self.state = state
+        self.keys = keys
+        self.columns = columns
+        self.converters = None
 
 
 class SDCardTelemetryDecoder(TelemetryDecoder):
@@ -288,12 +337,18 @@ class SDCardTelemetryDecoder(TelemetryDecoder):
         TelemetryDecoder.__init__(self)
 
         self.telemetry_keys = None
+        self.header = None # SDCardHeader of the last key row, used to decode value rows
         # Unique keys found in CSV headers for each flight mode:
         self.unique_keys = { DecoderState.INFLIGHT: "fltEvents",
                              DecoderState.MAXES: "Max Baro Alt",
                              DecoderState.LAUNCH: "launch date",
                              DecoderState.LAND: "landing date",
                              DecoderState.POSTFLIGHT: "Rocket Name" }
+        self.unique_key_set = set(self.unique_keys.values())
+
+        # header fingerprint: SDCardHeader, for every key row seen so far
+        # (multi-flight logs repeat the same key rows, so they are only compiled once)
+        self.headers = {}
 
         self.accel_resolution = accel_resolution
 
@@ -302,12 +357,71 @@ class SDCardTelemetryDecoder(TelemetryDecoder):
                            "accelY": self.accel_modifier,
                            "accelZ": self.accel_modifier }
 
+        # what the modifiers above divide by, for scaling whole columns at once
+        self.divisors = { "time":   self.TIMESTAMP_RESOLUTION,
+                          "accelX": self.accel_resolution,
+                          "accelY": self.accel_resolution,
+                          "accelZ": self.accel_resolution }
+
     def time_modifier(self, time):
         return float(time) / self.TIMESTAMP_RESOLUTION
 
     def accel_modifier(self, accel):
         return float(accel) / self.accel_resolution
 
+    @staticmethod
+    def parse_value(value: str) -> int | float | str:
+        """
+        converts a value from the SD card to int or float if it is a number
+        (numbers with leading zeros, like fltEvents bits, are kept as text)
+        """
+        value = value.strip()
+        digits = value[1:] if value.startswith("-") else value
+
+        if digits.isdigit():
+            if digits[0] != "0" or len(digits) == 1:
+                return int(value)
+            return value
+
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+    def compile_columns(self, keys: list) -> list:
+        """
+        builds the [key, converter] list used to decode value rows after a key row.
+        Keys with a modifier (time, accel) use it, other columns get their
+        converter (int, float or str.strip) from the first value found in them
+        """
+        return [[key, self.modifiers.get(key)] for key in keys]
+
+    @staticmethod
+    def infer_converter(value: str):
+        parsed = SDCardTelemetryDecoder.parse_value(value)
+
+        if type(parsed) is int:
+            return int
+        elif type(parsed) is float:
+            return float
+        return str.strip
+
+    @staticmethod
+    def decode_row(converters: list, values) -> dict:
+        """
+        decodes a whole value row once every column has a converter. Raises on
+        rows it can't handle (short rows, blank cells, values of another type)
+        so they go through decode_columns() instead
+        """
+        telemetry = {}
+
+        for (i, key, converter) in converters:
+            value = values[i]
+            if value:
+                telemetry[key] = converter(value)
+
+        return telemetry
+
     @staticmethod
     def format_key(key):
         # change all keys to be consistently formatted
@@ -339,40 +453,104 @@ class SDCardTelemetryDecoder(TelemetryDecoder):
             return self.decode_telemetry_values(items)
 
         # but if not raw telemetry, we check to see if there's a row of keys instead
-        # the only way to know what a line means is based on unique items that we can
-        # find in key-rows
-        for state, unique_key in self.unique_keys.items():
-            if unique_key in items:
-                self.state = state
+        header = self.read_header(line, items)
+
+        # if it's not flight telemetry, and it's not a key-row, then we can assume it's another
+        # row of telemetry (like launch/land/flight-summary)
+        if header is None:
+            return self.decode_telemetry_values(items)
+
+        # FLIGHT key-row's column 0 actually refers to time, not name. So we return name only.
+        if header.state == DecoderState.INFLIGHT:
+            return {"name": items[0]}
+
+        return None # return and await next line to decode it
 
+    def read_header(self, line: str, items: list) -> SDCardHeader | None:
+        """
+        if line is a key row, makes it the current header (and state) and returns it
+
+        Key rows already seen are found by their fingerprint: everything after the first
+        item, as item 0 of the FLIGHT key-row is the rocket name, which changes between flights
+        """
+        fingerprint = line.partition(",")[2]
+        header = self.headers.get(fingerprint)
+
+        if header is None:
+            header = self.detect_header(items)
+            if header is None:
+                return None
+            self.headers[fingerprint] = header
+
+        self.header = header
+        self.state = header.state
+        self.telemetry_keys = header.keys
+        return header
+
+    def detect_header(self, items: list) -> SDCardHeader | None:
+        """
+        the only way to know what a line means is based on unique items that we can
+        find in key-rows. Returns the compiled header if items is a key row
+        """
+        found_keys = self.unique_key_set.intersection(items)
+        if not found_keys:
+            return None
+
+        for state, unique_key in self.unique_keys.items():
+            if unique_key in found_keys:
                 # reformat keys and remove empty keys, then store for decoding:
-                self.telemetry_keys =  \
-                    [SDCardTelemetryDecoder.format_key(key) for key in items if key.strip()]
+                keys = [SDCardTelemetryDecoder.format_key(key) for key in items if key.strip()]
 
                 # item 0 of FLIGHT key-row is actually name of rocket which complicates things
-                # as its column actually refers to time, not name. So we return name only.
+                # as its column actually refers to time
                 if state == DecoderState.INFLIGHT:
-                    name = items[0]
-                    self.telemetry_keys[0] = "time"
-                    return {"name": name}
-                else:
-                    return None # return and await next line to decode it
+                    keys[0] = "time"
 
-        # if it's not flight telemetry, and it's not a key-row, then we can assume it's another
-        # row of telemetry (like launch/land/flight-summary)
-        return self.decode_telemetry_values(items)
+                return SDCardHeader(state, keys, self.compile_columns(keys))
 
     def decode_telemetry_values(self, values) -> dict | None:
         """
-        maps received data line to keys from key line for sending dict to UI
+        maps received data line to keys from key line for sending dict to UI,
+        converting each value with its column's converter and ignoring all empties
         """
+        header = self.header
+        if header is None:
+            return None
+
+        if header.converters is not None:
+            try:
+                return self.decode_row(header.converters, values)
+            except (ValueError, IndexError):
+                pass # decode this row column by column
+
+        return self.decode_columns(header, values)
+
+    def decode_columns(self, header: SDCardHeader, values) -> dict | None:
+        """
+        slow path of decode_telemetry_values(): picks converters for columns that
+        don't have one yet, and lists them for decode_row() once they all do
+        """
+        telemetry_dict = {}
+
         try:
-            telemetry_dict = {key: value for (key, value) in zip(self.telemetry_keys, values) if value.strip()}
+            for (column, value) in zip(header.columns, values):
+                if value and not value.isspace():
+                    (key, converter) = column
+
+                    if converter is None:
+                        converter = column[1] = self.infer_converter(value)
+
+                    try:
+                        telemetry_dict[key] = converter(value)
+                    except ValueError:
+                        # column isn't the type its first value looked like, parse it the slow way from now on
+                        column[1] = self.parse_value
+                        telemetry_dict[key] = self.parse_value(value)
+                        header.converters = None
         except Exception:
             return None
 
-        modified_telemetry = self.apply_modifiers(telemetry_dict)
-
-        # return a dict of all the key-value pairs in the received telemetry, ignoring all empties
-        return modified_telemetry
+        if header.converters is None and all(converter is not None for (_, converter) in header.columns):
+            header.converters = [(i, key, converter) for (i, (key, converter)) in enumerate(header.columns)]
 
+        return telemetry_dict
@@ -0,0 +1,113 @@
+import asyncio
+from threading import Thread, Event
+
+"""
+Telemetry Engine:
+
+runs any number of TelemetryReaders on one asyncio event loop in one
+background thread, instead of a thread per reader.
+
+Readers are given to the engine by setting reader.engine, after which their
+start() and stop() go through the engine, which runs their __run_async__()
+coroutine. Serial readers register their port's file descriptor with the loop
+so they only read when data is waiting; file readers wait between packets with
+asyncio.sleep(). All of them put Messages on their queue as usual. Anything
+which blocks (closing the backup files, readers with no __run_async__) runs in
+the loop's default executor instead, so it never holds up the other readers.
+"""
+
+STOP_TIMEOUT = 5 # seconds to wait for a reader to finish when stopping it
+
+
+class ReaderEngine(object):
+    """
+    One event loop thread shared by readers
+    """
+
+    def __init__(self, name: str = "reader_engine") -> None:
+        self.name = name
+        self.loop = None
+        self.thread = None
+        self.tasks = {} # reader: asyncio.Task running it
+        self.futures = {} # reader: concurrent.futures.Future, done when the reader has finished
+
+    def start_loop(self) -> None:
+        if self.thread is not None:
+            return
+
+        self.loop = asyncio.new_event_loop()
+        ready = Event()
+
+        def run() -> None:
+            asyncio.set_event_loop(self.loop)
+            self.loop.call_soon(ready.set)
+            self.loop.run_forever()
+
+        self.thread = Thread(target=run, name=self.name, daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def start(self, reader) -> None:
+        """
+        starts running reader on the engine (reader.running should already be set)
+        """
+        self.start_loop()
+
+        if reader in self.futures and not self.futures[reader].done():
+            print(f"Reader {reader.name} is already running")
+            return
+
+        self.futures[reader] = asyncio.run_coroutine_threadsafe(self.run_reader(reader), self.loop)
+
+    def stop(self, reader, timeout: float = STOP_TIMEOUT) -> None:
+        """
+        stops reader and waits for it to clean up (close its port and files)
+        """
+        future = self.futures.pop(reader, None)
+        if future is None or self.loop is None:
+            return
+
+        print(f"Stopping reader: {reader.name} ({self.name})")
+        self.loop.call_soon_threadsafe(self.cancel, reader)
+
+        try:
+            future.result(timeout)
+        except Exception as error:
+            print(f"Error stopping reader {reader.name}: {error}")
+
+    def cancel(self, reader) -> None:
+        task = self.tasks.get(reader)
+        if task is not None:
+            task.cancel()
+
+    async def run_reader(self, reader) -> None:
+        self.tasks[reader] = asyncio.current_task()
+
+        try:
+            await reader.__run_async__(reader.queue, reader.running)
+        except asyncio.CancelledError:
+            pass
+        except Exception as error:
+            print(f"Error running reader {reader.name}: {error}")
+        finally:
+            reader.running.clear()
+            del self.tasks[reader]
+
+    def running_readers(self) -> list:
+        return [reader for (reader, future) in self.futures.items() if not future.done()]
+
+    def shutdown(self) -> None:
+        """
+        stops every reader and then the event loop
+        """
+        for reader in list(self.futures):
+            reader.stop()
+
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.run_until_complete(self.loop.shutdown_default_executor()) # threads used for blocking calls
+            self.loop.close()
+
+        self.loop = None
+        self.thread = None
@@ -0,0 +1,390 @@
+from bisect import bisect_right
+from zlib import crc32
+from cobs import cobsr
+import mmap
+import struct
+import time
+
+"""
+Telemetry File:
+
+the TLM backup file format.
+
+Version 1 (legacy) files are just the radio frames as they arrived, one
+after another. Version 2 files wrap every frame in a record which adds the
+time it was received, and add records which make the file seekable:
+
+    header, frame, frame, ... index, frame, frame, ... index, ... summary
+
+Every record is framed the same way as radio packets:
+COBS/R(kind + body + CRC32 of kind + body) followed by a zero byte, so the
+file is append-only, can be split into records from anywhere, and a record
+torn by a crash or power cut fails its CRC and is skipped.
+
+ - header: magic, version and the wall-clock time the recording started
+ - frame: seconds since the start (monotonic clock) and the raw radio frame
+   (without its sync word), good or bad, exactly as it was received
+ - index: written every TLM_INDEX_BLOCK frames, holds an entry every
+   TLM_INDEX_STRIDE frames (time, byte offset, radioPacketNum of the last
+   packet before it) and the offset of the index before it. radioPacketNum
+   is a uint16, so in the index it counts on past 65535 instead of wrapping
+ - summary: written when the recording is closed, holds the number of frames,
+   the first and last frame times and the offset of the last index
+
+Opening a file reads the summary at the end and follows the index chain back
+to the start, so seeking to a time or packet number only needs to read at
+most TLM_INDEX_STRIDE frames. Files without a summary (the recording was cut
+off) are indexed from their last index block, scanning only the frames after it
+
+Files are memory-mapped and split into frames lazily, TLM_SPLIT_SIZE bytes
+of the mapping at a time, so memory use doesn't grow with the size of the
+file and the first frame is ready straight away
+"""
+
+TLM_MAGIC = b"HPRTLM"
+TLM_VERSION = 2
+TLM_INDEX_STRIDE = 16 # frames between index entries
+TLM_INDEX_BLOCK = 1024 # frames between index blocks
+TLM_TAIL_SIZE = 262144 # bytes read from the end of the file to find the summary or last index
+TLM_SPLIT_SIZE = 65536 # bytes of the file split into records at once
+PACKET_NUMBER_RANGE = 65536 # radioPacketNum is a uint16
+
+RECORD_END = b"\x00"
+RECORD_CHECKSUM_LENGTH = 4
+
+HEADER = b"H"
+FRAME = b"F"
+INDEX = b"I"
+SUMMARY = b"S"
+
+HEADER_FORMAT = struct.Struct("<6sBd") # magic, version, wall-clock start time
+FRAME_FORMAT = struct.Struct("<d") # seconds since start
+INDEX_FORMAT = struct.Struct("<q") # offset of previous index (-1 for none)
+INDEX_ENTRY_FORMAT = struct.Struct("<dqq") # time, offset, unwrapped packet number before it (-1 for none)
+SUMMARY_FORMAT = struct.Struct("<qqdd") # frames, offset of last index, first time, last time
+
+
+class TlmFormatError(Exception):
+    pass
+
+
+def encode_record(kind: bytes, body: bytes) -> bytes:
+    record = kind + body
+    return cobsr.encode(record + int.to_bytes(crc32(record), RECORD_CHECKSUM_LENGTH, "big")) + RECORD_END
+
+
+def decode_record(encoded) -> tuple | None:
+    """
+    (kind, body) of an encoded record (without its zero byte), or None if it is damaged
+    """
+    try:
+        record = cobsr.decode(bytes(encoded))
+    except cobsr.DecodeError:
+        return None
+
+    if len(record) <= RECORD_CHECKSUM_LENGTH:
+        return None
+
+    body = record[:-RECORD_CHECKSUM_LENGTH]
+    if crc32(body) != int.from_bytes(record[-RECORD_CHECKSUM_LENGTH:], "big"):
+        return None
+
+    return (body[:1], body[1:])
+
+
+class TlmIndexEntry(object):
+    __slots__ = ("time", "offset", "packet_number")
+
+    def __init__(self, time: float, offset: int, packet_number: int) -> None:
+        self.time = time
+        self.offset = offset
+        self.packet_number = packet_number
+
+
+class TlmWriter(object):
+    """
+    Writes a version 2 TLM file to `file` (anything with write() and tell(),
+    e.g. a BackupFile)
+    """
+    def __init__(self, file, start: float, wall_clock: float = None) -> None:
+        self.file = file
+        self.start = start # monotonic() time which frame times are measured from
+        self.frames = 0
+        self.first_time = None
+        self.last_time = 0.0
+        self.last_packet_number = -1 # unwrapped
+        self.packet_number_wraps = 0
+        self.entries = [] # index entries not written yet
+        self.last_index = -1 # offset of the last index written
+
+        wall_clock = time.time() if wall_clock is None else wall_clock
+        self.file.write(encode_record(HEADER, HEADER_FORMAT.pack(TLM_MAGIC, TLM_VERSION, wall_clock)))
+
+    def write_frame(self, raw: bytes, received: float) -> None:
+        """
+        writes a raw frame (with its sync word) received at monotonic() time `received`
+        """
+        frame_time = received - self.start
+
+        if self.frames % TLM_INDEX_STRIDE == 0:
+            self.entries.append(TlmIndexEntry(frame_time, self.file.tell(), self.last_packet_number))
+
+        self.file.write(encode_record(FRAME, FRAME_FORMAT.pack(frame_time) + raw[:-1]))
+
+        self.frames += 1
+        if self.first_time is None:
+            self.first_time = frame_time
+        self.last_time = frame_time
+
+        if self.frames % TLM_INDEX_BLOCK == 0:
+            self.write_index()
+
+    def note_packet_number(self, packet_number: int | None) -> None:
+        """
+        radioPacketNum of the last frame written (once it has been decoded).
+        A drop of more than half the range is the number wrapping round
+        """
+        if packet_number is None:
+            return
+
+        last = self.last_packet_number % PACKET_NUMBER_RANGE
+        if self.last_packet_number >= 0 and packet_number < last - PACKET_NUMBER_RANGE // 2:
+            self.packet_number_wraps += 1
+
+        self.last_packet_number = packet_number + self.packet_number_wraps * PACKET_NUMBER_RANGE
+
+    def write_index(self) -> None:
+        if not self.entries:
+            return
+
+        offset = self.file.tell()
+        body = INDEX_FORMAT.pack(self.last_index)
+        body += b"".join(INDEX_ENTRY_FORMAT.pack(entry.time, entry.offset, entry.packet_number) for entry in self.entries)
+        self.file.write(encode_record(INDEX, body))
+
+        self.last_index = offset
+        self.entries = []
+
+    def close(self) -> None:
+        """
+        writes the last index and the summary (the file itself is left open)
+        """
+        self.write_index()
+        first_time = 0.0 if self.first_time is None else self.first_time
+        self.file.write(encode_record(SUMMARY, SUMMARY_FORMAT.pack(self.frames, self.last_index, first_time, self.last_time)))
+
+
+class TlmFile(object):
+    """
+    Reads TLM files of either version from an open binary file.
+
+    frames() yields (time, raw frame) from any offset: time is seconds since
+    the start of the recording, or None for version 1 files, which have no
+    times (or index, so they can only be read from the start).
+
+    Call close() when done, to unmap the file
+    """
+    def __init__(self, file) -> None:
+        self.file = file
+        self.buffer = self.map(file)
+        self.version = 1
+        self.wall_clock = None
+        self.data_start = 0 # offset of the first frame
+        self.entries = [] # TlmIndexEntry, in file order
+        self.times = [] # time of every entry, for bisecting
+        self.packet_numbers = [] # packet number of every entry
+        self.frames_count = None
+        self.first_time = 0.0
+        self.last_time = 0.0
+        self.complete = False # has a summary (the recording was closed properly)
+
+        end = self.buffer.find(RECORD_END, 0, HEADER_FORMAT.size * 2 + 16)
+        record = decode_record(self.buffer[:end]) if end > 0 else None
+
+        if record is not None and record[0] == HEADER and len(record[1]) == HEADER_FORMAT.size:
+            (magic, version, wall_clock) = HEADER_FORMAT.unpack(record[1])
+            if magic == TLM_MAGIC:
+                if version != TLM_VERSION:
+                    raise TlmFormatError(f"TLM version {version} is not supported")
+                self.version = version
+                self.wall_clock = wall_clock
+                self.data_start = end + 1
+                self.load_index()
+
+    @staticmethod
+    def map(file):
+        """
+        read-only mapping of the whole file (its contents, for empty files
+        and file objects which can't be mapped)
+        """
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            file.seek(0)
+            return file.read()
+
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            buffer.madvise(mmap.MADV_SEQUENTIAL) # read ahead, and drop pages once read
+        return buffer
+
+    def close(self) -> None:
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.buffer = b""
+
+    @property
+    def duration(self) -> float:
+        return self.last_time - self.first_time
+
+    def split(self, offset: int):
+        """
+        yields (offset, encoded record or frame) of everything between zero
+        bytes from offset on. The mapping is split TLM_SPLIT_SIZE bytes at a
+        time (up to the last zero byte in them), so only that much is ever copied
+        """
+        buffer = self.buffer
+        size = len(buffer)
+        position = offset
+
+        while position < size:
+            end = buffer.rfind(RECORD_END, position, position + TLM_SPLIT_SIZE)
+            if end == -1:
+                end = buffer.find(RECORD_END, position) # record longer than TLM_SPLIT_SIZE
+                if end == -1:
+                    return # partial record at the end
+
+            start = position
+            for encoded in buffer[position:end].split(RECORD_END):
+                if encoded:
+                    yield (start, encoded)
+                start += len(encoded) + 1
+
+            position = end + 1
+
+    def records(self, offset: int):
+        """
+        yields (offset, kind, body) of every good record from offset on
+        """
+        for (position, encoded) in self.split(offset):
+            record = decode_record(encoded)
+            if record is not None:
+                yield (position, record[0], record[1])
+
+    def frames(self, offset: int = None):
+        """
+        yields (time, raw frame with sync word) from offset (the first frame if None)
+        """
+        offset = self.data_start if offset is None else offset
+
+        if self.version == 1:
+            for (_, raw) in self.split(offset):
+                yield (None, raw + RECORD_END)
+            return
+
+        for (_, kind, body) in self.records(offset):
+            if kind == FRAME:
+                yield (FRAME_FORMAT.unpack_from(body)[0], body[FRAME_FORMAT.size:] + RECORD_END)
+
+    def frame_offsets(self):
+        """
+        yields (offset, time, raw frame without sync word) of every frame, for
+        indexing: offset is where to read frames() from to start at it
+        """
+        if self.version == 1:
+            for (offset, raw) in self.split(self.data_start):
+                yield (offset, None, raw)
+            return
+
+        for (offset, kind, body) in self.records(self.data_start):
+            if kind == FRAME:
+                yield (offset, FRAME_FORMAT.unpack_from(body)[0], body[FRAME_FORMAT.size:])
+
+    def load_index(self) -> None:
+        """
+        finds the summary (or the last index) at the end of the file and
+        reads the index chain back from it
+        """
+        tail_start = max(self.data_start, len(self.buffer) - TLM_TAIL_SIZE)
+
+        # skip the (probably partial) record the tail starts in
+        if tail_start > self.data_start:
+            tail_start = self.buffer.find(RECORD_END, tail_start) + 1
+
+        last_index = -1
+        tail_frames = [] # (time, offset) of frames after the last index
+        last_frame_time = None
+
+        for (position, encoded) in self.split(tail_start):
+            record = decode_record(encoded)
+            if record is not None:
+                (kind, body) = record
+                if kind == SUMMARY:
+                    (self.frames_count, last_index, self.first_time, self.last_time) = SUMMARY_FORMAT.unpack(body)
+                    self.complete = True
+                elif kind == INDEX:
+                    last_index = position
+                    tail_frames = []
+                elif kind == FRAME:
+                    last_frame_time = FRAME_FORMAT.unpack_from(body)[0]
+                    tail_frames.append((last_frame_time, position))
+
+        if not self.complete and last_index == -1 and tail_start > self.data_start:
+            # cut off, and no index near the end: index the whole file
+            tail_frames = [(FRAME_FORMAT.unpack_from(body)[0], offset)
+                           for (offset, kind, body) in self.records(self.data_start) if kind == FRAME]
+
+        blocks = []
+        while last_index != -1:
+            record = self.read_record(last_index)
+            if record is None or record[0] != INDEX:
+                raise TlmFormatError(f"TLM index at {last_index} is damaged")
+            body = record[1]
+            entries = [TlmIndexEntry(*INDEX_ENTRY_FORMAT.unpack_from(body, i))
+                       for i in range(INDEX_FORMAT.size, len(body), INDEX_ENTRY_FORMAT.size)]
+            blocks.append(entries)
+            last_index = INDEX_FORMAT.unpack_from(body)[0]
+
+        for entries in reversed(blocks):
+            self.entries.extend(entries)
+
+        if not self.complete:
+            # frames after the last index are all indexed (there are at most TLM_INDEX_BLOCK)
+            packet_number = self.entries[-1].packet_number if self.entries else -1
+            self.entries.extend(TlmIndexEntry(frame_time, offset, packet_number) for (frame_time, offset) in tail_frames)
+            self.frames_count = None
+            if self.entries:
+                self.first_time = self.entries[0].time
+                self.last_time = self.entries[-1].time if last_frame_time is None else last_frame_time
+
+        self.times = [entry.time for entry in self.entries]
+        self.packet_numbers = [entry.packet_number for entry in self.entries]
+
+    def read_record(self, offset: int) -> tuple | None:
+        """
+        (kind, body) of the record at offset, or None if it is damaged
+        """
+        end = self.buffer.find(RECORD_END, offset)
+        return None if end == -1 else decode_record(self.buffer[offset:end])
+
+    def seek_time(self, frame_time: float) -> TlmIndexEntry | None:
+        """
+        index entry to read frames() from (its offset) to get the frames from
+        frame_time on (it may give up to TLM_INDEX_STRIDE frames before it).
+        None if the file has no index
+        """
+        if not self.entries:
+            return None
+
+        i = bisect_right(self.times, frame_time) - 1
+        return self.entries[max(i, 0)]
+
+    def seek_packet(self, packet_number: int) -> TlmIndexEntry | None:
+        """
+        index entry to read frames() from to get packet_number (radioPacketNum,
+        counting on past 65535 if it wrapped round) and after
+        """
+        if not self.entries:
+            return None
+
+        i = bisect_right(self.packet_numbers, packet_number - 1) - 1
+        return self.entries[max(i, 0)]
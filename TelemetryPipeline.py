@@ -0,0 +1,516 @@
+from time import perf_counter
+from zlib import crc32
+from cobs import cobsr
+from TelemetryDecoder import *
+
+"""
+Telemetry Pipeline:
+
+the steps every radio packet goes through between the radio (or a TLM file)
+and the UI, as a chain of generator stages:
+
+    raw chunks -> framing -> COBS/R -> CRC32 -> decode -> enrich -> sink
+
+Each stage takes Frames from the stage before it and yields the ones it lets
+through, so frames are pulled through the whole chain one at a time. Every
+stage counts the frames in and out, frames it rejected, and the time spent in
+it, so a stage can be benchmarked on its own (stage.run(frames)) or as part of
+the whole pipeline (Pipeline.report()).
+
+Readers only have to provide the source of raw bytes and the sink, and can add
+taps (e.g. writing the TLM backup) anywhere in the chain.
+"""
+
+SYNC_WORD = bytes.fromhex("00")
+SYNC_WORD_LENGTH = len(SYNC_WORD)
+CHECKSUM_LENGTH = 4
+
+FRAME_BUFFER_SIZE = 65536 # bytes preallocated for framing (grows if a bigger chunk arrives)
+MAX_FRAME_LENGTH = 4096 # partial frames longer than this are dropped as noise
+DEDUP_WINDOW = 2.0 # seconds within which the same packet from another receiver is a duplicate
+
+LINE_END = b"\n" # SD-card style telemetry is one line per row
+MAX_LINE_LENGTH = 4096 # partial lines longer than this are dropped as noise
+
+
+def check_crc32(buffer: bytes) -> memoryview | None:
+    """
+    checks the CRC32 on the end of a COBS-decoded packet and returns
+    a memoryview of the telemetry bytes in front of it, so the packet
+    can be decoded in place without copying it. Returns None on mismatch
+    """
+    if len(buffer) <= CHECKSUM_LENGTH:
+        print(f"CRC32 error: packet of {len(buffer)} bytes is too short") # for debug
+        return None
+
+    view = memoryview(buffer)
+    telemetry_bytes = view[:-CHECKSUM_LENGTH]
+    received_crc32 = int.from_bytes(view[-CHECKSUM_LENGTH:], "big")
+    calculated_crc32 = crc32(telemetry_bytes)
+
+    if received_crc32 != calculated_crc32:
+        print(f"CRC32 error: calculated checksum {calculated_crc32:08x} but expected {received_crc32:08x}") # for debug
+        return None
+
+    return telemetry_bytes
+
+
+class FrameError(Exception):
+    """
+    raised by a stage for a frame which can't go any further (bad COBS, CRC etc)
+    """
+    pass
+
+
+class Frame(object):
+    """
+    One radio packet on its way through the pipeline. Each stage fills in
+    its part: raw (frame with its sync word), buffer (COBS/R decoded),
+    telemetry_bytes (CRC checked), packets, state and schema (decoded),
+    telemetry and samples (enriched). source and received (monotonic time)
+    are set by readers which combine several receivers
+    """
+    __slots__ = ("raw", "buffer", "telemetry_bytes", "packets", "state", "schema", "telemetry", "samples",
+                 "source", "received")
+
+    def __init__(self, raw: bytes) -> None:
+        self.raw = raw
+        self.buffer = None
+        self.telemetry_bytes = None
+        self.packets = None
+        self.state = None
+        self.schema = None
+        self.telemetry = {}
+        self.samples = ()
+        self.source = None
+        self.received = 0.0
+
+
+class PipelineStage(object):
+    """
+    Base class for pipeline stages
+
+    Subclasses implement process(frame), which returns the frame to pass it
+    on, None to drop it quietly, or raises FrameError to reject it.
+    on_error(stage, frame, error) is called for every rejected frame
+    """
+    name = "stage"
+
+    def __init__(self) -> None:
+        self.on_error = None
+        self.reset()
+
+    def reset(self) -> None:
+        self.frames_in = 0
+        self.frames_out = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def process(self, frame: Frame) -> Frame | None:
+        return frame
+
+    def run(self, frames):
+        process = self.process
+
+        for frame in frames:
+            self.frames_in += 1
+            start = perf_counter()
+
+            try:
+                frame = process(frame)
+            except FrameError as error:
+                self.seconds += perf_counter() - start
+                self.errors += 1
+                if self.on_error is not None:
+                    self.on_error(self, frame, error)
+                continue
+
+            self.seconds += perf_counter() - start
+
+            if frame is not None:
+                self.frames_out += 1
+                yield frame
+
+    def stats(self) -> str:
+        rate = max(self.frames_in, self.frames_out) / self.seconds if self.seconds else 0
+        return (f"{self.name:<10} in: {self.frames_in:>9} out: {self.frames_out:>9} errors: {self.errors:>6}"
+                f"   {self.seconds:>8.3f}s  ({rate:,.0f} frames/s)")
+
+
+class FrameBuffer(object):
+    """
+    Preallocated buffer which raw bytes are copied into as they arrive and
+    which is split into frames on the sync word incrementally: bytes are only
+    searched once, however many reads a frame takes to arrive. Consumed bytes
+    are reclaimed when the buffer empties, or by moving the partial frame
+    back to the start when the end of the buffer is reached.
+
+    Frames can be any length up to max_frame_length. A partial frame longer
+    than that (e.g. noise with no sync word) is dropped and kept in
+    `discarded` until the caller takes it. sync_word can be anything which
+    ends a frame (e.g. LINE_END for text lines)
+    """
+
+    def __init__(self,
+                 capacity: int = FRAME_BUFFER_SIZE,
+                 max_frame_length: int = MAX_FRAME_LENGTH,
+                 sync_word: bytes = SYNC_WORD) -> None:
+
+        self.buffer = bytearray(capacity)
+        self.max_frame_length = max_frame_length
+        self.sync_word = sync_word
+        self.start = 0 # start of the partial frame
+        self.scan = 0 # bytes before this have been searched for the sync word
+        self.end = 0 # end of data
+        self.discarded = []
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def write(self, data) -> None:
+        length = len(data)
+
+        if self.end + length > len(self.buffer):
+            self.compact()
+            if self.end + length > len(self.buffer):
+                self.buffer.extend(bytes(self.end + length - len(self.buffer)))
+
+        self.buffer[self.end:self.end + length] = data
+        self.end += length
+
+    def compact(self) -> None:
+        """
+        moves the partial frame to the start of the buffer
+        """
+        length = self.end - self.start
+        self.buffer[:length] = self.buffer[self.start:self.end]
+        self.scan -= self.start
+        self.start = 0
+        self.end = length
+
+    def frames(self) -> list:
+        """
+        returns every complete frame (including its sync word) written so far
+        """
+        buffer = self.buffer
+        sync_word = self.sync_word
+        sync_word_length = len(sync_word)
+        start = self.start
+        end = self.end
+        frames = []
+
+        with memoryview(buffer) as view:
+            index = buffer.find(sync_word, self.scan, end)
+
+            while index != -1:
+                if index > start: # skip empty frames between sync words
+                    frames.append(bytes(view[start:index + sync_word_length]))
+                start = index + sync_word_length
+                index = buffer.find(sync_word, start, end)
+
+            if end - start > self.max_frame_length:
+                self.discarded.append(bytes(view[start:end]))
+                start = end
+
+        if start == end:
+            start = end = 0 # nothing left over, so start filling from the beginning again
+
+        self.start = start
+        self.scan = end
+        self.end = end
+        return frames
+
+
+class FramingStage(PipelineStage):
+    """
+    Splits chunks of raw bytes (from serial reads or a file) into frames
+    ending with the sync word with a FrameBuffer, so a partial frame at the
+    end of a chunk is kept until the rest of it arrives. Takes bytes instead
+    of Frames, counted as one frame in per chunk. Dropped partial frames
+    are counted as errors
+    """
+    name = "framing"
+
+    def __init__(self, frame_buffer: FrameBuffer = None) -> None:
+        PipelineStage.__init__(self)
+        self.frame_buffer = FrameBuffer() if frame_buffer is None else frame_buffer
+
+    def run(self, chunks):
+        frame_buffer = self.frame_buffer
+
+        for chunk in chunks:
+            self.frames_in += 1
+            start = perf_counter()
+
+            frame_buffer.write(chunk)
+            frames = [Frame(raw) for raw in frame_buffer.frames()]
+
+            self.seconds += perf_counter() - start
+
+            while frame_buffer.discarded:
+                self.errors += 1
+                if self.on_error is not None:
+                    self.on_error(self, Frame(frame_buffer.discarded.pop(0)),
+                                  FrameError(f"Framing error: no sync word within {frame_buffer.max_frame_length} bytes"))
+
+            self.frames_out += len(frames)
+            yield from frames
+
+
+class CobsStage(PipelineStage):
+    """
+    Decodes COBS/R (Consistent-Overhead Byte-Stuffing/Reduced [Packet synchronization])
+    """
+    name = "COBS/R"
+
+    def process(self, frame: Frame) -> Frame:
+        try:
+            frame.buffer = cobsr.decode(frame.raw[:-SYNC_WORD_LENGTH])
+        except cobsr.DecodeError as error: # technically should never happen...
+            raise FrameError(f"COBS error: 0x00 found in data stream ({error})")
+        return frame
+
+
+class CrcStage(PipelineStage):
+    """
+    Checks the CRC32 at the end of the packet (or only wraps the buffer in a
+    memoryview if use_crc32 is False)
+    """
+    name = "CRC32"
+
+    def __init__(self, use_crc32: bool = True) -> None:
+        PipelineStage.__init__(self)
+        self.use_crc32 = use_crc32
+
+    def process(self, frame: Frame) -> Frame:
+        if not self.use_crc32:
+            frame.telemetry_bytes = memoryview(frame.buffer)
+            return frame
+
+        frame.telemetry_bytes = check_crc32(frame.buffer)
+        if frame.telemetry_bytes is None:
+            raise FrameError("CRC32 error")
+        return frame
+
+
+class DecodeStage(PipelineStage):
+    """
+    Decodes the telemetry bytes into packet records with the RadioTelemetryDecoder
+    """
+    name = "decode"
+
+    def __init__(self, decoder: RadioTelemetryDecoder) -> None:
+        PipelineStage.__init__(self)
+        self.decoder = decoder
+
+    def process(self, frame: Frame) -> Frame:
+        try:
+            frame.packets = self.decoder.decode(frame.telemetry_bytes)
+        except Exception as error:
+            raise FrameError(f"Error decoding data: {error}")
+
+        frame.state = self.decoder.state
+        frame.schema = self.decoder.schema
+        return frame
+
+
+class LineDecodeStage(PipelineStage):
+    """
+    Decodes a line of SD-card style telemetry into the telemetry dict for the
+    UI with the SDCardTelemetryDecoder. Key rows (and lines with nothing to
+    show) are dropped quietly
+    """
+    name = "decode"
+
+    def __init__(self, decoder: SDCardTelemetryDecoder) -> None:
+        PipelineStage.__init__(self)
+        self.decoder = decoder
+
+    def process(self, frame: Frame) -> Frame | None:
+        try:
+            telemetry = self.decoder.decode(frame.raw.decode(errors="replace"))
+        except Exception as error:
+            raise FrameError(f"Error decoding line: {error}")
+
+        if telemetry is None:
+            return None
+
+        frame.telemetry = telemetry
+        frame.state = self.decoder.state
+        return frame
+
+
+class EnrichStage(PipelineStage):
+    """
+    Turns the decoded packets into the telemetry dict for the UI in one pass
+    (see RadioTelemetryDecoder.enrich()). If full_rate() returns True,
+    in-flight packets also get one telemetry dict per sample
+    """
+    name = "enrich"
+
+    def __init__(self, decoder: RadioTelemetryDecoder, full_rate = lambda: False) -> None:
+        PipelineStage.__init__(self)
+        self.decoder = decoder
+        self.full_rate = full_rate
+
+    def process(self, frame: Frame) -> Frame:
+        try:
+            frame.telemetry = self.decoder.enrich(frame.packets)
+
+            if frame.packets and self.full_rate() and frame.state == DecoderState.INFLIGHT:
+                frame.samples = self.decoder.split_samples(frame.packets)
+
+        except Exception as error:
+            raise FrameError(f"Error enriching telemetry data: {error}")
+
+        return frame
+
+
+class TapStage(PipelineStage):
+    """
+    Calls function(frame) on every frame and passes it on unchanged
+    (e.g. for writing the raw frames to a backup file)
+    """
+    def __init__(self, function, name: str = "tap") -> None:
+        PipelineStage.__init__(self)
+        self.name = name
+        self.function = function
+
+    def process(self, frame: Frame) -> Frame:
+        self.function(frame)
+        return frame
+
+
+class SinkStage(TapStage):
+    """
+    Last stage: calls function(frame) on every frame (e.g. send to the UI)
+    """
+    def __init__(self, function, name: str = "sink") -> None:
+        TapStage.__init__(self, function, name)
+
+
+class ReceiverStats(object):
+    """
+    What one receiver contributed to a combined stream
+    """
+    __slots__ = ("frames", "first", "duplicates", "latency")
+
+    def __init__(self) -> None:
+        self.frames = 0 # good frames received
+        self.first = 0 # frames this receiver was first to deliver
+        self.duplicates = 0 # frames another receiver delivered first
+        self.latency = 0.0 # total seconds behind the first copy, for duplicates
+
+
+class DedupStage(PipelineStage):
+    """
+    Combines good (CRC checked) frames from several receivers into one stream:
+    the first copy of a packet is passed on, later copies from other receivers
+    are dropped. Copies are matched by radioPacketNum (for packets which have
+    one) and CRC32, within `window` seconds so a packet which is repeated
+    unchanged by the flight computer later on isn't dropped. A copy from the
+    receiver the first one came from is such a repeat too (packets without a
+    radioPacketNum, like preflight ones, often are), so it is passed on.
+
+    Frames need their source and received time set. Keeps ReceiverStats
+    for every source
+    """
+    name = "dedup"
+
+    def __init__(self, decoder: RadioTelemetryDecoder, window: float = DEDUP_WINDOW) -> None:
+        PipelineStage.__init__(self)
+        self.decoder = decoder
+        self.window = window
+        self.seen = {} # (radioPacketNum, CRC32 bytes): (received time, source) of first copy (oldest first)
+        self.receivers = {} # source: ReceiverStats
+
+    def process(self, frame: Frame) -> Frame | None:
+        seen = self.seen
+        received = frame.received
+
+        # forget packets too old to still have copies on the way
+        while seen:
+            key = next(iter(seen))
+            if received - seen[key][0] <= self.window:
+                break
+            del seen[key]
+
+        stats = self.receivers.get(frame.source)
+        if stats is None:
+            stats = self.receivers[frame.source] = ReceiverStats()
+        stats.frames += 1
+
+        key = (self.decoder.packet_number(frame.telemetry_bytes), bytes(frame.buffer[-CHECKSUM_LENGTH:]))
+        first = seen.get(key)
+
+        if first is not None:
+            (first_received, first_source) = first
+            if first_source != frame.source:
+                stats.duplicates += 1
+                stats.latency += received - first_received
+                return None
+            del seen[key] # sent again: the copies to match are this one's, and it is now the newest
+
+        seen[key] = (received, frame.source)
+        stats.first += 1
+        return frame
+
+
+class Pipeline(object):
+    """
+    Chain of stages, run over a source of raw byte chunks with run()
+
+    on_error(stage, frame, error) is called for every frame any stage rejects
+    """
+    def __init__(self,
+                 stages: list,
+                 on_error = None) -> None:
+
+        self.stages = stages
+
+        for stage in stages:
+            stage.on_error = on_error
+
+    def frames(self, chunks):
+        """
+        generator of the frames coming out of the last stage
+        """
+        frames = chunks
+        for stage in self.stages:
+            frames = stage.run(frames)
+        return frames
+
+    def run(self, chunks) -> None:
+        """
+        pulls every chunk from chunks through all the stages
+        """
+        for _ in self.frames(chunks):
+            pass
+
+    def reset(self) -> None:
+        for stage in self.stages:
+            stage.reset()
+
+    def report(self) -> str:
+        return "\n".join(stage.stats() for stage in self.stages)
+
+
+def radio_stages(decoder: RadioTelemetryDecoder,
+                 use_crc32: bool = True,
+                 full_rate = lambda: False) -> list:
+    """
+    the standard chain for radio packets: framing -> COBS/R -> CRC32 -> decode -> enrich
+    """
+    return [FramingStage(),
+            CobsStage(),
+            CrcStage(use_crc32),
+            DecodeStage(decoder),
+            EnrichStage(decoder, full_rate)]
+
+
+def line_stages(decoder: SDCardTelemetryDecoder) -> list:
+    """
+    the chain for SD-card style telemetry sent as text: lines -> decode
+    """
+    return [FramingStage(FrameBuffer(max_frame_length=MAX_LINE_LENGTH, sync_word=LINE_END)),
+            LineDecodeStage(decoder)]
@@ -0,0 +1,377 @@
+from threading import Thread, Event, Lock
+from bisect import bisect_right
+from time import monotonic, sleep
+from enum import Enum
+from TelemetryDecoder import DecoderState
+import asyncio
+import os
+
+"""
+Telemetry Playback:
+
+speed, pause and seeking for the file readers (TLM and SD-card files).
+
+Every file reader has a PlaybackController. For each frame (or SD-card row)
+the reader tells it how much recording time has gone by, and the controller
+says when the reader should send what it has decoded to the UI and wait().
+
+Replay runs to deadlines against a fixed start: the controller anchors the
+recording time to monotonic() when playback starts (or resumes, seeks or
+changes speed), so every frame is due at anchor + recording time / speed.
+Sleeps never add up into drift, and all the frames due within one
+PLAYBACK_FRAME_INTERVAL are released to the UI as one batch with a single
+sleep before them, however fast the log was recorded. If the replay falls
+behind it catches up in one batch. How late it woke up is kept as its lag.
+
+Unthrottled, nothing waits apart from a yield every PLAYBACK_FRAME_INTERVAL
+(so the UI gets a batch and other readers on the ReaderEngine get a turn).
+Paused, the reader waits until it is resumed, and a wait never lasts longer
+than it takes to notice a seek or stop. The UI thread only sets requests on
+the controller, the reader picks them up between frames.
+
+Seeking goes through a PlaybackIndex the reader builds the first time a file
+is opened (kept while the file doesn't change): a mark every
+PLAYBACK_INDEX_INTERVAL seconds of recording and at every decoder state
+change. The file is scanned for it on a thread of its own, so playback starts
+straight away; seeks asked for before it is ready are turned down. A seek starts reading at the mark before the time asked for and plays
+the frames up to it without waiting. Events (liftoff, landing) are the first
+mark in their decoder state. Version 2 TLM files are indexed from the index
+blocks they carry (see TlmPlaybackIndex in TelemetryReader), which can
+also seek to a radioPacketNum.
+"""
+
+PLAYBACK_SPEEDS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0) # speeds offered in the UI
+PLAYBACK_WAIT_SLICE = 0.05 # longest sleep before checking for pause, seek and stop again
+PLAYBACK_FRAME_INTERVAL = 0.02 # seconds of replay sent to the UI as one batch
+PLAYBACK_INDEX_INTERVAL = 1.0 # seconds of recording between index marks
+
+
+class PlaybackEvent(Enum):
+    START = "Start"
+    LIFTOFF = "Liftoff"
+    LANDING = "Landing"
+
+    def __str__(self):
+        return self.value
+
+
+class PlaybackPacket(int):
+    """
+    seek target: a radioPacketNum (counting on past 65535 if it wrapped round)
+    """
+
+
+# decoder states which start each event (None: the start of the file)
+EVENT_STATES = {PlaybackEvent.START: None,
+                PlaybackEvent.LIFTOFF: (DecoderState.INFLIGHT,),
+                PlaybackEvent.LANDING: (DecoderState.LAND, DecoderState.POSTFLIGHT)}
+
+
+class PlaybackMark(object):
+    """
+    A place to start reading a file from: its recording time, byte offset,
+    decoder state and (SD-card files) the offset of the key row it needs
+    """
+    __slots__ = ("time", "offset", "state", "header")
+
+    def __init__(self, time: float, offset: int, state: DecoderState, header: int = None) -> None:
+        self.time = time
+        self.offset = offset
+        self.state = state
+        self.header = header
+
+
+class PlaybackIndex(object):
+    """
+    Marks of one file, in file order
+    """
+    def __init__(self, interval: float = PLAYBACK_INDEX_INTERVAL) -> None:
+        self.interval = interval
+        self.marks = []
+        self.times = [] # time of every mark, for bisecting
+        self.duration = 0.0
+        self.next_time = 0.0
+        self.last_state = None
+        self.complete = True # has the marks of every state change (so can find events)
+
+    def add(self, time: float, offset: int, state: DecoderState, header: int = None) -> None:
+        """
+        called by the reader building the index for every frame (or row), in
+        file order, with the time it is played at. Keeps it if it starts a new
+        state or interval seconds have gone by since the last mark
+        """
+        if state != self.last_state or time >= self.next_time:
+            self.marks.append(PlaybackMark(time, offset, state, header))
+            self.times.append(time)
+            self.next_time = time + self.interval
+            self.last_state = state
+
+        self.duration = time
+
+    def at_time(self, time: float) -> PlaybackMark | None:
+        """
+        last mark at or before time
+        """
+        if not self.marks:
+            return None
+
+        i = bisect_right(self.times, time) - 1
+        return self.marks[max(i, 0)]
+
+    def at_event(self, event: PlaybackEvent) -> PlaybackMark | None:
+        states = EVENT_STATES[event]
+
+        for mark in self.marks:
+            if states is None or mark.state in states:
+                return mark
+
+        return None
+
+    def at_packet(self, packet_number: int) -> PlaybackMark | None:
+        """
+        mark at or before packet_number, if the file has packet numbers in its index
+        """
+        return None
+
+
+class PlaybackController(object):
+    """
+    Speed, pause and seek requests for one file reader
+    """
+    def __init__(self) -> None:
+        self.speed = 1.0
+        self.unthrottled = False
+        self.playing = Event() # cleared while paused
+        self.playing.set()
+        self.lock = Lock()
+        self.seek_request = None # time or PlaybackEvent asked for by the UI
+        self.seek_target = None # time being skipped to, after a seek
+        self.index = None # PlaybackIndex of the file being played (None until it is ready)
+        self.indexes = {} # (filename, size, modification time): PlaybackIndex
+        self.indexing = set() # keys of the indexes being built
+        self.key = None # key of the file being played
+        self.filename = None
+        self.position = 0.0 # recording time of the last frame played
+        self.anchor = None # (monotonic() time, recording time) deadlines are measured from, None to start again
+        self.frame_end = 0.0 # frames due before this go in the current batch
+
+        # how late the last wait() woke up after its deadline (behind, when positive)
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    # UI side
+    # -------
+    def set_speed(self, speed: float) -> None:
+        self.speed = speed
+        self.unthrottled = False
+        self.anchor = None
+
+    def set_unthrottled(self, unthrottled: bool = True) -> None:
+        self.unthrottled = unthrottled
+        self.anchor = None
+
+    def pause(self) -> None:
+        self.playing.clear()
+
+    def resume(self) -> None:
+        self.playing.set()
+
+    def toggle_pause(self) -> None:
+        if self.paused:
+            self.resume()
+        else:
+            self.pause()
+
+    @property
+    def paused(self) -> bool:
+        return not self.playing.is_set()
+
+    def seek(self, target: float | PlaybackEvent | PlaybackPacket) -> None:
+        """
+        asks the reader to carry on from target: a recording time (seconds from
+        the start), an event or a packet number
+        """
+        with self.lock:
+            self.seek_request = target
+
+    @property
+    def duration(self) -> float:
+        return 0.0 if self.index is None else self.index.duration
+
+    # Reader side
+    # -----------
+    def open(self, filename: str, build_index, index: PlaybackIndex = None) -> None:
+        """
+        called by the reader when it starts playing filename. Uses the index
+        built the last time the file was played, or starts build_index() (which
+        opens the file itself) on a thread to scan the file for one. Until it
+        is ready, index is used if given: one which costs nothing to build but
+        may not be complete
+        """
+        status = os.stat(filename)
+        key = (os.path.abspath(filename), status.st_size, status.st_mtime)
+
+        with self.lock:
+            self.seek_request = None
+            self.key = key
+            self.filename = filename
+            self.index = self.indexes.get(key, index)
+
+            if key not in self.indexes and key not in self.indexing:
+                self.indexing.add(key)
+                Thread(target=self.build_index, args=(key, filename, build_index), name="playback_index", daemon=True).start()
+
+        self.seek_target = None
+        self.position = 0.0
+        self.anchor = None
+        self.frame_end = monotonic() + PLAYBACK_FRAME_INTERVAL
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def build_index(self, key: tuple, filename: str, build_index) -> None:
+        start = monotonic()
+
+        try:
+            index = build_index()
+        except Exception as error:
+            print(f"Cannot index {filename}:\n{error}")
+            index = None
+
+        with self.lock:
+            self.indexing.discard(key)
+            if index is None:
+                return
+            self.indexes[key] = index
+            if self.key == key:
+                self.index = index
+
+        print(f"Indexed {filename}: {len(index.marks)} marks over {index.duration:.1f}s"
+              f" in {1000 * (monotonic() - start):.0f}ms")
+
+    def due(self, delay: float) -> bool:
+        """
+        moves the playback on by delay seconds of recording (the time before
+        the frame just decoded). True if the reader should send what it has to
+        the UI and wait() now
+        """
+        self.position += delay
+
+        if self.seek_request is not None:
+            return True
+
+        if self.seek_target is not None:
+            if self.position < self.seek_target:
+                return monotonic() >= self.frame_end
+            self.seek_target = None
+            self.anchor = None
+
+        if not self.playing.is_set():
+            return True
+
+        if self.unthrottled:
+            return monotonic() >= self.frame_end
+
+        anchor = self.anchor
+        if anchor is None:
+            now = monotonic()
+            self.anchor = (now, self.position)
+            self.frame_end = now + PLAYBACK_FRAME_INTERVAL
+            return False
+
+        return anchor[0] + (self.position - anchor[1]) / self.speed > self.frame_end
+
+    def deadline(self) -> float | None:
+        """
+        monotonic() time the frame at position is due (None if it is due now)
+        """
+        anchor = self.anchor
+        if anchor is None or self.unthrottled or self.seek_target is not None:
+            return None
+        return anchor[0] + (self.position - anchor[1]) / self.speed
+
+    def wait(self, running: Event) -> None:
+        """
+        waits until the frame at position is due, and while paused. Returns
+        early when a seek is asked for or running is cleared
+        """
+        deadline = self.deadline()
+
+        while running.is_set() and self.seek_request is None:
+            if not self.playing.is_set() and self.seek_target is None:
+                self.playing.wait(PLAYBACK_WAIT_SLICE)
+                self.anchor = deadline = None # start the clock again once resumed
+                continue
+
+            remaining = 0.0 if deadline is None else deadline - monotonic()
+            if remaining <= 0:
+                break
+            sleep(min(remaining, PLAYBACK_WAIT_SLICE))
+
+        self.woke(deadline)
+
+    async def wait_async(self, running: Event) -> None:
+        """
+        wait() for the ReaderEngine's event loop (always gives it a turn, even when nothing is due)
+        """
+        deadline = self.deadline()
+        await asyncio.sleep(0)
+
+        while running.is_set() and self.seek_request is None:
+            if not self.playing.is_set() and self.seek_target is None:
+                await asyncio.sleep(PLAYBACK_WAIT_SLICE)
+                self.anchor = deadline = None
+                continue
+
+            remaining = 0.0 if deadline is None else deadline - monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(remaining, PLAYBACK_WAIT_SLICE))
+
+        self.woke(deadline)
+
+    def woke(self, deadline: float | None) -> None:
+        now = monotonic()
+        self.frame_end = now + PLAYBACK_FRAME_INTERVAL
+
+        if deadline is not None:
+            self.lag = now - deadline
+            self.max_lag = max(self.max_lag, self.lag)
+
+    def take_seek(self) -> PlaybackMark | None:
+        """
+        the mark to read from for the seek asked for since the last call, if any.
+        Frames from the mark to the time asked for are then played without waiting
+        """
+        with self.lock:
+            (target, self.seek_request) = (self.seek_request, None)
+
+        if target is None:
+            return None
+
+        index = self.index
+        if index is None or (isinstance(target, PlaybackEvent) and not index.complete):
+            print(f"Still indexing {self.filename}, try again in a moment")
+            return None
+
+        if isinstance(target, PlaybackEvent):
+            mark = index.at_event(target)
+            if mark is None:
+                print(f"No {str(target).lower()} found in this file")
+                return None
+            target = mark.time
+        elif isinstance(target, PlaybackPacket):
+            mark = index.at_packet(target)
+            if mark is None:
+                print(f"Can't go to packet {target}: this file has no packet numbers in its index")
+                return None
+            target = mark.time
+        else:
+            mark = index.at_time(target)
+            if mark is None:
+                return None
+
+        self.position = mark.time
+        self.seek_target = target if target > mark.time else None
+        self.anchor = None
+        self.frame_end = monotonic() + PLAYBACK_FRAME_INTERVAL
+        return mark
@@ -6,21 +6,22 @@ import time
 import queue
 import sys
 import serial
+import asyncio
 from time import monotonic
-from collections import namedtuple
 from TelemetryDecoder import *
-import pathlib
-from zlib import crc32
+from TelemetryPipeline import *
+from TelemetryBackup import *
+from TelemetryFile import *
+from TelemetryPlayback import *
 from cobs import cobsr
+from zlib import crc32
+import pathlib
+import locale
+import io
 
-SYNC_WORD = bytes.fromhex("00")
-SYNC_WORD_LENGTH = len(SYNC_WORD)
-CHECKSUM_LENGTH = 4
-
-MAX_PACKET_LENGTH = 255
 TLM_INTERVAL = 0.05
 SHORT_INTERVAL = 0.01
-SERIAL_READ_INTERVAL = 0.01
+ASYNC_POLL_INTERVAL = 0.01 # seconds between serial reads when the event loop can't watch the port
 
 TLM_EXTENSION = ".tlm"
 CSV_EXTENSION = ".csv"
@@ -28,9 +29,174 @@ BACKUP_NAME = "backup.tlm"
 END_LINE = "\n"
 TIME_FORMAT = "%H:%M:%S"
 ELAPSED_FORMAT = "{:.3f}"
+CSV_CHECKPOINT_INTERVAL = 5.0 # seconds between writing the pending preflight/postflight row of the CSV backup
+
+
+async def run_blocking(function, *args):
+    """
+    runs function(*args) in the event loop's default executor, so it doesn't
+    stall the other readers on the loop. If the task is cancelled meanwhile,
+    still waits for function to finish before passing the cancel on, so
+    ReaderEngine.stop() only returns once it has
+    """
+    future = asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await future
+        raise
+
+
+class MessageBatch(object):
+    """
+    Everything a reader decoded in one read (or one replay tick), sent to the
+    UI queue in one put() instead of a Message per packet.
+
+    telemetry is every message's telemetry dict merged in order (so it holds
+    the latest value of every key, ready for the UI variables), and columns
+    has the same data laid out per key, one row per message (or per in-flight
+    sample in full-rate mode) for graphs and min/max. Rows which didn't have a
+    key hold None in its column.
+
+    A batch only ever holds one decoder state
+    """
+    __slots__ = ("telemetry", "decoder_state", "local_time", "total_message_size", "messages", "rows", "columns", "last_keys")
+
+    def __init__(self, decoder_state: DecoderState) -> None:
+        self.telemetry = {}
+        self.decoder_state = decoder_state
+        self.local_time = 0.0
+        self.total_message_size = 0
+        self.messages = 0
+        self.rows = 0
+        self.columns = {}
+        self.last_keys = None
+
+    def add(self, telemetry: dict, local_time: float, message_size: int, samples = ()) -> None:
+        self.telemetry.update(telemetry)
+        self.local_time = local_time
+        self.total_message_size += message_size
+        self.messages += 1
+
+        for row in samples or (telemetry,):
+            self.add_row(row)
+
+    def add_row(self, row: dict) -> None:
+        columns = self.columns
+        rows = self.rows
+
+        if row.keys() == self.last_keys:
+            # same keys as the row before, so their columns are all full up to here
+            for (key, value) in row.items():
+                columns[key].append(value)
+            self.rows = rows + 1
+            return
+
+        self.last_keys = row.keys()
 
+        for (key, value) in row.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * rows
+            elif len(column) < rows:
+                column.extend([None] * (rows - len(column)))
+            column.append(value)
+
+        self.rows = rows + 1
+
+    def merge(self, batch: "MessageBatch") -> None:
+        """
+        appends a later batch of the same decoder state to this one: the
+        telemetry keeps the latest value of every key, columns keep every row
+        """
+        rows = self.rows
+        columns = self.columns
+
+        self.telemetry.update(batch.telemetry)
+        self.local_time = batch.local_time
+        self.total_message_size += batch.total_message_size
+        self.messages += batch.messages
+
+        for (key, column) in batch.columns.items():
+            own = columns.get(key)
+            if own is None:
+                own = columns[key] = [None] * rows
+            elif len(own) < rows:
+                own.extend([None] * (rows - len(own)))
+            own.extend(column)
+
+        self.rows = rows + batch.rows
+        self.last_keys = None
+
+    def insert_rows(self, batch: "MessageBatch") -> None:
+        """
+        puts the rows of an earlier batch, which is being dropped, in front of
+        this one's so graphs still get them. Only the rows: the telemetry,
+        decoder state and message counts stay this batch's own
+        """
+        rows = batch.rows
+        columns = batch.columns # the earlier batch is being dropped, so its columns can be reused
+
+        for column in columns.values():
+            if len(column) < rows:
+                column.extend([None] * (rows - len(column)))
+
+        for (key, own) in self.columns.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * rows
+            column.extend(own)
+
+        self.columns = columns
+        self.rows += rows
+        self.last_keys = None
+
+    def column(self, key: str) -> list:
+        """
+        all rows of key (None where a row didn't have it)
+        """
+        column = self.columns.get(key)
+        if column is None:
+            return [None] * self.rows
+        if len(column) < self.rows:
+            column.extend([None] * (self.rows - len(column)))
+        return column
+
+
+class MessageBatcher(object):
+    """
+    Collects a reader's messages into a MessageBatch until flush(), which puts
+    the batch on the queue. A change of decoder state flushes first, so the UI
+    sees every state the flight went through
+    """
+    def __init__(self, message_queue: queue.Queue) -> None:
+        self.queue = message_queue
+        self.batch = None
+        self.batches_sent = 0
+        self.messages_sent = 0
+
+    def add(self, telemetry: dict, decoder_state: DecoderState, message_size: int, samples = ()) -> None:
+        batch = self.batch
+        if batch is not None and batch.decoder_state != decoder_state:
+            self.flush()
+            batch = None
+
+        if batch is None:
+            batch = self.batch = MessageBatch(decoder_state)
+
+        # monotonic() is not affected by time/date/zone changes
+        batch.add(telemetry, monotonic(), message_size, samples)
+
+    def flush(self) -> None:
+        if self.batch is None:
+            return
+
+        self.batches_sent += 1
+        self.messages_sent += self.batch.messages
+        self.queue.put(self.batch)
+        self.batch = None
 
-Message = namedtuple("message", ["telemetry", "decoder_state", "local_time", "total_message_size"])
 
 class TelemetryReader(object):
     """
@@ -54,21 +220,253 @@ class TelemetryReader(object):
         self.bad_packets_received = 0
         self.print_received = False
         self.use_crc32 = False
+        self.full_rate = False # send every in-flight sample to UI, instead of merging them into the last one
+        self.pipeline = None # last pipeline built, for per-stage stats
+        self.engine = None # ReaderEngine to run on, instead of a thread of our own
+        self.batcher = None # MessageBatcher of the current session
 
     def start(self) -> None:
         self.running.set()
+
+        if self.engine is not None:
+            self.engine.start(self)
+            return
+
         self.thread = Thread(target=self.__run__, args=(self.queue,self.running), name=self.name)
         self.thread.start()
 
     def stop(self) -> None:
         self.running.clear()
+
+        if self.engine is not None:
+            self.engine.stop(self)
+            return
+
         if self.thread is not None:
             print(f"Stopping thread: {self.name} ({self.thread})")
             self.thread.join()
 
-    def __run__(self):
+    def __run__(self, message_queue, running):
         pass
 
+    async def __run_async__(self, message_queue, running):
+        """
+        version of __run__ for the ReaderEngine's event loop: must never block,
+        waits with await instead. Readers without one have their __run__ run
+        in the loop's default executor, so they still work on an engine (in a
+        thread of their own, stopped by clearing running as usual)
+        """
+        await run_blocking(self.__run__, message_queue, running)
+
+    # kept here as well, for code which checks packets without a pipeline
+    check_crc32 = staticmethod(check_crc32)
+
+    def build_pipeline(self, sink, backup = None) -> Pipeline:
+        """
+        builds the radio pipeline (framing -> COBS/R -> CRC32 -> decode -> enrich)
+        ending in sink(frame), or with no sink if sink is None (the caller then
+        takes the frames from pipeline.frames() itself). backup(frame) is called
+        for every frame, good or bad, straight after framing
+        """
+        stages = radio_stages(self.decoder, self.use_crc32, lambda: self.full_rate)
+
+        if backup is not None:
+            stages.insert(1, TapStage(backup, "backup"))
+
+        if sink is not None:
+            stages.append(SinkStage(sink))
+
+        self.pipeline = Pipeline(stages, on_error=self.frame_error)
+        return self.pipeline
+
+    def frame_error(self, stage: PipelineStage, frame: Frame, error: FrameError) -> None:
+        self.bad_packets_received += 1
+        self.bad_bytes_received += len(frame.raw)
+        print(f"{error}") # for debug
+        print(f"{len(frame.raw):>6} raw bytes: {frame.raw.hex(' ')}  ({self.bad_bytes_received} bad bytes so far)") # for debug
+
+class CsvBackupWriter(object):
+    """
+    Writes decoded radio telemetry to the human-readable CSV backup file
+
+    CSV files have quite complex behaviour, to try to simulate the CSV file recorded by groundstation
+     - there should only be 1 preflight message (but FC can go PRE->FlIGHT->PRE many times during setup)
+     - i.e. it is possible to go FLIGHT->PREFLIGHT so need to handle this
+     - there should only be 1 postflight message (but we may receive more than this, and dont know which is last)
+     - should not allow POSTFLIGHT->FLIGHT
+     - file is flushed regularly (by the BackupWriter) to ensure it is write to disk
+
+    This is a state machine: TRANSITIONS maps (previous decoder state, new
+    decoder state) to the transition function to run. The latest preflight
+    (or postflight) row is kept in memory as the pending row, which each new
+    one replaces, and only goes to the file when the flight moves on, on a
+    checkpoint every CSV_CHECKPOINT_INTERVAL seconds, or on close(). So the
+    file ends up exactly as if every row had been written and the replaced
+    ones truncated away, without a seek and truncate per packet
+    """
+
+    def __init__(self, csv_file, csv_filename: str, layout: RadioLayout,
+                 checkpoint_interval: float = None) -> None:
+        self.csv_file = csv_file
+        self.csv_filename = csv_filename
+
+        self.csv_saving_state = DecoderState.OFFLINE
+        self.previous_decoder_state = DecoderState.OFFLINE
+        self.preflight_timestamp = 0.0 # monotonic() timestamp of last preflight message received
+
+        # CSV backup file headers
+        # we get them ready before running so they can be used quickly later
+        self.inflight_header = layout.schema_for_state(DecoderState.INFLIGHT).csv_header(["elapsed"])
+        self.postflight_header = layout.schema_for_state(DecoderState.POSTFLIGHT).csv_header()
+
+        # pending rows: written after pending_start, but may still be replaced
+        self.pending_state = None # PREFLIGHT or POSTFLIGHT while there is a pending row
+        self.pending = [] # rows since pending_start
+        self.pending_start = 0 # position in CSV file of the pending rows
+        self.on_disk = "" # pending rows as they were at the last checkpoint
+        self.checkpoint_interval = CSV_CHECKPOINT_INTERVAL if checkpoint_interval is None else checkpoint_interval
+        self.last_checkpoint = monotonic()
+
+    def write(self, frame: Frame) -> None:
+        state = frame.state
+
+        # First take a copy of the packet's own fields from received telemetry
+        # (not the ones added for the UI, and we don't want to send file changes to UI)
+        csv_keys = frame.schema.all_keys
+        csv_telemetry = {key: frame.telemetry[key] for key in csv_keys}
+
+        # Always add date and time info to PREFLIGHT packets
+        if state == DecoderState.PREFLIGHT:
+            csv_telemetry["date"] = datetime.date.today().isoformat()
+            csv_telemetry["time"] = time.strftime(TIME_FORMAT)
+            self.preflight_timestamp = monotonic()
+
+        # Add elapsed timer to inflight packets (for debug and playback)
+        if state == DecoderState.INFLIGHT:
+            csv_telemetry["elapsed"] = ELAPSED_FORMAT.format(monotonic() - self.preflight_timestamp)
+
+        transition = self.TRANSITIONS.get((self.previous_decoder_state, state))
+        if transition is not None:
+            transition(self, csv_telemetry)
+
+        # Only if we are receiving the packets we expect, write to file:
+        if state == self.csv_saving_state:
+            if frame.samples:
+                # one row per sample, all with the elapsed time of the packet
+                for sample in frame.samples:
+                    self.emit(self.csv_format([sample[key] for key in csv_keys] + [csv_telemetry["elapsed"]]))
+            else:
+                self.emit(self.csv_format(csv_telemetry.values()))
+
+        # Finely store old state
+        self.previous_decoder_state = state
+
+        if self.pending_state is not None and monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    # State transitions
+    # -----------------
+    def begin_preflight(self, csv_telemetry: dict) -> None:
+        # 1. OFFLINE -> PREFLIGHT: record file header (PREFLIGHT keys + date and time),
+        # the PREFLIGHT row after it is pending until the flight starts
+        self.csv_saving_state = DecoderState.PREFLIGHT
+        self.emit(self.csv_format(csv_telemetry.keys()))
+        self.begin_pending(DecoderState.PREFLIGHT)
+
+    def replace_preflight(self, csv_telemetry: dict) -> None:
+        # 2. PREFLIGHT -> PREFLIGHT: if we have not yet seen any FLIGHT data, the new row replaces the pending one
+        if self.csv_saving_state == DecoderState.PREFLIGHT:
+            self.discard_pending(DecoderState.PREFLIGHT)
+
+    def begin_inflight(self, csv_telemetry: dict) -> None:
+        # 3. PREFLIGHT -> INFLIGHT: the first time, keep the last PREFLIGHT row and write the FLIGHT data headers
+        if self.csv_saving_state == DecoderState.PREFLIGHT:
+            self.csv_saving_state = DecoderState.INFLIGHT
+            self.end_pending()
+            self.emit(self.inflight_header)
+
+    def begin_postflight(self, csv_telemetry: dict) -> None:
+        # 4. INFLIGHT -> POSTFLIGHT: write postflight header, the POSTFLIGHT row after it is pending
+        if self.csv_saving_state == DecoderState.INFLIGHT:
+            self.csv_saving_state = DecoderState.POSTFLIGHT
+            self.emit(self.postflight_header)
+            self.begin_pending(DecoderState.POSTFLIGHT)
+
+    def replace_postflight(self, csv_telemetry: dict) -> None:
+        # 5. POSTFLIGHT -> POSTFLIGHT: the new row replaces the pending one
+        self.discard_pending(DecoderState.POSTFLIGHT)
+
+    TRANSITIONS = {(DecoderState.OFFLINE, DecoderState.PREFLIGHT): begin_preflight,
+                   (DecoderState.PREFLIGHT, DecoderState.PREFLIGHT): replace_preflight,
+                   (DecoderState.PREFLIGHT, DecoderState.INFLIGHT): begin_inflight,
+                   (DecoderState.INFLIGHT, DecoderState.POSTFLIGHT): begin_postflight,
+                   (DecoderState.POSTFLIGHT, DecoderState.POSTFLIGHT): replace_postflight}
+
+    # Pending rows
+    # ------------
+    def emit(self, text: str) -> None:
+        if self.pending_state is not None:
+            self.pending.append(text)
+        else:
+            self.safe_write(text)
+
+    def begin_pending(self, state: DecoderState) -> None:
+        self.end_pending()
+        self.pending_state = state
+        self.pending_start = self.csv_file.tell()
+        self.last_checkpoint = monotonic()
+
+    def discard_pending(self, state: DecoderState) -> None:
+        if self.pending_state == state:
+            self.pending = []
+
+    def end_pending(self) -> None:
+        """
+        the pending rows can't be replaced any more, so they go in the file for good
+        """
+        if self.pending_state is None:
+            return
+
+        self.checkpoint()
+        self.pending_state = None
+        self.pending = []
+        self.on_disk = ""
+
+    def checkpoint(self) -> None:
+        """
+        brings the file up to date with the pending rows (at most one truncate,
+        and none if the rows were only added to since the last checkpoint)
+        """
+        self.last_checkpoint = monotonic()
+        text = "".join(self.pending)
+
+        if text == self.on_disk:
+            return
+
+        if text.startswith(self.on_disk):
+            self.safe_write(text[len(self.on_disk):])
+        else:
+            try:
+                self.csv_file.seek(self.pending_start)
+                self.csv_file.truncate()
+            except Exception as error:
+                print(f"Error seeking/truncating {self.csv_filename}:\n{error}")
+            self.safe_write(text)
+
+        self.on_disk = text
+
+    def close(self) -> None:
+        self.end_pending()
+
+    def safe_write(self, data):
+        # errors are reported by the BackupWriter which does the actual writing
+        self.csv_file.write(data)
+
+    @staticmethod
+    def csv_format(values: list):
+        return ",".join(map(str,values)) + "\n"
+
+
 class TelemetrySerialReader(TelemetryReader):
     """
     Base class for readers that read from serial port and save to backup file
@@ -91,318 +489,253 @@ class TelemetrySerialReader(TelemetryReader):
         self.filename = os.path.join(pathlib.Path(__file__).parent.resolve(), BACKUP_NAME) # always save backup
         self.read = None
         self.use_crc32 = True
+        self.tlm_file = None
+        self.csv_file = None
+        self.csv_writer = None
+        self.tlm_writer = None
+        self.backup_writer = None
+
+        # group commit of the backup files (see TelemetryBackup)
+        self.flush_interval = BACKUP_FLUSH_INTERVAL
+        self.flush_bytes = BACKUP_FLUSH_BYTES
+        self.fsync_interval = BACKUP_FSYNC_INTERVAL
 
 
     def __run__(self,
                 message_queue: queue.Queue,
                 running):
 
-        assert self.serial_port is not None
-        assert self.serial_port != ""
+        port = self.open_session(self.timeout)
+        if port is None:
+            return
 
-        port = None
-        tlm_file = None
-        csv_file = None
-        csv_filename = None
-        csv_saving_state = DecoderState.OFFLINE
-        previous_decoder_state = DecoderState.OFFLINE
-        preflight_timestamp = 0.0 # monotonic() timestamp of last preflight message received
+        pipeline = self.session_pipeline(message_queue)
 
-        # CSV backup file headers (only used if saving to CSV file)
-        # we get them ready before running so they can be used quickly later
-        inflight_header = self.csv_format(InFlightData.keys + InFlightMetaData.keys + ["elapsed"])
-        postflight_header = self.csv_format(PostFlightPacket.keys)
-        preflight_start_position = 0 # position in CSV file of preflight message, so we can overwrite it
-        postflight_start_position = 0 # same for postflight
+        for _ in pipeline.frames(self.read_chunks(port)):
+            if not running.is_set():
+                break
 
-        try:
-            port = serial.Serial(port=self.serial_port,
-                                 baudrate=self.baud_rate,
-                                 timeout=self.timeout)
-            print(f"Successfully opened port {self.serial_port}")
-        except Exception as error:
-            print(f"Could not open serial port: {self.serial_port}\n{str(error)}")
+        self.close_session(port)
+        running.clear()
+
+
+    async def __run_async__(self,
+                            message_queue: queue.Queue,
+                            running):
+        """
+        same as __run__ but for the ReaderEngine's event loop: the port is opened
+        non-blocking and its file descriptor is watched by the loop, so reads
+        only happen when there is data. Platforms which can't watch a serial
+        port (Windows) poll it every ASYNC_POLL_INTERVAL instead
+        """
+        port = self.open_session(timeout=0)
+        if port is None:
             return
 
+        pipeline = self.session_pipeline(message_queue)
+        loop = asyncio.get_running_loop()
+        data_ready = asyncio.Event()
+        watching = False
 
-        # Open binary file for direct data backup
-        if tlm_file is None and self.filename is not None: # tlm file isn't open but user has added backup file during running
-            try:
-                tlm_file = open(self.filename, 'wb')
+        try:
+            loop.add_reader(port.fileno(), data_ready.set)
+            watching = True
+        except (NotImplementedError, AttributeError, OSError):
+            print(f"Polling serial port: {self.serial_port}")
 
-            except Exception as error:
-                print(f"Couldn't open file {self.filename}")
-                tlm_file = None
-            else:
-                print(f"Open TLM file for writing backup to: {self.filename}")
+        try:
+            while running.is_set():
+                if watching:
+                    await data_ready.wait()
+                    data_ready.clear()
+                else:
+                    await asyncio.sleep(ASYNC_POLL_INTERVAL)
 
+                try:
+                    raw_buffer = port.read(port.in_waiting)
+                except Exception as error:
+                    print(f"Error reading from port: {self.serial_port}, disconnecting\n{str(error)}")
+                    break
 
-        # Open human-readable CSV file for backup
-        if csv_file is None and self.filename is not None: # csv file isn't open but user has added backup file during running
-            try:
-                csv_filename = os.path.splitext(self.filename)[0] + CSV_EXTENSION
-                csv_file = open(csv_filename, 'wt')
+                if raw_buffer:
+                    self.bytes_received += len(raw_buffer) # keep track of total amount of data we got since start
+                    pipeline.run([raw_buffer])
+                    self.batcher.flush()
 
-            except Exception as error:
-                print(f"Couldn't open file {csv_filename}")
-                csv_file = None
-            else:
-                print(f"Open CSV file for writing backup to: {csv_filename}")
+        finally:
+            if watching:
+                loop.remove_reader(port.fileno())
+            await run_blocking(self.close_session, port) # waits for the backup files
+            running.clear()
 
-        while self.running.is_set():
-            telemetry_bytes = None
-            buffer = None
-            buffer_length = 0
 
-            # Read from serial port
-            # ---------------------
+    def open_session(self, timeout):
+        """
+        opens the serial port and the backup files, returns the port (None if it couldn't be opened)
+        """
+        assert self.serial_port is not None
+        assert self.serial_port != ""
 
-            try:
-                raw_buffer = self.read(port)
-            except Exception as error:
-                print(f"Error reading from port: {self.serial_port}, disconnecting\n{str(error)}")
-                break
+        port = self.open_port(self.serial_port, timeout)
+        if port is None:
+            return None
 
-            buffer_length = len(raw_buffer)
+        self.open_backups()
+        return port
 
-            if buffer_length == 0:
-                sleep(SERIAL_READ_INTERVAL)
-                continue
-            else:
-                self.bytes_received += buffer_length # keep track of total amount of data we got since start
 
+    def open_port(self, serial_port: str, timeout):
+        try:
+            port = serial.Serial(port=serial_port,
+                                 baudrate=self.baud_rate,
+                                 timeout=timeout)
+            print(f"Successfully opened port {serial_port}")
+        except Exception as error:
+            print(f"Could not open serial port: {serial_port}\n{str(error)}")
+            return None
 
-            # Decode COBS/R (Consistent-Overhead Byte-Stuffing/Reduced [Packet synchronization])
-            # -------------
-            try:
-                buffer = cobsr.decode(raw_buffer[:-SYNC_WORD_LENGTH])
-            except cobsr.DecodeError as error: # technically should never happen...
-                self.bad_bytes_received += buffer_length
-                print(f"COBS error: 0x00 found in data stream") # for debug
-                print(f"{buffer_length:>6} raw bytes: {raw_buffer.hex(' ')}  ({self.bad_bytes_received} bad bytes so far)") # for debug
+        return port
 
-            if self.print_received:
-                print(f"{len(buffer):>6} bytes: {buffer.hex(' ')}  ({self.bytes_received} bytes total)") # for debug
 
-            # if we have an open TLM file then write the raw data into it
-            # (we always write TLM data even if it is bad - for future debug)
-            if tlm_file is not None:
-                self.safe_write(tlm_file, self.filename, raw_buffer)
+    def open_backups(self) -> None:
+        """
+        opens the backup files, which are then written by a BackupWriter
+        thread so the read loop never waits for the disk
+        """
+        self.tlm_file = None
+        self.tlm_writer = None
+        self.csv_file = None
+        self.csv_writer = None
+        self.backup_writer = BackupWriter(self.flush_interval, self.flush_bytes, self.fsync_interval)
 
+        if self.filename is not None:
+            # binary file for direct data backup
+            (self.tlm_file, self.tlm_writer) = self.open_tlm_backup(self.filename)
 
-            # CRC32 check
-            # -----------
-            if self.use_crc32:
-                received_crc32 = buffer[-CHECKSUM_LENGTH:]
-                telemetry_bytes = buffer[:-CHECKSUM_LENGTH]
-                calculated_crc32 = int.to_bytes(crc32(telemetry_bytes), CHECKSUM_LENGTH)
+            # human-readable CSV file for backup
+            self.open_csv_backup(os.path.splitext(self.filename)[0] + CSV_EXTENSION)
 
-                if received_crc32 != calculated_crc32:
-                    self.bad_packets_received += 1
-                    self.bad_bytes_received += buffer_length
 
-                    print(f"CRC32 error: calculated checksum {calculated_crc32.hex()} but expected {received_crc32.hex()}") # for debug
-                    print(f"{buffer_length:>6} bytes: {buffer.hex(' ')}  ({self.bad_bytes_received} bad bytes so far)") # for debug
-                    continue
+    def open_tlm_backup(self, filename: str) -> tuple:
+        """
+        opens a TLM backup file with the backup writer, returns (file, TlmWriter) or (None, None)
+        """
+        try:
+            tlm_file = self.backup_writer.add(open(filename, 'wb'), filename)
+            tlm_writer = TlmWriter(tlm_file, monotonic()) # version 2: with receive times and index
 
-            else:
-                telemetry_bytes = buffer
+        except Exception as error:
+            print(f"Couldn't open file {filename}")
+            return (None, None)
 
+        print(f"Open TLM file for writing backup to: {filename}")
+        return (tlm_file, tlm_writer)
 
-            # Packet decoding
-            # ---------------
-            received_telemetry = {}
-            received_telemetry_messages = []
 
-            try:
-                received_telemetry_messages = self.decoder.decode(telemetry_bytes)
-            except Exception as error:
-                print(f"Error decoding data from: {self.serial_port}\n{str(error)}")
-                self.bad_packets_received += 1
-                self.bad_bytes_received += buffer_length
-                continue
+    def open_csv_backup(self, csv_filename: str) -> None:
+        try:
+            self.csv_file = self.backup_writer.add(open(csv_filename, 'wb'), csv_filename, text=True)
+
+        except Exception as error:
+            print(f"Couldn't open file {csv_filename}")
+            self.csv_file = None
+        else:
+            print(f"Open CSV file for writing backup to: {csv_filename}")
+            self.csv_writer = CsvBackupWriter(self.csv_file, csv_filename, self.decoder.layout)
 
 
-            # Packet merging
-            # --------------
-            # INFLIGHT packets can have multiple payloads (4 telemetry payloads + metadata) for now we just merge them to one
-            if received_telemetry_messages:
-                for message in received_telemetry_messages:
-                    self.messages_decoded += 1
-                    # when in flight we just send last of 4 packets to UI to save time updating:
-                    received_telemetry |= message # merge telemetry dicts together
+    def session_pipeline(self, message_queue: queue.Queue) -> Pipeline:
+        """
+        pipeline for the session: TLM backup after framing, CSV backup and UI queue at the end
+        """
+        return self.build_pipeline(self.sender(message_queue), self.backup)
 
 
-            # Apply modifiers
-            # ---------------
-            # (like accel * ACCEL_MULTIPLIER)
-            try:
-                received_telemetry = self.decoder.apply_modifiers(received_telemetry)
-            except Exception as error:
-                print(f"Error applying modifers to telemetry data received from: {self.serial_port}\n{str(error)}")
-
-
-            # CSV file writing
-            # ----------------
-            # if there is open csv_file then write
-            if received_telemetry and csv_file is not None:
-                """
-                CSV files have quite complex behaviour, to try to simulate the CSV file recorded by groundstation
-                 - there should only be 1 preflight message (but FC can go PRE->FlIGHT->PRE many times during setup)
-                 - i.e. it is possible to go FLIGHT->PREFLIGHT so need to handle this
-                 - there should only be 1 postflight message (but we may receive more than this, and dont know which is last)
-                 - should not allow POSTFLIGHT->FLIGHT
-                 - file should be flushed regularly to ensure it is write to disk
-                This code would make better sense as a state machine with transition
-                functions, but for now I just use elif cases
-                """
-
-                # First take a copy of received telemetry in case we change it for the file
-                # (and don't want to send these changes to UI)
-                csv_telemetry = received_telemetry.copy()
-
-                # Always add date and time info to PREFLIGHT packets
-                if self.decoder.state == DecoderState.PREFLIGHT:
-                    csv_telemetry["date"] = datetime.date.today().isoformat()
-                    csv_telemetry["time"] = time.strftime(TIME_FORMAT)
-                    preflight_timestamp = monotonic()
-
-                # Add elapsed timer to inflight packets (for debug and playback)
-                if self.decoder.state == DecoderState.INFLIGHT:
-                    csv_telemetry["elapsed"] = ELAPSED_FORMAT.format(monotonic() - preflight_timestamp)
-
-                # State transitions
-                # -----------------
-                # 1. OFFLINE -> PREFLIGHT
-                if previous_decoder_state == DecoderState.OFFLINE and \
-                   self.decoder.state     == DecoderState.PREFLIGHT:
-                    # Set file state to PREFLIGHT
-                    csv_saving_state = DecoderState.PREFLIGHT
-
-                    # Record file header (PREFLIGHT keys + date and time)
-                    self.safe_write(csv_file,
-                                    csv_filename,
-                                    self.csv_format(csv_telemetry.keys()))
-
-                    # Record position of start of PREFLIGHT packet:
-                    preflight_start_position = csv_file.tell()
-
-                # 2. PREFLIGHT -> PREFLIGHT
-                elif previous_decoder_state == DecoderState.PREFLIGHT and \
-                     self.decoder.state     == DecoderState.PREFLIGHT:
-                    # If we have not yet seen any FLIGHT data but already saw PREFLIGHT data...
-                    if csv_saving_state == DecoderState.PREFLIGHT:
-                        # then we go back to start of PREFLIGHT packet and erase
-                        try:
-                            csv_file.seek(preflight_start_position)
-                            csv_file.truncate()
-                        except Exception as error:
-                            print(f"Error seeking/truncating {csv_filename}:\n{error}")
-
-                # 3. PREFLIGHT -> INFLIGHT
-                elif previous_decoder_state == DecoderState.PREFLIGHT and \
-                     self.decoder.state     == DecoderState.INFLIGHT:
-                    # if this is the first time we see this transition, move to FLIGHT writer state...
-                    if csv_saving_state == DecoderState.PREFLIGHT:
-                        # ... set the writer state to FLIGHT and ...
-                        csv_saving_state = DecoderState.INFLIGHT
-                        # ...write the FLIGHT data headers:
-                        self.safe_write(csv_file,
-                                        csv_filename,
-                                        inflight_header)
-
-                # 4. INFLIGHT -> POSTFLIGHT: write postflight header
-                elif previous_decoder_state == DecoderState.INFLIGHT and \
-                     self.decoder.state     == DecoderState.POSTFLIGHT:
-
-                    if csv_saving_state == DecoderState.INFLIGHT:
-                        csv_saving_state = DecoderState.POSTFLIGHT
-                        self.safe_write(csv_file,
-                                        csv_filename,
-                                        postflight_header) # write postflight header then...
-                        # store start of postflight data for use later:
-                        postflight_start_position = csv_file.tell()
-
-                # 5. POSTFLIGHT -> POSTFLIGHT: overwrite last postflight message
-                elif previous_decoder_state == DecoderState.POSTFLIGHT and \
-                     self.decoder.state     == DecoderState.POSTFLIGHT:
-                    try:
-                        if postflight_start_position != 0: # don't let erroneous postflight packet wipe whole file
-                            csv_file.seek(postflight_start_position)
-                            csv_file.truncate()
-                    except Exception as error:
-                        print(f"Error seeking/truncating {csv_filename}:\n{error}")
-
-                # Only if we are receiving the packets we expect, write to file:
-                if self.decoder.state == csv_saving_state:
-                    self.safe_write(csv_file,
-                                    csv_filename,
-                                    self.csv_format(csv_telemetry.values()))
-
-                # Finely store old state
-                previous_decoder_state = self.decoder.state
-
-
-            # Add float strings
-            # -----------------
-            # should be done in UI really, but tkinter cannot apply format to variables easily
-            # (this operator: |= merges 2 dicts and saves in left-side)
-            try:
-                received_telemetry |= self.decoder.generate_float_strings(received_telemetry)
-            except Exception as error:
-                print(f"Error generating float strings for telemetry data received from: {self.serial_port}\n{str(error)}")
+    def backup(self, frame: Frame) -> None:
+        if self.print_received:
+            print(f"{len(frame.raw):>6} raw bytes: {frame.raw.hex(' ')}  ({self.bytes_received} bytes total)") # for debug
 
+        # if we have an open TLM file then write the raw data into it
+        # (we always write TLM data even if it is bad - for future debug)
+        if self.tlm_writer is not None:
+            self.tlm_writer.write_frame(frame.raw, frame.received or monotonic()) # only queued for the backup writer
 
-            # Add turns and bound roll
-            # ------------------------
-            if self.decoder.state == DecoderState.INFLIGHT:
-                try:
-                    received_telemetry |= self.decoder.generate_roll_turns(received_telemetry)
-                except Exception as error:
-                    print(f"Error generating roll turns for telemetry data received from: {self.serial_port}\n{str(error)}")
 
+    def sender(self, message_queue: queue.Queue):
+        """
+        sink for the pipeline: adds each frame to the session's MessageBatcher,
+        which the read loop flushes to the UI queue after every read
+        """
+        batcher = self.batcher = MessageBatcher(message_queue)
 
-            # Add name strings
-            # ----------------
-            # add additional string names for UI representation (e.g. event number -> event name)
-            try:
-                received_telemetry |= self.decoder.generate_name_strings(received_telemetry)
-            except Exception as error:
-                print(f"Error generating name strings for telemetry data received from: {self.serial_port}\n{str(error)}")
+        def send(frame: Frame) -> None:
+            if frame.packets:
+                self.messages_decoded += len(frame.packets)
+
+            if frame.telemetry and self.csv_writer is not None:
+                self.csv_writer.write(frame)
 
+            if self.tlm_writer is not None:
+                self.tlm_writer.note_packet_number(frame.telemetry.get(PACKET_NUMBER_KEY)) # for the TLM index
 
-            # Send to UI
-            # ----------
-            # add merged dict to queue for UI:
-            message_queue.put(Message(received_telemetry, # the telemetry dictionarie modify for UI display
-                                      self.decoder.state, # current decoder state (PRE/INFLIGHT/POST)
-                                      monotonic(),
-                                      buffer_length)) # current time in float seconds. monotonic() is not affected by time/date/zone changes
+            # add merged dict to the batch for UI:
+            batcher.add(frame.telemetry, # the telemetry dictionarie modify for UI display
+                        frame.state, # current decoder state (PRE/INFLIGHT/POST)
+                        len(frame.raw),
+                        frame.samples) # every in-flight sample (full-rate mode only)
+        return send
 
 
+    def close_session(self, port) -> None:
         # after ending serial port reading we must clean up:
-        if tlm_file is not None:
-            tlm_file.close()
+        if self.batcher is not None:
+            self.batcher.flush()
+
+        if self.tlm_writer is not None:
+            self.tlm_writer.close() # writes the index and summary
+            self.tlm_writer = None
 
-        if csv_file is not None:
-            csv_file.close()
+        if self.tlm_file is not None:
+            self.tlm_file.close()
+            self.tlm_file = None
+
+        if self.csv_writer is not None:
+            self.csv_writer.close() # writes the pending row
+
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+            self.csv_writer = None
+
+        if self.backup_writer is not None:
+            self.backup_writer.close() # waits for the files to be written
+            if self.backup_writer.bytes_written:
+                print(self.backup_writer.report())
+            self.backup_writer = None
 
         if port is not None:
             port.close()
 
-        running.clear()
 
+    def read_chunks(self, port):
+        """
+        source for the pipeline: yields whatever each read from the serial port returns
+        (reads block until data arrives or the port timeout, so there is no need to sleep)
+        """
+        while self.running.is_set():
+            self.batcher.flush() # everything decoded from the last read goes to the UI at once
 
-    def safe_write(self, file, filename, data):
-        try:
-            file.write(data)
-            file.flush()
-        except Exception as error:
-            print(f"Error writing to file {filename}:\n{error}")
+            try:
+                raw_buffer = self.read(port)
+            except Exception as error:
+                print(f"Error reading from port: {self.serial_port}, disconnecting\n{str(error)}")
+                return
 
+            if len(raw_buffer) == 0:
+                continue
 
-    def csv_format(self, values: list):
-        return ",".join(map(str,values)) + "\n"
+            self.bytes_received += len(raw_buffer) # keep track of total amount of data we got since start
+            yield raw_buffer
 
 
     def available_ports(self) -> list:
@@ -438,19 +771,318 @@ class RadioTelemetryReader(TelemetrySerialReader):
     def __init__(self, *kargs) -> None:
         TelemetrySerialReader.__init__(self, *kargs)
         self.decoder = RadioTelemetryDecoder()
-        self.read = lambda port: serial.Serial.read_until(port,
-                                                          SYNC_WORD,
-                                                          MAX_PACKET_LENGTH)
+        self.read = self.read_waiting
+
+    @staticmethod
+    def read_waiting(port) -> bytes:
+        """
+        reads everything waiting in the port's input buffer in one call (often
+        several packets), or waits for the first byte if nothing is waiting.
+        Frames are split out of the reads by the pipeline's FramingStage
+        """
+        return port.read(max(1, port.in_waiting))
 
 
 class SDCardSerialReader(TelemetrySerialReader):
     """
     Class for reading Flight Computer SD-Card-style telemetry over a serial port
+
+    The telemetry is text, one row per line, so it goes through its own
+    pipeline (lines -> decode) instead of the radio one. The backup is the
+    lines as they arrived, in the SD-card CSV format, so it can be replayed
+    with the SDCardFileReader (there is no TLM file, and no radio CSV backup)
     """
     def __init__(self, *kargs) -> None:
         TelemetrySerialReader.__init__(self, *kargs)
         self.decoder = SDCardTelemetryDecoder()
-        self.read = serial.Serial.readline
+        self.read = RadioTelemetryReader.read_waiting # split into lines by the pipeline
+        self.filename = os.path.splitext(self.filename)[0] + CSV_EXTENSION
+
+    def build_pipeline(self, sink, backup = None) -> Pipeline:
+        """
+        builds the line pipeline (lines -> decode) ending in sink(frame).
+        backup(frame) is called for every line, straight after framing
+        """
+        stages = line_stages(self.decoder)
+
+        if backup is not None:
+            stages.insert(1, TapStage(backup, "backup"))
+
+        stages.append(SinkStage(sink))
+
+        self.pipeline = Pipeline(stages, on_error=self.frame_error)
+        return self.pipeline
+
+    def open_backups(self) -> None:
+        """
+        opens the CSV backup file, which the lines are written to as they are
+        """
+        self.tlm_file = None
+        self.tlm_writer = None
+        self.csv_file = None
+        self.csv_writer = None
+        self.backup_writer = BackupWriter(self.flush_interval, self.flush_bytes, self.fsync_interval)
+
+        if self.filename is not None:
+            try:
+                self.csv_file = self.backup_writer.add(open(self.filename, 'wb'), self.filename)
+
+            except Exception as error:
+                print(f"Couldn't open file {self.filename}")
+                self.csv_file = None
+            else:
+                print(f"Open CSV file for writing backup to: {self.filename}")
+
+    def backup(self, frame: Frame) -> None:
+        if self.print_received:
+            print(f"{len(frame.raw):>6} raw bytes: {frame.raw!r}  ({self.bytes_received} bytes total)") # for debug
+
+        if self.csv_file is not None:
+            self.csv_file.write(frame.raw) # only queued for the backup writer
+
+    def sender(self, message_queue: queue.Queue):
+        send = TelemetrySerialReader.sender(self, message_queue)
+
+        def send_line(frame: Frame) -> None:
+            self.messages_decoded += 1
+            send(frame)
+        return send_line
+
+
+class Receiver(object):
+    """
+    One radio receiver of a DiversityReader: its port, its TLM backup and the
+    stages which take its raw bytes as far as a CRC checked frame
+    """
+    def __init__(self, serial_port: str, port, pipeline: Pipeline = None) -> None:
+        self.serial_port = serial_port
+        self.port = port
+        self.pipeline = pipeline
+        self.tlm_file = None
+        self.tlm_writer = None
+
+    @property
+    def bad_frames(self) -> int:
+        return sum(stage.errors for stage in self.pipeline.stages)
+
+
+class DiversityReader(TelemetrySerialReader):
+    """
+    Combines several radio receivers listening to the same Flight Computer
+    (e.g. ground radios at different spots) into one stream of telemetry.
+
+    Each receiver has its own framing -> backup -> COBS/R -> CRC32 stages:
+    everything it receives, good or bad, goes to its own TLM backup (named
+    after the port, see receiver_filename()), and a copy which fails CRC is
+    dropped there. Good frames go through one DedupStage which keeps the
+    first copy of every packet, and only then through the shared decode ->
+    enrich -> CSV backup and UI stages, so extra receivers add no UI work.
+    Per-receiver loss and latency are in receiver_report()
+    """
+    def __init__(self,
+                 queue: queue.Queue = None,
+                 serial_ports: list = (),
+                 baud_rate = TelemetrySerialReader.DEFAULT_BAUD,
+                 timeout = TelemetrySerialReader.DEFAULT_TIMEOUT) -> None:
+
+        TelemetrySerialReader.__init__(self, queue, None, baud_rate, timeout)
+        self.serial_ports = list(serial_ports)
+        self.decoder = RadioTelemetryDecoder()
+        self.receivers = []
+        self.dedup = None
+
+    def __run__(self, message_queue, running) -> None:
+        merged = self.open_receivers(message_queue)
+        if merged is None:
+            return
+
+        while running.is_set() and self.receivers:
+            got_data = False
+
+            for receiver in list(self.receivers):
+                got_data |= self.read_receiver(receiver, merged)
+
+            if not got_data:
+                sleep(ASYNC_POLL_INTERVAL)
+
+        self.close_receivers()
+        running.clear()
+
+    async def __run_async__(self, message_queue, running) -> None:
+        merged = self.open_receivers(message_queue)
+        if merged is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        watched = []
+
+        try:
+            for receiver in self.receivers:
+                try:
+                    loop.add_reader(receiver.port.fileno(), self.read_receiver, receiver, merged)
+                    watched.append(receiver.port.fileno())
+                except (NotImplementedError, AttributeError, OSError):
+                    for fileno in watched: # so the ports already watched aren't read twice
+                        loop.remove_reader(fileno)
+                    watched = None
+                    print(f"Polling serial ports: {', '.join(self.serial_ports)}")
+                    break
+
+            while running.is_set() and self.receivers:
+                if watched is None: # can't watch serial ports on this platform
+                    for receiver in list(self.receivers):
+                        self.read_receiver(receiver, merged)
+                await asyncio.sleep(ASYNC_POLL_INTERVAL)
+
+        finally:
+            for fileno in watched or []:
+                loop.remove_reader(fileno)
+            await run_blocking(self.close_receivers) # waits for the backup files
+            running.clear()
+
+    def open_receivers(self, message_queue) -> Pipeline | None:
+        """
+        opens every port (ports which can't be opened are left out) and the
+        backups, returns the merged pipeline (None if no port could be opened)
+        """
+        self.receivers = []
+
+        for serial_port in self.serial_ports:
+            port = self.open_port(serial_port, 0)
+            if port is not None:
+                self.receivers.append(Receiver(serial_port, port))
+
+        if not self.receivers:
+            return None
+
+        self.open_backups()
+
+        for receiver in self.receivers:
+            receiver.pipeline = self.receiver_pipeline(receiver)
+
+        self.dedup = DedupStage(self.decoder)
+        self.pipeline = Pipeline([self.dedup,
+                                  DecodeStage(self.decoder),
+                                  EnrichStage(self.decoder, lambda: self.full_rate),
+                                  SinkStage(self.sender(message_queue))],
+                                 on_error=self.frame_error)
+        return self.pipeline
+
+    def open_backups(self) -> None:
+        """
+        opens a TLM backup per receiver, and the CSV backup of the merged stream
+        """
+        self.tlm_file = None
+        self.tlm_writer = None
+        self.csv_file = None
+        self.csv_writer = None
+        self.backup_writer = BackupWriter(self.flush_interval, self.flush_bytes, self.fsync_interval)
+
+        if self.filename is not None:
+            for receiver in self.receivers:
+                (receiver.tlm_file, receiver.tlm_writer) = self.open_tlm_backup(self.receiver_filename(receiver.serial_port))
+
+            self.open_csv_backup(os.path.splitext(self.filename)[0] + CSV_EXTENSION)
+
+    def receiver_filename(self, serial_port: str) -> str:
+        """
+        TLM backup of one receiver: the backup filename with the port's name
+        added (e.g. backup_ttyUSB0.tlm)
+        """
+        (root, extension) = os.path.splitext(self.filename)
+        return f"{root}_{os.path.basename(serial_port)}{extension}"
+
+    def receiver_pipeline(self, receiver: Receiver) -> Pipeline:
+        serial_port = receiver.serial_port
+        tlm_writer = receiver.tlm_writer
+
+        def tag(frame: Frame) -> None:
+            frame.source = serial_port
+            frame.received = monotonic()
+
+        def backup(frame: Frame) -> None:
+            if self.print_received:
+                print(f"{serial_port}: {len(frame.raw):>6} raw bytes: {frame.raw.hex(' ')}") # for debug
+
+            # every frame, even bad ones (for future debug)
+            tlm_writer.write_frame(frame.raw, frame.received) # only queued for the backup writer
+
+        def note_packet_number(frame: Frame) -> None:
+            # for the TLM index: read from the packet, as only the first copy gets decoded
+            tlm_writer.note_packet_number(self.decoder.packet_number(frame.telemetry_bytes))
+
+        stages = [FramingStage(),
+                  TapStage(tag, "receiver"),
+                  CobsStage(),
+                  CrcStage(self.use_crc32)]
+
+        if tlm_writer is not None:
+            stages.insert(2, TapStage(backup, "backup"))
+            stages.append(TapStage(note_packet_number, "index"))
+
+        return Pipeline(stages, on_error=self.frame_error)
+
+    def read_receiver(self, receiver: Receiver, merged: Pipeline) -> bool:
+        """
+        reads whatever is waiting on one receiver's port and pushes its good
+        frames into the merged pipeline. Returns True if there was any data
+        """
+        try:
+            raw_buffer = receiver.port.read(receiver.port.in_waiting)
+        except Exception as error:
+            print(f"Error reading from port: {receiver.serial_port}, disconnecting it\n{str(error)}")
+            self.close_receiver(receiver)
+            return False
+
+        if not raw_buffer:
+            return False
+
+        self.bytes_received += len(raw_buffer)
+        merged.run(receiver.pipeline.frames([raw_buffer]))
+        self.batcher.flush()
+        return True
+
+    def close_receiver(self, receiver: Receiver) -> None:
+        try:
+            asyncio.get_running_loop().remove_reader(receiver.port.fileno())
+        except Exception:
+            pass # not running on an event loop, or port wasn't watched
+        receiver.port.close()
+        self.receivers.remove(receiver)
+
+        if receiver.tlm_writer is not None:
+            receiver.tlm_writer.close() # writes the index and summary
+            receiver.tlm_file.close() # once written (doesn't wait)
+            receiver.tlm_writer = None
+            receiver.tlm_file = None
+
+    def close_receivers(self) -> None:
+        print(self.receiver_report())
+
+        for receiver in list(self.receivers):
+            self.close_receiver(receiver)
+
+        self.close_session(None)
+
+    def receiver_report(self) -> str:
+        """
+        per receiver: good and bad frames, how often it was first, packets it
+        missed (loss) and how far behind the first copy its copies arrived
+        """
+        if self.dedup is None:
+            return ""
+
+        total = self.dedup.frames_out # packets in the merged stream
+        lines = [f"{total} packets from {len(self.dedup.receivers)} receivers:"]
+
+        for (name, stats) in self.dedup.receivers.items():
+            loss = 100 * (1 - stats.frames / total) if total else 0
+            latency = 1000 * stats.latency / stats.duplicates if stats.duplicates else 0
+            bad = next((receiver.bad_frames for receiver in self.receivers if receiver.serial_port == name), 0)
+            lines.append(f"  {name:<16} good: {stats.frames:>7} bad: {bad:>5} first: {stats.first:>7}"
+                         f"   loss: {loss:5.1f}%   latency: {latency:6.1f}ms behind first copy")
+
+        return "\n".join(lines)
 
 
 class SDCardFileReader(TelemetryReader):
@@ -462,6 +1094,7 @@ class SDCardFileReader(TelemetryReader):
         TelemetryReader.__init__(self, queue)
         self.filename = None
         self.decoder = SDCardTelemetryDecoder()
+        self.playback = PlaybackController()
 
     def __run__(self, message_queue, running) -> None:
 
@@ -469,30 +1102,29 @@ class SDCardFileReader(TelemetryReader):
 
         print(f"Reading telemetry file {self.filename}")
 
-        last_timestamp = 0
-
         try:
-            with open(self.filename, 'rt') as telemetry_file:
-                for line in telemetry_file:
-                    if not running.is_set():
-                        return
-                    self.bytes_received += len(line)
-                    self.messages_decoded += 1
+            with open(self.filename, 'rb') as telemetry_file:
+                for _ in self.read_lines(telemetry_file, message_queue, running):
+                    self.playback.wait(running)
 
-                    telemetry_dict = self.decoder.decode(line)
+        except IOError:
+            print(f"Cannot read file: {self.filename}")
 
-                    if telemetry_dict is None:
-                        continue
+        finally:
+            running.clear()
+
+        print(f"Finished reading file {self.filename}")
 
-                    message_queue.put(Message(telemetry_dict,
-                                            self.decoder.state,
-                                            monotonic(),
-                                            len(line)))
+    async def __run_async__(self, message_queue, running) -> None:
 
-                    if "time" in telemetry_dict:
-                        timestamp = float(telemetry_dict["time"])
-                        sleep(timestamp - last_timestamp)
-                        last_timestamp = timestamp
+        assert self.filename is not None
+
+        print(f"Reading telemetry file {self.filename}")
+
+        try:
+            with open(self.filename, 'rb') as telemetry_file:
+                for _ in self.read_lines(telemetry_file, message_queue, running):
+                    await self.playback.wait_async(running)
 
         except IOError:
             print(f"Cannot read file: {self.filename}")
@@ -502,12 +1134,150 @@ class SDCardFileReader(TelemetryReader):
 
         print(f"Finished reading file {self.filename}")
 
+    def read_lines(self, telemetry_file, message_queue, running):
+        """
+        decodes the file (opened in binary mode) line by line and sends each
+        message to the queue, yielding whenever the playback controller says
+        the next line isn't due yet (to replay at flight speed): every line
+        due by then goes to the UI as one batch first. After a seek, carries
+        on from the index mark, starting with the key row it needs
+        """
+        batcher = self.batcher = MessageBatcher(message_queue)
+        playback = self.playback
+        playback.open(self.filename, lambda: self.build_index(self.filename))
+        mark = None
+
+        while True:
+            if mark is not None and mark.header is not None:
+                telemetry_file.seek(mark.header)
+                header = io.TextIOWrapper(telemetry_file)
+                self.decoder.decode(header.readline())
+                header.detach()
+
+            telemetry_file.seek(0 if mark is None else mark.offset)
+            lines = io.TextIOWrapper(telemetry_file)
+            last_timestamp = 0 if mark is None else None # no delay before the first row after a seek
+            mark = None
+
+            for line in lines:
+                if not running.is_set():
+                    break
+
+                self.bytes_received += len(line)
+                self.messages_decoded += 1
+
+                telemetry_dict = self.decoder.decode(line)
+
+                if telemetry_dict is None:
+                    continue
+
+                # timestamps go backwards between flights: no delay there
+                if "time" in telemetry_dict:
+                    timestamp = float(telemetry_dict["time"])
+                    delay = 0.0 if last_timestamp is None else max(0.0, timestamp - last_timestamp)
+                    last_timestamp = timestamp
+                else:
+                    delay = 0
+
+                if playback.due(delay):
+                    batcher.flush()
+                    yield
+                    mark = playback.take_seek()
+                    if mark is not None:
+                        break
+
+                batcher.add(telemetry_dict,
+                            self.decoder.state,
+                            len(line))
+
+            lines.detach() # leaves telemetry_file open
+
+            if mark is None:
+                break
+
+        batcher.flush()
+
+    def build_index(self, filename: str) -> PlaybackIndex:
+        """
+        reads the whole file for its PlaybackIndex (on the playback index
+        thread, so with a file of its own). Only key rows and the time column
+        are looked at, the rows aren't decoded
+        """
+        index = PlaybackIndex()
+        decoder = SDCardTelemetryDecoder(self.decoder.accel_resolution)
+        encoding = locale.getpreferredencoding(False)
+        offset = 0
+        header = None # offset of the last key row
+        time_column = None
+        position = 0.0
+        last_timestamp = 0
+
+        with open(filename, 'rb') as telemetry_file:
+            for raw in telemetry_file:
+                line = raw.decode(encoding, errors="replace")
+                items = line.split(",")
+
+                if len(items) >= 2:
+                    value_row = decoder.state == DecoderState.INFLIGHT and items[0].isnumeric()
+
+                    if not value_row and decoder.read_header(line, items) is not None:
+                        header = offset
+                        keys = decoder.header.keys
+                        time_column = keys.index("time") if "time" in keys else None
+
+                    elif time_column is not None:
+                        try:
+                            timestamp = decoder.time_modifier(items[time_column])
+                        except (ValueError, IndexError):
+                            pass
+                        else:
+                            position += max(0.0, timestamp - last_timestamp)
+                            last_timestamp = timestamp
+
+                    index.add(position, offset, decoder.state, header)
+
+                offset += len(raw)
+
+        return index
+
+
+class TlmPlaybackIndex(PlaybackIndex):
+    """
+    PlaybackIndex of a version 2 TLM file, from the index blocks in the file
+    instead of its frames: times and packet numbers are looked up with
+    TlmFile.seek_time() and seek_packet(). Events need the decoder state of
+    the frames: its marks are those of the index scanned from them, once
+    add_events() has been called (only the TlmFile's index is used, so it can
+    be closed)
+    """
+    def __init__(self, tlm: TlmFile) -> None:
+        PlaybackIndex.__init__(self)
+        self.tlm = tlm
+        self.start = tlm.first_time # frame time of the first frame, played at 0
+        self.duration = tlm.duration
+        self.complete = False
+
+    def add_events(self, events: PlaybackIndex) -> "TlmPlaybackIndex":
+        self.marks = events.marks
+        self.times = events.times
+        self.complete = True
+        return self
+
+    def at_time(self, time: float) -> PlaybackMark | None:
+        return self.mark(self.tlm.seek_time(self.start + time))
+
+    def at_packet(self, packet_number: int) -> PlaybackMark | None:
+        return self.mark(self.tlm.seek_packet(packet_number))
+
+    def mark(self, entry: TlmIndexEntry | None) -> PlaybackMark | None:
+        if entry is None:
+            return None
+        return PlaybackMark(max(0.0, entry.time - self.start), entry.offset, None)
+
 
 class BinaryFileReader(TelemetryReader):
     """
-    Class for reading TLM file backup data
-    ---
-    Todo: a lot of this is copy/paste from serial reader above and should be merged
+    Class for reading TLM file backup data, through the same pipeline as the serial reader
     """
     def __init__(self, queue: queue.Queue = None) -> None:
 
@@ -515,6 +1285,10 @@ class BinaryFileReader(TelemetryReader):
         self.filename = None
         self.decoder = RadioTelemetryDecoder()
         self.use_crc32 = True
+        self.playback = PlaybackController()
+        self.tlm = None # TlmFile being read
+        self.frame_time = None # receive time of the last frame read (version 2 files)
+        self.replay_time = None # receive time of the last frame replayed
 
     def __run__(self, message_queue, running) -> None:
 
@@ -522,124 +1296,187 @@ class BinaryFileReader(TelemetryReader):
 
         print(f"Reading binary (TLM) telemetry file {self.filename}")
 
-        last_timestamp = 0
+        pipeline = self.build_pipeline(None, self.stamp)
+        send = self.sender(message_queue)
 
         try:
             with open(self.filename, 'rb') as file:
-                raw_data = file.read()
+                for _ in self.replay(file, pipeline, send, running):
+                    self.playback.wait(running)
 
-                packets = raw_data.split(SYNC_WORD)
+        except IOError:
+            print(f"Cannot read file: {self.filename}")
 
-                for packet in packets:
-                    if not running.is_set():
-                        break
+        except TlmFormatError as error:
+            print(f"Cannot read TLM file {self.filename}: {error}")
 
-                    packet_length = len(packet)
-                    self.bytes_received += packet_length # keep track of total amount of data we got since start
+        finally:
+            self.batcher.flush()
+            running.clear()
 
-                    # Decode COBS/R (Consistent-Overhead Byte-Stuffing/Reduced [Packet synchronization])
-                    # -------------
-                    try:
-                        buffer = cobsr.decode(packet)
-                    except cobsr.DecodeError as error: # technically should never happen...
-                        self.bad_bytes_received += packet_length
-                        print(f"COBS error: 0x00 found in data stream") # for debug
-                        print(f"{packet_length:>6} raw bytes: {packet.hex(' ')}  ({self.bad_bytes_received} bad bytes so far)") # for debug
+        print(f"Finished reading TLM file {self.filename}")
+
+    async def __run_async__(self, message_queue, running) -> None:
 
-                    # CRC32 check
-                    # -----------
-                    if self.use_crc32:
-                        received_crc32 = buffer[-CHECKSUM_LENGTH:]
-                        telemetry_bytes = buffer[:-CHECKSUM_LENGTH]
-                        calculated_crc32 = int.to_bytes(crc32(telemetry_bytes), CHECKSUM_LENGTH)
+        assert self.filename is not None
 
-                        if received_crc32 != calculated_crc32:
-                            self.bad_packets_received += 1
-                            self.bad_bytes_received += packet_length
+        print(f"Reading binary (TLM) telemetry file {self.filename}")
 
-                            print(f"CRC32 error: calculated checksum {calculated_crc32.hex()} but expected {received_crc32.hex()}") # for debug
-                            print(f"{packet_length:>6} bytes: {buffer.hex(' ')}  ({self.bad_bytes_received} bad bytes so far)") # for debug
-                            continue
+        pipeline = self.build_pipeline(None, self.stamp)
+        send = self.sender(message_queue)
 
+        try:
+            with open(self.filename, 'rb') as file:
+                for _ in self.replay(file, pipeline, send, running):
+                    await self.playback.wait_async(running)
 
-                    received_telemetry_messages = []
-                    received_telemetry = {}
+        except IOError:
+            print(f"Cannot read file: {self.filename}")
 
-                    try:
-                        received_telemetry_messages = self.decoder.decode(telemetry_bytes)
-                    except Exception as error:
-                        print(f"Error decoding data\n{str(error)}")
-                        print(buffer)
+        except TlmFormatError as error:
+            print(f"Cannot read TLM file {self.filename}: {error}")
+
+        finally:
+            self.batcher.flush()
+            running.clear()
+
+        print(f"Finished reading TLM file {self.filename}")
+
+    def replay(self, file, pipeline: Pipeline, send, running):
+        """
+        plays the file through the pipeline (which has no sink), yielding
+        whenever the playback controller says the next frame isn't due yet
+        (after sending the frames due by then to the UI, as one batch). Each
+        frame goes to send(frame) once it is due, not before. After a seek,
+        carries on from the index mark
+        """
+        self.tlm = TlmFile(file)
+        playback = self.playback
+        offset = None
+
+        try:
+            # the frames are scanned on the playback index thread: version 2
+            # files can seek to times and packets from their own index until then
+            filename = self.filename
+            if self.tlm.version == 1:
+                playback.open(filename, lambda: self.build_index(filename))
+            else:
+                index = TlmPlaybackIndex(self.tlm)
+                playback.open(filename, lambda: index.add_events(self.build_index(filename)), index)
+
+            while True:
+                self.replay_time = None
+                mark = None
+                seeked = offset is not None # no delay before the first frame after a seek
+                frames = pipeline.frames(self.read_chunks(offset))
+
+                for frame in frames:
+                    if not running.is_set():
                         break
 
-                    if received_telemetry_messages:
-                        for message in received_telemetry_messages:
-                            self.messages_decoded += 1
-                            # when in flight we just send last of 4 packets to UI to save time updating:
-                            received_telemetry |= message # merge telemetry dicts together
-                        self.messages_decoded += 1
+                    delay = self.replay_delay(frame)
+                    if seeked:
+                        delay = 0.0
+                        seeked = False
 
-                    else:
-                        continue
+                    if playback.due(delay):
+                        self.batcher.flush()
+                        yield
+                        mark = playback.take_seek()
+                        if mark is not None:
+                            break
 
+                    send(frame)
 
-                    # Apply modifiers
-                    # ---------------
-                    # (like accel * ACCEL_MULTIPLIER)
-                    try:
-                        received_telemetry = self.decoder.apply_modifiers(received_telemetry)
-                    except Exception as error:
-                        print(f"Error applying modifers to telemetry data received from: {self.serial_port}\n{str(error)}")
+                frames.close()
+                if mark is None:
+                    break
+                offset = mark.offset
 
+        finally:
+            self.tlm.close()
 
-                    # Add float strings
-                    # -----------------
-                    # should be done in UI really, but tkinter cannot apply format to variables easily
-                    # (this operator: |= merges 2 dicts and saves in left-side)
-                    try:
-                        received_telemetry |= self.decoder.generate_float_strings(received_telemetry)
-                    except Exception as error:
-                        print(f"Error generating float strings for telemetry data received from: {self.serial_port}\n{str(error)}")
+    def sender(self, message_queue):
+        batcher = self.batcher = MessageBatcher(message_queue)
 
+        def send(frame: Frame) -> None:
+            if frame.packets:
+                self.messages_decoded += len(frame.packets)
 
-                    # Add turns and bound roll
-                    # ------------------------
-                    if self.decoder.state == DecoderState.INFLIGHT:
-                        try:
-                            received_telemetry |= self.decoder.generate_roll_turns(received_telemetry)
-                        except Exception as error:
-                            print(f"Error generating roll turns for telemetry data received from: {self.serial_port}\n{str(error)}")
+            batcher.add(frame.telemetry,
+                        frame.state,
+                        len(frame.raw),
+                        frame.samples)
+        return send
 
+    def stamp(self, frame: Frame) -> None:
+        # tap after framing: the frame came from the record read last
+        frame.received = self.frame_time
 
-                    # Add name strings
-                    # ----------------
-                    # add additional string names for UI representation (e.g. event number -> event name)
-                    try:
-                        received_telemetry |= self.decoder.generate_name_strings(received_telemetry)
-                    except Exception as error:
-                        print(f"Error generating name strings for telemetry data received from: {self.serial_port}\n{str(error)}")
+    def replay_delay(self, frame: Frame) -> float:
+        delay = self.frame_interval(frame.received, self.replay_time, frame.state)
+        self.replay_time = frame.received
+        return delay
 
+    @staticmethod
+    def frame_interval(received: float | None, last_received: float | None, state: DecoderState) -> float:
+        """
+        Delay to emulate packet time: the time between the frames being
+        received for version 2 files, guessed from the state for older ones
+        """
+        if received is not None:
+            return 0.0 if last_received is None else max(0.0, received - last_received)
+
+        match(state):
+            case DecoderState.PREFLIGHT:
+                return SHORT_INTERVAL
+            case DecoderState.INFLIGHT:
+                return TLM_INTERVAL
+            case DecoderState.POSTFLIGHT:
+                return SHORT_INTERVAL
+        return 0
+
+    def read_chunks(self, offset: int = None):
+        """
+        source for the pipeline: yields one frame at a time from offset (the
+        start if None), split lazily out of the memory-mapped file (for
+        version 2 files with frame_time set to when it was received)
+        """
+        self.frame_time = None
 
-                    message_queue.put(Message(received_telemetry,
-                                                self.decoder.state,
-                                                monotonic(),
-                                                packet_length))
+        for (self.frame_time, raw) in self.tlm.frames(offset):
+            self.bytes_received += len(raw)
+            yield raw
 
+    def build_index(self, filename: str) -> PlaybackIndex:
+        """
+        reads the whole file for its PlaybackIndex (on the playback index
+        thread, so with a TlmFile of its own). Frames are only COBS/R decoded
+        and checked, for the state in their event byte
+        """
+        index = PlaybackIndex()
+        event_table = self.decoder.layout.event_table
+        position = 0.0
+        last_received = None
 
-                    # Delay to emulate packet time
-                    # ----------------------------
-                    match(self.decoder.state):
-                        case DecoderState.PREFLIGHT:
-                            sleep(SHORT_INTERVAL)
-                        case DecoderState.INFLIGHT:
-                            sleep(TLM_INTERVAL)
-                        case DecoderState.POSTFLIGHT:
-                            sleep(SHORT_INTERVAL)
+        with open(filename, 'rb') as file:
+            tlm = TlmFile(file)
 
-        except IOError:
-            print(f"Cannot read file: {self.filename}")
+            try:
+                for (offset, received, raw) in tlm.frame_offsets():
+                    try:
+                        buffer = cobsr.decode(raw)
+                    except cobsr.DecodeError:
+                        continue
 
-        finally:
-            running.clear()
+                    if len(buffer) <= CHECKSUM_LENGTH or crc32(buffer[:-CHECKSUM_LENGTH]) != int.from_bytes(buffer[-CHECKSUM_LENGTH:], "big"):
+                        continue # bad frames are skipped when playing too
 
-        print(f"Finished reading TLM file {self.filename}")
+                    state = event_table[buffer[0]].state
+                    position += self.frame_interval(received, last_received, state)
+                    last_received = received
+                    index.add(position, offset, state)
+            finally:
+                tlm.close()
+
+        return index
@@ -0,0 +1,309 @@
+import struct
+from collections import namedtuple
+
+"""
+Telemetry Schemas:
+
+declarative description of the binary radio packets sent by the flight computer.
+
+Each packet type is described once, as a PacketSchema made of Fields
+(name, type, scaling) plus the event codes which select it. Everything else is
+generated from that description when the schema is created:
+  - the compiled struct.Struct and a RadioPacket record class to decode into
+  - the CSV header for backup files
+  - the NumPy dtype for bulk decoding
+  - the modifiers which turn raw values into values for the UI
+
+A RadioLayout groups the schemas of one firmware version and compiles a lookup
+table from event byte to schema, so decoding a packet is one table lookup.
+Layouts are registered by version number with register_layout()
+"""
+
+ENDIANNESS = "<"
+STRING_ENCODING = "ascii"
+STRING_DECODING_ERRORS = "ignore"
+NUM_EVENT_CODES = 256 # event is uint8_t
+
+# type name: (struct format code, numpy dtype code)
+FIELD_TYPES = {"bool":   ("?", "?"),
+               "uint8":  ("B", "u1"),
+               "int16":  ("h", "<i2"),
+               "uint16": ("H", "<u2"),
+               "float":  ("f", "<f4")}
+
+# text fields are written "char[length]"
+CHAR_TYPE_PREFIX = "char["
+
+class SchemaError(Exception):
+    pass
+
+class DecodingError(Exception):
+    pass
+
+# scale: multiply raw value by this for the UI (None to leave as it is)
+# rounded: round after scaling (for values shown as whole numbers)
+Field = namedtuple("Field", ["name", "type", "scale", "rounded"], defaults=[None, False])
+
+def text_modifier(text: bytes) -> str:
+    """
+    Removes extra or bad characters from fixed-length text fields (name, callsign)
+    """
+    return text.decode(STRING_ENCODING, errors=STRING_DECODING_ERRORS).strip().rstrip('\x00')
+
+def scale_modifier(scale: float, rounded: bool = False):
+    if rounded:
+        return lambda value: round(value * scale)
+    return lambda value: value * scale
+
+
+class RadioPacket(object):
+    """
+    Base class for binary radio packets
+
+    Each subclass describes its layout with `keys` and a struct `format`. The
+    format is compiled once into a struct.Struct when the subclass is created,
+    and a packet only keeps the tuple of unpacked values. A dict is built only
+    when a consumer asks for one with as_dict()
+
+    Use from_buffer() to unpack straight out of a bytes/memoryview buffer at
+    an offset without slicing (and so copying) it first
+    """
+    __slots__ = ("values",)
+
+    keys = []
+    format = ENDIANNESS
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls.unpacker = struct.Struct(cls.format) # compiled once per packet type
+        cls.size = cls.unpacker.size
+        cls.index = {key: i for (i, key) in enumerate(cls.keys)}
+        cls.key_tuple = tuple(cls.keys)
+
+    def __init__(self,
+                 values: tuple) -> None:
+        self.values = values
+
+    @classmethod
+    def from_buffer(cls, buffer, offset: int = 0):
+        return cls(cls.unpacker.unpack_from(buffer, offset))
+
+    def __getitem__(self, key: str):
+        return self.values[self.index[key]]
+
+    def as_dict(self) -> dict:
+        return dict(zip(self.key_tuple, self.values))
+
+
+class PacketSchema(object):
+    """
+    Describes one type of radio packet.
+
+    Packets with `metadata` are made of `samples` repeats of this schema's
+    fields followed by one copy of the metadata schema's fields (the in-flight
+    packet). samples=None means any whole number of samples, worked out from
+    the packet length.
+
+    A schema with no fields (e.g. error events) decodes to None
+    """
+
+    def __init__(self,
+                 name: str,
+                 fields: list,
+                 events = (),
+                 state = None,
+                 metadata = None,
+                 samples: int | None = 1) -> None:
+
+        self.name = name
+        self.fields = fields
+        self.events = list(events)
+        self.state = state
+        self.metadata = metadata
+        self.samples = samples
+
+        self.keys = [field.name for field in fields]
+        self.format = ENDIANNESS + "".join(self.struct_code(field) for field in fields)
+
+        self.record = type(name, (RadioPacket,), {"__slots__": (),
+                                                  "keys": self.keys,
+                                                  "format": self.format})
+        self.size = self.record.size
+
+        self.modifiers = {}
+        for field in fields:
+            if field.type.startswith(CHAR_TYPE_PREFIX):
+                self.modifiers[field.name] = text_modifier
+            elif field.scale is not None:
+                self.modifiers[field.name] = scale_modifier(field.scale, field.rounded)
+
+        self._dtype = None
+        self.decode = self.compile_decoder()
+
+    @staticmethod
+    def struct_code(field: Field) -> str:
+        if field.type.startswith(CHAR_TYPE_PREFIX):
+            return field.type[len(CHAR_TYPE_PREFIX):-1] + "s"
+        try:
+            return FIELD_TYPES[field.type][0]
+        except KeyError:
+            raise SchemaError(f"Unknown type {field.type} for field {field.name}")
+
+    @staticmethod
+    def dtype_code(field: Field) -> str:
+        if field.type.startswith(CHAR_TYPE_PREFIX):
+            return "S" + field.type[len(CHAR_TYPE_PREFIX):-1]
+        return FIELD_TYPES[field.type][1]
+
+    @property
+    def all_keys(self) -> list:
+        """
+        keys of a whole decoded packet (including metadata)
+        """
+        if self.metadata is None:
+            return self.keys
+        return self.keys + self.metadata.keys
+
+    @property
+    def dtype(self):
+        """
+        NumPy structured dtype matching the struct format (packed, little-endian)
+        numpy is only imported when this is first used
+        """
+        if self._dtype is None:
+            import numpy
+            self._dtype = numpy.dtype([(field.name, self.dtype_code(field)) for field in self.fields])
+        return self._dtype
+
+    def packet_dtype(self, samples: int = 1):
+        """
+        NumPy dtype of a whole packet: for in-flight packets this is `samples`
+        sub-arrays of samples followed by the metadata fields
+        """
+        if self.metadata is None:
+            return self.dtype
+
+        import numpy
+        return numpy.dtype([("samples", self.dtype, (samples,))] +
+                           [(name, self.metadata.dtype.fields[name][0]) for name in self.metadata.keys])
+
+    def field_reader(self, key: str):
+        """
+        returns a function which reads one field straight out of a packet of
+        this type (a memoryview) without decoding the rest of it, or None if
+        the packet has no such field. Metadata fields are read from the end
+        of the packet, so it works for any number of samples
+        """
+        for (schema, from_end) in ((self, False), (self.metadata, True)):
+            if schema is None or key not in schema.keys:
+                continue
+
+            index = schema.keys.index(key)
+            offset = struct.calcsize(ENDIANNESS + "".join(self.struct_code(field) for field in schema.fields[:index]))
+            unpacker = struct.Struct(ENDIANNESS + self.struct_code(schema.fields[index]))
+
+            if from_end:
+                offset -= schema.size
+                return lambda view: unpacker.unpack_from(view, len(view) + offset)[0]
+            return lambda view: unpacker.unpack_from(view, offset)[0]
+
+        return None
+
+    def csv_header(self, extra_keys: list = ()) -> str:
+        return ",".join(self.all_keys + list(extra_keys)) + "\n"
+
+    def compile_decoder(self):
+        """
+        returns the function used to decode a packet of this type from a
+        memoryview, picked once here so decoding doesn't need to check
+        what kind of packet it is
+        """
+        record = self.record
+        size = self.size
+        name = self.name
+
+        if not self.fields:
+            return lambda view: None
+
+        if self.metadata is None:
+            def decode_packet(view):
+                if len(view) != size:
+                    raise DecodingError(f"{name} should be {size} bytes but got {len(view)}")
+                return [record.from_buffer(view)]
+
+            return decode_packet
+
+        metadata = self.metadata.record
+        unpacker = record.unpacker
+        expected_length = None if self.samples is None else self.samples * size + metadata.size
+
+        def decode_samples(view):
+            length = len(view)
+            samples_length = length - metadata.size
+
+            if expected_length is not None and length != expected_length:
+                raise DecodingError(f"{name} should be {expected_length} bytes but got {length}")
+
+            if samples_length <= 0 or samples_length % size != 0:
+                raise DecodingError(f"{name} packet of {length} bytes does not contain whole samples")
+
+            packets = [record(values) for values in unpacker.iter_unpack(view[:samples_length])]
+            packets.append(metadata.from_buffer(view, samples_length))
+            return packets
+
+        return decode_samples
+
+
+class RadioLayout(object):
+    """
+    All packet schemas used by one version of the flight computer firmware.
+
+    Compiles an event table of NUM_EVENT_CODES entries mapping the event byte
+    (first byte of every packet) to the schema which decodes it. Events not
+    claimed by any schema are decoded with the fallback schema
+    """
+
+    def __init__(self,
+                 version: int,
+                 schemas: list,
+                 fallback: PacketSchema) -> None:
+
+        self.version = version
+        self.schemas = schemas
+        self.fallback = fallback
+
+        self.event_table = [fallback] * NUM_EVENT_CODES
+
+        for schema in schemas:
+            for event in schema.events:
+                self.event_table[event] = schema
+
+        self.modifiers = {}
+        for schema in schemas + [fallback]:
+            self.modifiers |= schema.modifiers
+            if schema.metadata is not None:
+                self.modifiers |= schema.metadata.modifiers
+
+    def schema(self, event: int) -> PacketSchema:
+        return self.event_table[event]
+
+    def schema_for_state(self, state) -> PacketSchema | None:
+        for schema in self.schemas + [self.fallback]:
+            if schema.state == state:
+                return schema
+        return None
+
+
+layouts = {} # firmware layout version: RadioLayout
+
+def register_layout(layout: RadioLayout) -> RadioLayout:
+    if layout.version in layouts:
+        raise SchemaError(f"Radio layout version {layout.version} is already registered")
+    layouts[layout.version] = layout
+    return layout
+
+def get_layout(version: int) -> RadioLayout:
+    try:
+        return layouts[version]
+    except KeyError:
+        raise SchemaError(f"No radio layout registered for firmware version {version}")